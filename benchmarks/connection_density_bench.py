@@ -0,0 +1,139 @@
+"""
+Measure server memory per idle WebSocket connection.
+
+Starts a WebSocketServer in a child process, opens --connections local client
+connections from several client processes (each connection performs the
+handshake and then idles), and reports the server's RSS growth per connection
+as JSON. Client connections are spread over 127.0.0.x source addresses so more
+than one ephemeral port range is available.
+
+Run from the repository root, for example:
+
+    CONNECTION_DENSITY_MODE=true python -m benchmarks.connection_density_bench --connections 100000
+
+Opening 100k connections needs a high open-file limit (ulimit -n) for the shell.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import resource
+import time
+
+import websockets
+
+from config import CONNECTION_DENSITY_MODE
+
+PORTS_PER_SOURCE_ADDRESS = 25_000
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def rss_bytes(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def run_server(host, port, ready):
+    raise_fd_limit()
+    from config import logger
+    from trading_view_extension.managers.session_manager import SessionManager
+    from utils.websocket import WebSocketServer
+
+    logger.disabled = True
+    server = WebSocketServer(analysis_router=None, session_manager=SessionManager())
+
+    async def serve():
+        task = asyncio.create_task(server.run(host=host, port=port))
+        await asyncio.sleep(0.5)
+        ready.set()
+        await task
+
+    asyncio.run(serve())
+
+
+def run_clients(host, port, first, count, connected, release):
+    raise_fd_limit()
+
+    async def connect(index):
+        source = f"127.0.0.{2 + index // PORTS_PER_SOURCE_ADDRESS}"
+        # Offer permessage-deflate like a browser does, so the server's choice matters
+        websocket = await websockets.connect(
+            f"ws://{host}:{port}", local_addr=(source, 0), ping_interval=None
+        )
+        await websocket.send(json.dumps({"user_id": f"user-{index}", "tab_id": f"tab-{index}"}))
+        await websocket.recv()  # "Connection established."
+        await websocket.recv()  # session id and resume token
+        return websocket
+
+    async def main():
+        connections = []
+        batch = 500
+        for start in range(first, first + count, batch):
+            stop = min(start + batch, first + count)
+            connections += await asyncio.gather(*(connect(i) for i in range(start, stop)))
+        connected.set()
+        while not release.is_set():
+            await asyncio.sleep(0.5)
+        await asyncio.gather(*(ws.close() for ws in connections), return_exceptions=True)
+
+    asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=100_000)
+    parser.add_argument("--client-processes", type=int, default=8)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18765)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    server = context.Process(target=run_server, args=(args.host, args.port, ready), daemon=True)
+    server.start()
+    ready.wait(timeout=60)
+    time.sleep(1)
+    baseline = rss_bytes(server.pid)
+
+    release = context.Event()
+    per_process = -(-args.connections // args.client_processes)
+    clients = []
+    started = time.perf_counter()
+    for first in range(0, args.connections, per_process):
+        connected = context.Event()
+        count = min(per_process, args.connections - first)
+        process = context.Process(target=run_clients,
+                                  args=(args.host, args.port, first, count, connected, release), daemon=True)
+        process.start()
+        clients.append((process, connected))
+    for process, connected in clients:
+        connected.wait()
+    connect_seconds = time.perf_counter() - started
+    time.sleep(2)  # Let the server settle after the last handshake
+    loaded = rss_bytes(server.pid)
+
+    release.set()
+    for process, _ in clients:
+        process.join(timeout=60)
+    server.terminate()
+
+    print(json.dumps({
+        "connection_density_mode": CONNECTION_DENSITY_MODE,
+        "connections": args.connections,
+        "connect_seconds": round(connect_seconds, 2),
+        "server_rss_baseline_bytes": baseline,
+        "server_rss_loaded_bytes": loaded,
+        "rss_bytes_per_connection": round((loaded - baseline) / args.connections, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Micro-benchmarks for the code that runs on every request, with regression gates.
+
+Covers frame parsing in WebSocketServer.process_binary_message, save_file, job
+construction and serialization in AnalysisTaskManager.publish_analysis_task,
+SessionManager.get_websocket with a large registry, and result decoding in
+ResponseWorker.process_completed_task. Each benchmark reports the best of
+--repeat runs in nanoseconds per operation.
+
+Run from the repository root:
+
+    python -m benchmarks.hot_paths_bench                       # print results
+    python -m benchmarks.hot_paths_bench --save-baseline       # store a baseline
+    python -m benchmarks.hot_paths_bench --compare --max-regression 0.15
+
+--compare exits with status 1 if any benchmark is slower than the baseline by more
+than --max-regression (a fraction). Baselines are machine-specific; record them
+on the machine that runs the comparison.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import struct
+import sys
+import tempfile
+import time
+import uuid
+
+from config import logger
+from trading_view_extension.managers.analysis_task_manager import AnalysisTaskManager
+from trading_view_extension.managers.session_manager import SessionManager
+from trading_view_extension.queue.sqs_queue_publisher import SQSQueuePublisher
+from trading_view_extension.workers.response_worker import ResponseWorker
+from utils.websocket import WebSocketServer
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "hot_paths.json")
+
+
+class FakeWebSocket:
+    async def send(self, message):
+        pass
+
+
+class NullSQSClient:
+    def send_message(self, **kwargs):
+        return {"MessageId": "0"}
+
+
+class NullAnalysisRouter:
+    async def create_analysis(self, data):
+        pass
+
+
+class ParseOnlyServer(WebSocketServer):
+    """
+    Skips the disk write so the parse benchmark measures parsing alone.
+    """
+    def save_file(self, metadata, binary_data):
+        return metadata.get("filename")
+
+
+def build_upload(images=3, image_bytes=200_000):
+    blob = os.urandom(image_bytes)
+    parts = []
+    for i in range(images):
+        metadata = json.dumps({
+            "user_id": "bench-user",
+            "tab_id": "bench-tab",
+            "agent": "model_a",
+            "asset": "BTCUSD",
+            "action_type": "analysis",
+            "filename": f"BTCUSD_{i}.png",
+            "blob_size": len(blob),
+        }).encode("utf-8")
+        parts += [struct.pack(">I", len(metadata)), metadata, blob]
+    return b"".join(parts)
+
+
+def best_of(repeat, operations, fn, setup=None):
+    """
+    Run fn (which performs `operations` operations) `repeat` times and return the
+    best time per operation in nanoseconds. setup, if given, runs untimed before
+    each run.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1e9 / operations
+
+
+def run_benchmarks(args):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    results = {}
+
+    # Frame parsing: a three-image upload through the full binary handler
+    session_manager = SessionManager()
+    server = ParseOnlyServer(NullAnalysisRouter(), session_manager)
+    upload = build_upload()
+    websocket = FakeWebSocket()
+
+    async def parse(n):
+        for _ in range(n):
+            await server._process_binary_message(websocket, upload)
+
+    def release_jobs():
+        # Every upload binds a new job to the session; start each run from an empty index
+        for job_id in list(session_manager.sessions_by_job):
+            session_manager.release_job(job_id)
+
+    n = args.iterations
+    results["process_binary_message"] = best_of(args.repeat, n, lambda: loop.run_until_complete(parse(n)),
+                                                setup=release_jobs)
+
+    # save_file: one 200 kB image written to a scratch upload directory
+    writer = WebSocketServer(NullAnalysisRouter(), session_manager)
+    metadata = {"user_id": "bench-user", "tab_id": "bench-tab", "filename": "BTCUSD_chart.png"}
+    image = os.urandom(200_000)
+    results["save_file"] = best_of(args.repeat, n, lambda: [writer.save_file(metadata, image) for _ in range(n)])
+
+    # Job construction and serialization on the publish path
+    task_manager = AnalysisTaskManager(SQSQueuePublisher(client=NullSQSClient()))
+    job = {
+        "asset": "BTCUSD", "user_id": "bench-user", "tab_id": "bench-tab", "job_id": str(uuid.uuid4()),
+        "s3_urls": [f"https://bucket.s3.amazonaws.com/{uuid.uuid4()}_chart_{i}.png" for i in range(3)],
+        "agent": "model_a", "action_type": "analysis", "status": "PENDING", "websocket_id": "bench-session",
+        "filenames": [f"chart_{i}.png" for i in range(3)], "file_paths": [f"uploads/chart_{i}.png" for i in range(3)],
+    }
+
+    async def publish(n):
+        for _ in range(n):
+            await task_manager.publish_analysis_task(**job)
+
+    n = args.iterations * 10
+    results["publish_analysis_task"] = best_of(args.repeat, n, lambda: loop.run_until_complete(publish(n)))
+
+    # Session lookups in a large registry
+    registry = SessionManager()
+    ids = [str(uuid.uuid4()) for _ in range(args.sessions)]
+    for i, ws_id in enumerate(ids):
+        registry.register_websocket(ws_id, FakeWebSocket(), user_id=f"user-{i // 4}", tab_id=f"tab-{i}")
+    lookups = random.Random(0).choices(ids, k=100_000)
+    results["get_websocket"] = best_of(
+        args.repeat, len(lookups), lambda: [registry.get_websocket(ws_id) for ws_id in lookups]
+    )
+
+    # Result decoding and delivery to a connected session
+    token, _ = session_manager.open_session(FakeWebSocket(), user_id="bench-user", tab_id="bench-tab")
+    worker = ResponseWorker(queue_consumer=None, session_manager=session_manager)
+    body = json.dumps(dict(job, action_type="processed", status="COMPLETED", websocket_id=token,
+                           analysis={"summary": "x" * 2_000, "signals": list(range(50))}))
+    message = {"MessageId": "bench", "Body": body}
+
+    async def decode(n):
+        for _ in range(n):
+            await worker.process_completed_task(message)
+        await asyncio.sleep(0)  # Let the session's writer drain
+
+    n = args.iterations * 10
+    results["process_completed_task"] = best_of(args.repeat, n, lambda: loop.run_until_complete(decode(n)))
+
+    for websocket_id in list(session_manager.sessions):
+        session_manager.remove_websocket(websocket_id)
+    loop.run_until_complete(asyncio.sleep(0))  # Let the stopped writers finish
+    loop.close()
+    return {name: round(ns, 1) for name, ns in results.items()}
+
+
+def compare(results, baseline, max_regression):
+    """
+    Print results against the baseline and return the names of regressed benchmarks.
+    """
+    regressions = []
+    print(f"{'benchmark':<26} {'baseline ns':>12} {'current ns':>12} {'change':>8}")
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:<26} {'-':>12} {current:>12.1f} {'new':>8}")
+            continue
+        change = current / previous - 1
+        flag = ""
+        if change > max_regression:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<26} {previous:>12.1f} {current:>12.1f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--sessions", type=int, default=100_000)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results to --baseline")
+    parser.add_argument("--compare", action="store_true", help="Compare against --baseline")
+    parser.add_argument("--max-regression", type=float, default=0.15,
+                        help="Allowed slowdown per benchmark as a fraction (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    baseline_path = os.path.abspath(args.baseline)
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)  # save_file writes under ./uploads
+        results = run_benchmarks(args)
+
+    if args.compare:
+        with open(baseline_path) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"Regressed by more than {args.max_regression:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results},
+                      f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {baseline_path}")
+
+
+if __name__ == "__main__":
+    main()
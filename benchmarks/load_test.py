@@ -0,0 +1,292 @@
+"""
+End-to-end load test of the gateway.
+
+Simulates --clients extension tabs. Each one connects, performs the handshake
+and then submits --jobs-per-client analysis jobs one after another using the
+real length-prefixed multi-image binary protocol. It waits for the
+"Server received images" acknowledgement and for the job's final result before
+thinking for --think-time seconds and submitting the next job.
+
+With --spawn-server the gateway is started as `python main.py --local`. That
+uses in-memory stand-ins for S3, SQS and Postgres and a local analysis worker
+which answers every job after --worker-latency seconds. With --result-bytes
+that worker stores each result in S3 as a report of that size and the gateway
+streams it to the client in chunks (claim-check delivery); a result then counts
+as complete when its last chunk arrives. Without --spawn-server, the test
+targets --url.
+
+The report is printed as JSON (and written to --output) so runs can be compared
+across commits. It contains submit-ack and result latency percentiles,
+throughput, rejections by code, and error and timeout counts.
+
+Run from the repository root, for example:
+
+    python -m benchmarks.load_test --spawn-server --clients 2000 --processes 4
+
+Admission control applies as in production (RATE_LIMIT_PER_USER etc.). Every
+client is a separate user, so keep --think-time above the per-user rate limit,
+or raise the limits in the environment of the spawned server.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+import websockets
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_upload(user_id, tab_id, asset, images, image_bytes, index):
+    """
+    Encode one multi-image upload: per image a 4-byte big-endian metadata length,
+    the metadata JSON, then the image bytes.
+    """
+    blob = os.urandom(image_bytes)
+    parts = []
+    for i in range(images):
+        metadata = json.dumps({
+            "user_id": user_id,
+            "tab_id": tab_id,
+            "agent": "model_a",
+            "asset": asset,
+            "action_type": "analysis",
+            "filename": f"{asset}_{index}_{i}.png",
+            "blob_size": len(blob),
+        }).encode("utf-8")
+        parts += [struct.pack(">I", len(metadata)), metadata, blob]
+    return b"".join(parts)
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+
+    def pick(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 2)
+
+    return {
+        "count": len(samples),
+        "mean": round(sum(samples) / len(samples) * 1000, 2),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": round(samples[-1] * 1000, 2),
+    }
+
+
+class ClientStats:
+    def __init__(self):
+        self.ack_latencies = []
+        self.result_latencies = []
+        self.submitted = 0
+        self.acked = 0
+        self.completed = 0
+        self.rejected = {}
+        self.errors = 0
+        self.timeouts = 0
+        self.partial_frames = 0
+        self.result_bytes = 0
+        self.connect_errors = 0
+
+    def merge(self, other: dict):
+        self.ack_latencies += other["ack_latencies"]
+        self.result_latencies += other["result_latencies"]
+        for key in ("submitted", "acked", "completed", "errors", "timeouts", "partial_frames", "result_bytes",
+                    "connect_errors"):
+            setattr(self, key, getattr(self, key) + other[key])
+        for code, count in other["rejected"].items():
+            self.rejected[code] = self.rejected.get(code, 0) + count
+
+
+async def run_client(index, args, stats: ClientStats):
+    user_id = f"load-user-{index}"
+    tab_id = f"tab-{index}"
+    asset = f"ASSET{index % args.assets}"
+    try:
+        websocket = await websockets.connect(args.url, max_size=None, ping_interval=None)
+    except Exception:
+        stats.connect_errors += 1
+        return
+    try:
+        await websocket.send(json.dumps({"user_id": user_id, "tab_id": tab_id}))
+        await websocket.recv()  # "Connection established."
+        await websocket.recv()  # session id and resume token
+        for job in range(args.jobs_per_client):
+            upload = build_upload(user_id, tab_id, asset, args.images, args.image_bytes, job)
+            started = time.perf_counter()
+            await websocket.send(upload)
+            stats.submitted += 1
+            try:
+                await asyncio.wait_for(wait_for_job(websocket, started, stats), args.result_timeout)
+            except asyncio.TimeoutError:
+                stats.timeouts += 1
+            await asyncio.sleep(args.think_time)
+    except websockets.exceptions.ConnectionClosed:
+        stats.errors += 1
+    finally:
+        await websocket.close()
+
+
+async def wait_for_job(websocket, started, stats: ClientStats):
+    """
+    Read frames until the job is acknowledged and its final result arrives, or it
+    is rejected.
+    """
+    job_id = None
+    while True:
+        frame = await websocket.recv()
+        if isinstance(frame, bytes) and job_id is not None:
+            # Claim-check chunk: 4-byte header length, header JSON, then the data
+            header_length = struct.unpack(">I", frame[:4])[0]
+            stats.result_bytes += len(frame) - 4 - header_length
+            continue
+        try:
+            data = json.loads(frame)
+        except (TypeError, ValueError):
+            data = None
+        if not isinstance(data, dict):
+            stats.errors += 1  # Plain-text "Error: ..." frames
+            return
+        if data.get("type") == "error":
+            stats.rejected[data.get("code")] = stats.rejected.get(data.get("code"), 0) + 1
+            return
+        if data.get("type") == "partial_results":
+            stats.partial_frames += 1
+            continue
+        if job_id is None and "message" in data and data.get("job_id"):
+            job_id = data["job_id"]
+            stats.acked += 1
+            stats.ack_latencies.append(time.perf_counter() - started)
+            continue
+        if job_id is not None and data.get("job_id") == job_id:
+            if (data.get("result_stream") or {}).get("streaming"):
+                continue  # The result follows in chunks, closed by "result_end"
+            stats.completed += 1
+            stats.result_latencies.append(time.perf_counter() - started)
+            return
+
+
+def run_clients(first, count, args, results):
+    async def main():
+        stats = ClientStats()
+        tasks = []
+        for index in range(first, first + count):
+            tasks.append(asyncio.create_task(run_client(index, args, stats)))
+            # Spread connections over the ramp-up period
+            await asyncio.sleep(args.ramp_up / max(1, args.clients))
+        await asyncio.gather(*tasks)
+        return stats
+
+    stats = asyncio.run(main())
+    results.put({key: value for key, value in vars(stats).items()})
+
+
+def wait_for_port(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="ws://127.0.0.1:8080")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--processes", type=int, default=4, help="Client processes")
+    parser.add_argument("--jobs-per-client", type=int, default=5)
+    parser.add_argument("--images", type=int, default=2, help="Images per upload")
+    parser.add_argument("--image-bytes", type=int, default=50_000)
+    parser.add_argument("--assets", type=int, default=20, help="Distinct assets across clients")
+    parser.add_argument("--think-time", type=float, default=2.5, help="Seconds between a result and the next job")
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="Seconds over which clients connect")
+    parser.add_argument("--result-timeout", type=float, default=60.0)
+    parser.add_argument("--spawn-server", action="store_true", help="Start `main.py --local` for the run")
+    parser.add_argument("--worker-latency", type=float, default=0.5, help="With --spawn-server")
+    parser.add_argument("--result-bytes", type=int, default=0,
+                        help="With --spawn-server: size of claim-check results (0 = inline results)")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn_server:
+        host, port = args.url.rsplit("/", 1)[-1].rsplit(":", 1)
+        env = dict(os.environ, WEBSOCKET_HOST=host, PORT=port, LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"))
+        server = subprocess.Popen(
+            [sys.executable, "main.py", "--local", "--worker-latency", str(args.worker_latency),
+             "--result-bytes", str(args.result_bytes)],
+            cwd=REPO_ROOT, env=env,
+        )
+        if not wait_for_port(host, int(port), timeout=30):
+            server.terminate()
+            sys.exit("Gateway did not start listening")
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    per_process = -(-args.clients // args.processes)
+    processes = []
+    started = time.perf_counter()
+    try:
+        for first in range(0, args.clients, per_process):
+            count = min(per_process, args.clients - first)
+            process = context.Process(target=run_clients, args=(first, count, args, results))
+            process.start()
+            processes.append(process)
+        stats = ClientStats()
+        for _ in processes:
+            stats.merge(results.get())
+        for process in processes:
+            process.join()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+    duration = time.perf_counter() - started
+
+    report = {
+        "commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "duration_s": round(duration, 2),
+        "jobs": {
+            "submitted": stats.submitted,
+            "acked": stats.acked,
+            "completed": stats.completed,
+            "rejected": stats.rejected,
+            "errors": stats.errors,
+            "timeouts": stats.timeouts,
+        },
+        "connect_errors": stats.connect_errors,
+        "partial_frames": stats.partial_frames,
+        "result_bytes": stats.result_bytes,
+        "throughput_jobs_per_s": round(stats.completed / duration, 2) if duration else 0.0,
+        "error_rate": round((stats.submitted - stats.completed) / stats.submitted, 4) if stats.submitted else 0.0,
+        "ack_latency_ms": percentiles(stats.ack_latencies),
+        "result_latency_ms": percentiles(stats.result_latencies),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
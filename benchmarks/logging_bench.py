@@ -0,0 +1,116 @@
+"""
+Per-request logging cost on the calling (event loop) thread.
+
+Replays the INFO records one analysis job produces (SQS publish, task
+published, result received, result queued) --requests times under three
+set-ups and reports the caller-side cost per request:
+
+    sync_text        FileHandler + StreamHandler on the caller's thread with
+                     f-string messages (the previous configuration)
+    async_json       utils.async_logging: queue hand-off, JSON formatted on the
+                     writer thread, lazy %-style arguments, per-call-site sampling
+    async_unsampled  the same without sampling (every record is written)
+
+The console stream goes to os.devnull and the file to a scratch directory, so
+the numbers measure the logging pipeline and not the terminal. "drain_s" is how
+long the writer thread needed afterwards to write the queued records.
+
+Run from the repository root:
+
+    python -m benchmarks.logging_bench --requests 20000
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+
+from utils.async_logging import configure_logging, stop_listener
+
+REQUEST_RECORDS = 4
+
+
+def reset_root():
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        stop_listener(handler)
+        handler.close()
+
+
+def make_handlers(directory, name):
+    return [
+        logging.FileHandler(os.path.join(directory, f"{name}.log")),
+        logging.StreamHandler(open(os.devnull, "w")),
+    ]
+
+
+def eager_request(logger, job_id, message_id, websocket_id):
+    logger.info(f"Message sent to SQS (analysis) with MessageId: {message_id}")
+    logger.info(f"Published analysis task for job {job_id}")
+    logger.info(f"Processing completed task message: {message_id}")
+    logger.info(f"Queued processed job details for WebSocket {websocket_id}")
+
+
+def lazy_request(logger, job_id, message_id, websocket_id):
+    logger.info("Message sent to SQS (%s) with MessageId: %s", "analysis", message_id)
+    logger.info("Published analysis task for job %s", job_id)
+    logger.info("Processing completed task message: %s", message_id)
+    logger.info("Queued processed job details for WebSocket %s", websocket_id)
+
+
+def run(mode, requests, directory):
+    reset_root()
+    handlers = make_handlers(directory, mode)
+    queue_handler = None
+    if mode == "sync_text":
+        formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+        for handler in handlers:
+            handler.setFormatter(formatter)
+            root.addHandler(handler)
+        log_request = eager_request
+    else:
+        queue_handler = configure_logging(
+            logging.INFO, handlers, structured=True, queue_size=requests * REQUEST_RECORDS,
+            sample_rate=10.0 if mode == "async_json" else 0,
+        )
+        log_request = lazy_request
+
+    logger = logging.getLogger("bench")
+    ids = [(str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4())) for _ in range(requests)]
+    started = time.perf_counter()
+    for job_id, message_id, websocket_id in ids:
+        log_request(logger, job_id, message_id, websocket_id)
+    elapsed = time.perf_counter() - started
+
+    drain_started = time.perf_counter()
+    stats = None
+    if queue_handler is not None:
+        stats = queue_handler.stats()
+        stop_listener(queue_handler)  # Returns once every queued record is written
+    drain = time.perf_counter() - drain_started
+    reset_root()
+    result = {"us_per_request": round(elapsed * 1e6 / requests, 2), "drain_s": round(drain, 3)}
+    if stats:
+        result["written"] = stats["enqueued"]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ("sync_text", "async_json", "async_unsampled"):
+            results[mode] = run(mode, args.requests, directory)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Gateway memory used to deliver one large analysis result.
+
+For each --sizes (in MB) a single result is delivered to one connected client
+in two ways, and the peak Python memory allocated during the delivery
+(tracemalloc) is reported:
+
+    inline        the result travels in the queue message; the gateway decodes
+                  it and re-serializes it into one WebSocket frame
+    claim_check   the result is in S3 (LocalS3Client) and the queue message
+                  carries only its reference; the gateway streams it in
+                  RESULT_CHUNK_SIZE ranges
+
+The client is a stub that counts bytes, so only the gateway's side is measured.
+
+Run from the repository root:
+
+    python -m benchmarks.result_delivery_bench --sizes 1 8 32
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+import tracemalloc
+
+from config import S3_RESULTS_BUCKET_NAME
+from trading_view_extension.managers.session_manager import SessionManager
+from trading_view_extension.managers.result_streamer import ResultStreamer
+from trading_view_extension.workers.response_worker import ResponseWorker
+from utils.local_s3 import LocalS3Client
+
+
+class CountingWebSocket:
+    def __init__(self):
+        self.bytes_received = 0
+        self.finished = asyncio.Event()
+
+    async def send(self, message):
+        self.bytes_received += len(message)
+        if isinstance(message, str) and '"result_end"' in message:
+            self.finished.set()
+
+
+def make_report(size):
+    return json.dumps({"summary": "benchmark", "report": "." * size}).encode("utf-8")
+
+
+async def deliver(mode, size):
+    session_manager = SessionManager()
+    s3 = LocalS3Client()
+    streamer = ResultStreamer(session_manager, s3_client=s3)
+    worker = ResponseWorker(queue_consumer=None, session_manager=session_manager, result_streamer=streamer)
+    websocket = CountingWebSocket()
+    websocket_id, _ = session_manager.open_session(websocket, user_id="bench", tab_id="tab")
+    job = {"job_id": "job-1", "websocket_id": websocket_id, "user_id": "bench", "status": "COMPLETED"}
+    if mode == "claim_check":
+        report = make_report(size)
+        s3.put_object(Bucket=S3_RESULTS_BUCKET_NAME, Key="results/job-1.json", Body=report)
+        job["result_ref"] = {"bucket": S3_RESULTS_BUCKET_NAME, "key": "results/job-1.json", "size": len(report)}
+        del report
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    if mode == "inline":
+        # The message body is received into gateway memory as part of the delivery
+        body = json.dumps(dict(job, analysis=json.loads(make_report(size))))
+        await worker.manage_processed_job(json.loads(body))
+        del body
+        await session_manager.get_session(websocket_id).outbound.flush(60)
+    else:
+        await worker.manage_processed_job(json.loads(json.dumps(job)))
+        await asyncio.wait_for(websocket.finished.wait(), 60)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"peak_mb": round(peak / 2**20, 2), "seconds": round(elapsed, 3),
+            "sent_mb": round(websocket.bytes_received / 2**20, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 8, 32], help="Result sizes in MB")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    results = {}
+    for size in args.sizes:
+        results[f"{size}MB"] = {mode: asyncio.run(deliver(mode, size * 2**20)) for mode in ("inline", "claim_check")}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark SessionManager lookups with a large number of registered sessions.
+
+Run from the repository root:
+
+    python -m benchmarks.session_manager_bench --sessions 100000
+"""
+import argparse
+import logging
+import time
+import uuid
+
+from config import logger
+from trading_view_extension.managers.session_manager import SessionManager
+
+
+class FakeWebSocket:
+    async def send(self, message):
+        pass
+
+
+def timed(label, operations, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {operations:>8} ops  {elapsed * 1e9 / operations:>10.1f} ns/op")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=100_000)
+    parser.add_argument("--tabs-per-user", type=int, default=4)
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    manager = SessionManager()
+    ids = [str(i) for i in range(args.sessions)]
+    users = [f"user-{i // args.tabs_per_user}" for i in range(args.sessions)]
+    jobs = [str(uuid.uuid4()) for _ in range(args.sessions)]
+    n = args.sessions
+
+    def register():
+        for i in range(n):
+            manager.register_websocket(ids[i], FakeWebSocket(), user_id=users[i], tab_id=f"tab-{i}")
+
+    def bind():
+        for i in range(n):
+            manager.bind_job(ids[i], jobs[i])
+
+    def lookup_by_id():
+        for ws_id in ids:
+            manager.get_websocket(ws_id)
+
+    def lookup_by_job():
+        for job_id in jobs:
+            manager.get_websocket_for_job(job_id)
+
+    def lookup_by_user():
+        for user_id in users:
+            manager.get_user_websockets(user_id)
+
+    def release():
+        for job_id in jobs:
+            manager.release_job(job_id)
+
+    def remove():
+        for ws_id in ids:
+            manager.remove_websocket(ws_id)
+
+    timed("register_websocket", n, register)
+    timed("bind_job", n, bind)
+    timed("get_websocket", n, lookup_by_id)
+    timed("get_websocket_for_job", n, lookup_by_job)
+    timed("get_user_websockets", n, lookup_by_user)
+    timed("release_job", n, release)
+    timed("remove_websocket", n, remove)
+    assert len(manager) == 0 and not manager.sessions_by_user
+
+
+if __name__ == "__main__":
+    main()
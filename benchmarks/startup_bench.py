@@ -0,0 +1,107 @@
+"""
+Start-up time of the gateway.
+
+Measures, in fresh interpreter processes:
+
+    interpreter_ms        `python -c pass`, the floor for everything below
+    import_config_ms      `import config`, paid by every tool, test and worker
+    import_main_ms        importing the whole gateway
+    first_connection_ms   from spawning `python main.py --local` until a client
+                          completes the WebSocket handshake and gets its greeting
+
+Each figure is the median of --runs runs. Local mode keeps S3, SQS and Postgres
+in memory, so the numbers do not depend on the network.
+
+Run from the repository root:
+
+    python -m benchmarks.startup_bench --runs 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_env(scratch):
+    return dict(
+        os.environ,
+        LOG_LEVEL="WARNING",
+        LOG_FILE=os.path.join(scratch, "gateway.log"),
+        ADMIN_SOCKET_PATH="",
+        PYTHONDONTWRITEBYTECODE="1",
+    )
+
+
+def time_statement(statement, env):
+    """
+    Run `statement` in a fresh interpreter and return its wall time in ms.
+    """
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", statement], cwd=REPO_ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - started) * 1000
+
+
+async def handshake(url):
+    async with websockets.connect(url, open_timeout=1) as websocket:
+        await websocket.send(json.dumps({"user_id": "startup-bench", "tab_id": "tab"}))
+        await websocket.recv()
+
+
+def time_first_connection(env, timeout=30):
+    """
+    Spawn the gateway and return the ms until the first handshake succeeds.
+    """
+    port = free_port()
+    env = dict(env, WEBSOCKET_HOST="127.0.0.1", PORT=str(port), METRICS_PORT=str(free_port()))
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "main.py", "--local"], cwd=REPO_ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = started + timeout
+        while time.perf_counter() < deadline:
+            try:
+                asyncio.run(handshake(f"ws://127.0.0.1:{port}"))
+                return (time.perf_counter() - started) * 1000
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException):
+                time.sleep(0.005)
+        raise RuntimeError("Gateway did not accept a connection in time")
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    samples = {"interpreter_ms": [], "import_config_ms": [], "import_main_ms": [], "first_connection_ms": []}
+    with tempfile.TemporaryDirectory() as scratch:
+        env = bench_env(scratch)
+        for _ in range(args.runs):
+            samples["interpreter_ms"].append(time_statement("pass", env))
+            samples["import_config_ms"].append(time_statement("import config", env))
+            samples["import_main_ms"].append(time_statement("import main", env))
+            samples["first_connection_ms"].append(time_first_connection(env))
+    print(json.dumps({name: round(statistics.median(values), 1) for name, values in samples.items()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
 import os
+import socket
 import logging
-from dotenv import load_dotenv
-import boto3
 from dataclasses import dataclass
+from utils.async_logging import configure_logging
+from utils.aws_clients import AWSClientFactory
 
-# Load environment variables from the .env file
-load_dotenv()
+# Settings are read from the environment when this module is first imported.
+# Entry points load the .env file (load_environment in main.py) before that;
+# importing config itself has no side effects.
 
 # --------------------------
 # General Configuration
@@ -19,50 +21,266 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 LOG_FORMAT = os.getenv("LOG_FORMAT", "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 LOG_FILE = os.getenv("LOG_FILE", "trading_view_extension.log")
+# JSON lines (default) or LOG_FORMAT text.
+LOG_STRUCTURED = os.getenv("LOG_STRUCTURED", "true").lower() in ("1", "true", "yes")
+# Records waiting for the writer thread; beyond this new records are dropped.
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# Per call site, INFO and below: records per second (0 = no sampling) and burst
+# before only one in LOG_SAMPLE_EVERY is kept.
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 10))
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", 50))
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", 100))
 
-# Configure logging for the application
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format=LOG_FORMAT,
-    handlers=[
-        logging.FileHandler(LOG_FILE),  # Log to file
-        logging.StreamHandler(),        # Log to console
-    ],
-)
 logger = logging.getLogger(__name__)
+log_queue_handler = None
+
+
+def setup_logging():
+    """
+    Configure logging for the application; called once by entry points (importing
+    config has no side effects on logging). Handlers run on a background thread,
+    so the event loop never waits on formatting or disk writes.
+
+    Returns:
+        The AsyncQueueHandler feeding the writer thread.
+    """
+    global log_queue_handler
+    if log_queue_handler is None:
+        log_queue_handler = configure_logging(
+            level=LOG_LEVEL,
+            handlers=[
+                logging.FileHandler(LOG_FILE),  # Log to file
+                logging.StreamHandler(),        # Log to console
+            ],
+            structured=LOG_STRUCTURED,
+            text_format=LOG_FORMAT,
+            queue_size=LOG_QUEUE_SIZE,
+            sample_rate=LOG_SAMPLE_RATE,
+            sample_burst=LOG_SAMPLE_BURST,
+            sample_every=LOG_SAMPLE_EVERY,
+        )
+    return log_queue_handler
 
 # --------------------------
 # WebSocket host and port
 # --------------------------
 WEBSOCKET_HOST = os.getenv("WEBSOCKET_HOST", "localhost")
 WEBSOCKET_PORT = int(os.getenv("PORT", 8080))
+# Number of worker processes sharing the port via SO_REUSEPORT (1 = no supervisor).
+# Sessions are per worker: a client that reconnects to another worker starts a new one.
+GATEWAY_WORKERS = int(os.getenv("GATEWAY_WORKERS", 1))
+
+# --------------------------
+# Session resume and result replay
+# --------------------------
+# How long a disconnected session (and its results) is kept for the client to resume it.
+SESSION_RESUME_TTL = float(os.getenv("SESSION_RESUME_TTL", 300))
+# Undelivered results kept per disconnected session, and for how long (seconds).
+REPLAY_BUFFER_SIZE = int(os.getenv("REPLAY_BUFFER_SIZE", 20))
+REPLAY_TTL = float(os.getenv("REPLAY_TTL", 300))
+
+# --------------------------
+# Outbound send queues
+# --------------------------
+# Frames buffered per connection, and what to do when a slow client fills them up:
+# "drop_oldest", "coalesce" (superseded status updates replace each other) or "disconnect".
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", 100))
+OUTBOUND_OVERFLOW_POLICY = os.getenv("OUTBOUND_OVERFLOW_POLICY", "coalesce")
+# Connections with the deepest outbound queues whose depth and send latency are
+# exported per connection (metrics and the admin "connections" command).
+OUTBOUND_STATS_TOP = int(os.getenv("OUTBOUND_STATS_TOP", 10))
+
+# --------------------------
+# Partial result streaming
+# --------------------------
+# Progress and partial-output messages are merged into at most one frame per
+# connection per this many seconds.
+PARTIAL_FLUSH_INTERVAL = float(os.getenv("PARTIAL_FLUSH_INTERVAL", 0.25))
+
+# --------------------------
+# Asset topic broadcasts
+# --------------------------
+# Broadcast frames at least this large are zlib-compressed (once) for subscribers that ask for it.
+# Connections that negotiated permessage-deflate get plain text frames instead, as
+# the transport compresses them anyway.
+BROADCAST_COMPRESSION_MIN_BYTES = int(os.getenv("BROADCAST_COMPRESSION_MIN_BYTES", 1024))
+# Asset topics a single session may subscribe to.
+MAX_TOPICS_PER_SESSION = int(os.getenv("MAX_TOPICS_PER_SESSION", 50))
+
+# --------------------------
+# Admission control
+# --------------------------
+# Per-user token bucket: sustained submissions per second and burst size.
+RATE_LIMIT_PER_USER = float(os.getenv("RATE_LIMIT_PER_USER", 0.5))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", 5))
+# Concurrent in-flight jobs per user, per tab and per gateway process.
+MAX_INFLIGHT_PER_USER = int(os.getenv("MAX_INFLIGHT_PER_USER", 5))
+MAX_INFLIGHT_PER_TAB = int(os.getenv("MAX_INFLIGHT_PER_TAB", 2))
+MAX_INFLIGHT_GLOBAL = int(os.getenv("MAX_INFLIGHT_GLOBAL", 500))
+# Seconds after which a job that never got a result stops counting as in flight.
+INFLIGHT_TTL = float(os.getenv("INFLIGHT_TTL", 900))
+
+# --------------------------
+# Circuit breakers and load shedding
+# --------------------------
+# A breaker opens when this share of its last BREAKER_WINDOW calls failed or took
+# longer than BREAKER_SLOW_CALL_SECONDS, and stays open for BREAKER_OPEN_SECONDS.
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", 0.5))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", 5))
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", 20))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", 5))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", 30))
+# Upload pipelines (spool, S3, DB, SQS) allowed to run at once in one process.
+MAX_INFLIGHT_PIPELINES = int(os.getenv("MAX_INFLIGHT_PIPELINES", 64))
+
+# --------------------------
+# WebSocket connection tuning
+# --------------------------
+# Idle connections are pinged every WS_PING_INTERVAL seconds; peers that do not answer
+# within WS_PING_TIMEOUT are treated as dead and evicted.
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", 20))
+WS_PING_TIMEOUT = float(os.getenv("WS_PING_TIMEOUT", 20))
+# Largest accepted frame (a multi-image upload arrives as one binary frame).
+WS_MAX_SIZE = int(os.getenv("WS_MAX_SIZE", 1024 * 1024))
+# Connection-density mode trades per-connection throughput for memory so one instance
+# can hold far more mostly idle connections: smaller buffers, a one-message incoming
+# queue and no per-connection permessage-deflate state.
+CONNECTION_DENSITY_MODE = os.getenv("CONNECTION_DENSITY_MODE", "false").lower() in ("1", "true", "yes")
+WS_MAX_QUEUE = int(os.getenv("WS_MAX_QUEUE", 1 if CONNECTION_DENSITY_MODE else 32))
+WS_READ_LIMIT = int(os.getenv("WS_READ_LIMIT", 16 * 1024 if CONNECTION_DENSITY_MODE else 64 * 1024))
+WS_WRITE_LIMIT = int(os.getenv("WS_WRITE_LIMIT", 16 * 1024 if CONNECTION_DENSITY_MODE else 64 * 1024))
+WS_COMPRESSION = None if CONNECTION_DENSITY_MODE else "deflate"
+
+# --------------------------
+# Metrics
+# --------------------------
+# Prometheus-format metrics are served at http://METRICS_HOST:METRICS_PORT/metrics.
+# Supervised workers use METRICS_PORT + worker index.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_HOST = os.getenv("METRICS_HOST", WEBSOCKET_HOST)
+METRICS_PORT = int(os.getenv("METRICS_PORT", WEBSOCKET_PORT + 1))
+
+# --------------------------
+# Job tracing
+# --------------------------
+# Traces follow a job from upload through the SQS round trip back to the client.
+# Finished traces are appended as JSON lines to TRACE_EXPORT_PATH, or POSTed in
+# batches to TRACE_COLLECTOR_URL when that is set.
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() in ("1", "true", "yes")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 1.0))
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "traces.jsonl")
+TRACE_COLLECTOR_URL = os.getenv("TRACE_COLLECTOR_URL")
+# Traces of jobs still waiting for their result, per gateway process.
+MAX_PENDING_TRACES = int(os.getenv("MAX_PENDING_TRACES", 10000))
+
+# --------------------------
+# Event loop health
+# --------------------------
+# The loop is checked every LOOP_MONITOR_INTERVAL seconds. When it has not run
+# for LOOP_STALL_THRESHOLD seconds, the stack of the blocking code is logged (at
+# most once per LOOP_STALL_LOG_INTERVAL seconds).
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() in ("1", "true", "yes")
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", 0.1))
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", 0.25))
+LOOP_STALL_LOG_INTERVAL = float(os.getenv("LOOP_STALL_LOG_INTERVAL", 10))
+# Local admin channel (Unix socket) for stacks and on-demand profiling. "{node_id}"
+# is replaced so supervised workers get a socket each; empty disables it.
+ADMIN_SOCKET_PATH = os.getenv("ADMIN_SOCKET_PATH", "/tmp/alpha-gateway-{node_id}.sock")
+PROFILE_OUTPUT_DIR = os.getenv("PROFILE_OUTPUT_DIR", "profiles")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", 60))
+PROFILE_DEFAULT_HZ = int(os.getenv("PROFILE_DEFAULT_HZ", 100))
+
+# --------------------------
+# Job cancellation
+# --------------------------
+# Cancel the in-flight jobs of a disconnected session that does not resume within
+# CANCEL_GRACE_PERIOD seconds. Off by default: a session can only be resumed on the
+# process that issued it, so enable this only when reconnects are sure to reach the
+# same gateway process (one node, or sticky routing); otherwise a client that
+# reconnects through the load balancer would have its jobs cancelled. Ignored by
+# supervised workers (--workers), where it can never be sure.
+CANCEL_ON_DISCONNECT = os.getenv("CANCEL_ON_DISCONNECT", "false").lower() in ("1", "true", "yes")
+CANCEL_GRACE_PERIOD = float(os.getenv("CANCEL_GRACE_PERIOD", 30))
+
+# --------------------------
+# Graceful drain
+# --------------------------
+# On SIGTERM/SIGINT the gateway stops listening and refuses new uploads, waits up
+# to DRAIN_PIPELINE_TIMEOUT seconds for uploads already being processed, keeps
+# delivering results for up to DRAIN_GRACE_PERIOD seconds while jobs are in flight,
+# then closes every connection with code 1012 and a reconnect hint. A second
+# signal skips the remaining waits.
+DRAIN_PIPELINE_TIMEOUT = float(os.getenv("DRAIN_PIPELINE_TIMEOUT", 15))
+DRAIN_GRACE_PERIOD = float(os.getenv("DRAIN_GRACE_PERIOD", 30))
+# Seconds to wait for queued frames to reach clients before closing their connections.
+DRAIN_FLUSH_TIMEOUT = float(os.getenv("DRAIN_FLUSH_TIMEOUT", 5))
+# Suggested delay before reconnecting, sent to clients in the reconnect hint.
+DRAIN_RECONNECT_DELAY = float(os.getenv("DRAIN_RECONNECT_DELAY", 1))
+
+# --------------------------
+# Job deadlines
+# --------------------------
+# Clients may send "deadline" (epoch seconds) or "max_age" (seconds) in the upload
+# metadata; jobs carry the result as an absolute "expires_at". DEFAULT_JOB_MAX_AGE
+# applies when the client sends neither (0 = no deadline).
+DEFAULT_JOB_MAX_AGE = float(os.getenv("DEFAULT_JOB_MAX_AGE", 0))
+# What to do with results that arrive after their deadline: "drop" or "mark"
+# (deliver with "expired": true).
+EXPIRED_RESULT_POLICY = os.getenv("EXPIRED_RESULT_POLICY", "drop")
 
 # --------------------------
 # Directory for uploaded files
 # --------------------------
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
 
+# --------------------------
+# Job history streaming
+# --------------------------
+# Rows per keyset page (one server-side cursor per page) and rows per WebSocket frame.
+JOB_HISTORY_PAGE_SIZE = int(os.getenv("JOB_HISTORY_PAGE_SIZE", 500))
+JOB_HISTORY_CHUNK_SIZE = int(os.getenv("JOB_HISTORY_CHUNK_SIZE", 50))
+# Most jobs one "job_history" request may return; also the default when no limit is given.
+JOB_HISTORY_MAX_LIMIT = int(os.getenv("JOB_HISTORY_MAX_LIMIT", 1000))
+
+# --------------------------
+# Claim-check results
+# --------------------------
+# Analysis workers may store a large result in S3 and send only a reference
+# ({"result_ref": {"bucket", "key", ...}}); the gateway streams the object to the
+# client in RESULT_CHUNK_SIZE-byte ranges. At most RESULT_STREAM_CONCURRENCY
+# streams run at once, so the memory they use is bounded whatever the result sizes.
+RESULT_CHUNK_SIZE = int(os.getenv("RESULT_CHUNK_SIZE", 256 * 1024))
+RESULT_STREAM_CONCURRENCY = int(os.getenv("RESULT_STREAM_CONCURRENCY", 32))
+# How long (and how many) references are kept so clients can resume a stream with "fetch_result".
+RESULT_REF_TTL = float(os.getenv("RESULT_REF_TTL", 900))
+MAX_RESULT_REFS = int(os.getenv("MAX_RESULT_REFS", 10000))
+
 # --------------------------
 # AWS Configuration
 # --------------------------
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
-
-# Initialize AWS clients
-sqs_client = boto3.client(
-    'sqs',
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
+# Connections each client keeps open (boto3's default is 10).
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", 50))
+
+# AWS clients are built on first use (or by aws_clients.prewarm() at server start)
+# and shared by the whole process.
+aws_clients = AWSClientFactory(
+    access_key_id=AWS_ACCESS_KEY_ID,
+    secret_access_key=AWS_SECRET_ACCESS_KEY,
+    region=AWS_REGION,
+    max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
 )
 
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
-)
+
+def __getattr__(name):
+    # config.sqs_client and config.s3_client are still available, built on first access
+    if name == "sqs_client":
+        return aws_clients.sqs()
+    if name == "s3_client":
+        return aws_clients.s3()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # --------------------------
 # Data Classes for AWS SQS Queues
@@ -72,27 +290,112 @@ class SQSQueue:
     name: str
     url: str
     arn: str
-    client: boto3.client
+
+    @property
+    def client(self):
+        return aws_clients.sqs()
 
 # Initialize separate SQSQueue objects
 input_tasks_queue = SQSQueue(
     name=os.getenv("SQS_INPUT_QUEUE_NAME"),
     url=os.getenv("SQS_INPUT_QUEUE_URL"),
     arn=os.getenv("SQS_INPUT_QUEUE_ARN"),
-    client=sqs_client
 )
 
 output_tasks_queue = SQSQueue(
     name=os.getenv("SQS_OUTPUT_QUEUE_NAME"),
     url=os.getenv("SQS_OUTPUT_QUEUE_URL"),
     arn=os.getenv("SQS_OUTPUT_QUEUE_ARN"),
-    client=sqs_client
 )
 
+# Cancellation notices go to the queue their job was published to (its agent's or
+# lane's), in their own message group so they are not stuck behind pending jobs.
+# This queue is the fallback for jobs the publishing process no longer knows.
+cancel_tasks_queue = SQSQueue(
+    name=os.getenv("SQS_CANCEL_QUEUE_NAME", input_tasks_queue.name or ""),
+    url=os.getenv("SQS_CANCEL_QUEUE_URL", input_tasks_queue.url or ""),
+    arn=os.getenv("SQS_CANCEL_QUEUE_ARN", input_tasks_queue.arn or ""),
+)
+
+# --------------------------
+# Per-node reply routing
+# --------------------------
+# Identifies this gateway instance; jobs are stamped with it so results come back here.
+NODE_ID = os.getenv("GATEWAY_NODE_ID", socket.gethostname())
+# e.g. "https://sqs.us-east-1.amazonaws.com/123456789012/gateway-replies-{node_id}.fifo"
+# (may also contain "{lane}" for one reply queue per priority lane).
+# When unset, all nodes share output_tasks_queue and results for other nodes are handed
+# back after SQS_HANDOFF_DELAY, until the redrive policy gives up on them. Required with
+# more than one worker process (--workers / GATEWAY_WORKERS) or gateway host.
+SQS_REPLY_QUEUE_URL_TEMPLATE = os.getenv("SQS_REPLY_QUEUE_URL_TEMPLATE")
+
+# --------------------------
+# Queue consumers
+# --------------------------
+# Messages are received with a short visibility timeout, which is renewed (in
+# ChangeMessageVisibilityBatch calls) every SQS_HEARTBEAT_INTERVAL seconds while
+# they are buffered or being processed, for at most SQS_MAX_HOLD seconds. A
+# gateway that dies therefore hides its messages for seconds, not minutes.
+SQS_VISIBILITY_TIMEOUT = int(os.getenv("SQS_VISIBILITY_TIMEOUT", 30))
+SQS_HEARTBEAT_INTERVAL = float(os.getenv("SQS_HEARTBEAT_INTERVAL", 10))
+SQS_MAX_HOLD = float(os.getenv("SQS_MAX_HOLD", 600))
+# Messages received ahead of processing, per queue.
+SQS_PREFETCH = int(os.getenv("SQS_PREFETCH", 20))
+# Failed messages are released with an exponential backoff (by receive count)
+# between these bounds; a redrive policy on the queue decides when to give up.
+SQS_RETRY_BASE_DELAY = float(os.getenv("SQS_RETRY_BASE_DELAY", 1))
+SQS_RETRY_MAX_DELAY = float(os.getenv("SQS_RETRY_MAX_DELAY", 60))
+# A result for another node that cannot be forwarded (no SQS_REPLY_QUEUE_URL_TEMPLATE)
+# is handed back after this many seconds, so nodes sharing the output queue do not
+# spin on it. Each hand-back counts towards the redrive policy's maxReceiveCount, so
+# set the template whenever more than one node shares the output queue.
+SQS_HANDOFF_DELAY = int(os.getenv("SQS_HANDOFF_DELAY", 2))
+
+# --------------------------
+# Priority lanes
+# --------------------------
+def _parse_pairs(value):
+    """
+    Parse "key:value,key:value" into a dict, preserving order.
+    """
+    pairs = (item.split(":", 1) for item in value.split(",") if ":" in item)
+    return {key.strip(): val.strip() for key, val in pairs}
+
+# Lanes and their polling weights, highest priority first, e.g. "interactive:4,batch:1".
+# Each lane may have its own queues: SQS_INPUT_QUEUE_URL_<LANE> and SQS_OUTPUT_QUEUE_URL_<LANE>
+# (falling back to the shared queues, in a lane-specific message group).
+PRIORITY_LANE_WEIGHTS = {
+    lane: max(1, int(weight))
+    for lane, weight in _parse_pairs(os.getenv("PRIORITY_LANE_WEIGHTS", "interactive:1")).items()
+}
+DEFAULT_PRIORITY_LANE = os.getenv("DEFAULT_PRIORITY_LANE", next(iter(PRIORITY_LANE_WEIGHTS)))
+# Lane overrides by user tier and by action type, e.g. "free:batch" and "backtest:batch".
+PRIORITY_LANE_BY_TIER = _parse_pairs(os.getenv("PRIORITY_LANE_BY_TIER", ""))
+PRIORITY_LANE_BY_ACTION_TYPE = _parse_pairs(os.getenv("PRIORITY_LANE_BY_ACTION_TYPE", ""))
+PRIORITY_LANE_INPUT_QUEUE_URLS = {
+    lane: os.getenv(f"SQS_INPUT_QUEUE_URL_{lane.upper()}") for lane in PRIORITY_LANE_WEIGHTS
+}
+PRIORITY_LANE_OUTPUT_QUEUE_URLS = {
+    lane: os.getenv(f"SQS_OUTPUT_QUEUE_URL_{lane.upper()}") for lane in PRIORITY_LANE_WEIGHTS
+}
+# Seconds between queue depth samples, and completed jobs kept per lane for latency percentiles.
+LANE_DEPTH_INTERVAL = float(os.getenv("LANE_DEPTH_INTERVAL", 15))
+LANE_LATENCY_WINDOW = int(os.getenv("LANE_LATENCY_WINDOW", 1000))
+
+# --------------------------
+# Per-agent input queues
+# --------------------------
+# Routing table giving agents their own input queue (and worker fleet), e.g.
+# "model_a:https://sqs.us-east-1.amazonaws.com/123456789012/model-a.fifo,model_b:...".
+# Agents not listed use their priority lane's queue, or input_tasks_queue.
+AGENT_QUEUE_URLS = _parse_pairs(os.getenv("AGENT_QUEUE_URLS", ""))
+
 # --------------------------
 # AWS S3 Configuration
 # --------------------------
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
+# Bucket analysis workers store claim-check results in; references to other buckets are refused.
+S3_RESULTS_BUCKET_NAME = os.getenv("S3_RESULTS_BUCKET_NAME", S3_BUCKET_NAME)
 
 # # --------------------------
 # # AWS RDS Configuration
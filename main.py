@@ -1,5 +1,15 @@
+from dotenv import load_dotenv
+
+# config.py reads its settings from the environment when it is first imported, so
+# the .env file is loaded before anything that imports it. Spawned workers
+# re-import this module and load it the same way.
+load_dotenv()
+
+import argparse
 import asyncio
+import signal
 from utils.websocket import WebSocketServer
+from utils.supervisor import Supervisor
 from trading_view_extension.routers.analysis_router import AnalysisRouter
 from trading_view_extension.repository.db_connection import DBConnection
 from trading_view_extension.managers.analysis_task_manager import AnalysisTaskManager
@@ -7,47 +17,233 @@ from trading_view_extension.queue.sqs_queue_publisher import SQSQueuePublisher
 from trading_view_extension.workers.response_worker import ResponseWorker
 from trading_view_extension.queue.sqs_queue_consumer import SqsQueueConsumer
 from trading_view_extension.managers.session_manager import SessionManager
-from config import logger  # Ensure logger is imported from config.py
+from trading_view_extension.queue.reply_router import ReplyRouter
+from trading_view_extension.managers.topic_manager import TopicManager
+from trading_view_extension.managers.admission_controller import AdmissionController
+from trading_view_extension.managers.load_shedder import LoadShedder
+from trading_view_extension.managers.cancellation_manager import CancellationManager
+from trading_view_extension.queue.priority_lanes import PriorityLanes
+from trading_view_extension.managers.partial_result_coalescer import PartialResultCoalescer
+from trading_view_extension.managers.drain_manager import DrainManager
+from trading_view_extension.managers.result_streamer import ResultStreamer
+from trading_view_extension.repository.local_db_connection import LocalDBConnection
+from trading_view_extension.queue.local_sqs import LocalSQSClient
+from trading_view_extension.workers.local_analysis_worker import LocalAnalysisWorker
+from utils.local_s3 import LocalS3Client
+from utils.metrics import MetricsServer, register_gateway_metrics
+from utils.tracing import Tracer
+from utils.loop_monitor import LoopMonitor
+from utils.admin_server import AdminServer
+from config import (  # Ensure logger is imported from config.py
+    logger,
+    setup_logging,
+    aws_clients,
+    S3_BUCKET_NAME,
+    NODE_ID,
+    SQS_REPLY_QUEUE_URL_TEMPLATE,
+    GATEWAY_WORKERS,
+    CANCEL_ON_DISCONNECT,
+    input_tasks_queue,
+    output_tasks_queue,
+    cancel_tasks_queue,
+    METRICS_ENABLED,
+    METRICS_HOST,
+    METRICS_PORT,
+    TRACING_ENABLED,
+    LOOP_MONITOR_ENABLED,
+    ADMIN_SOCKET_PATH,
+)
+
+def use_local_queue_urls():
+    """
+    Give queues that have no URL configured a local one, so the in-memory SQS
+    stand-in can tell them apart.
+    """
+    for queue, name in ((input_tasks_queue, "analysis-tasks"),
+                        (output_tasks_queue, "analysis-completed"),
+                        (cancel_tasks_queue, "analysis-tasks")):
+        queue.url = queue.url or f"local://{name}"
+
+async def main(node_id=NODE_ID, reuse_port=False, local=False, worker_latency=0.5, metrics_port=METRICS_PORT,
+               result_bytes=0):
+    """
+    Wire up and run the gateway.
 
-async def main():
+    Args:
+        node_id: Identifies this gateway process for reply routing.
+        reuse_port: Bind with SO_REUSEPORT (supervised workers).
+        local: Use in-memory stand-ins for S3, SQS and Postgres, and run a local
+            analysis worker that answers every job after `worker_latency` seconds.
+        worker_latency: Simulated analysis time in local mode.
+        result_bytes: In local mode, deliver results as claim-checks of this size.
+        metrics_port: Port of the Prometheus metrics endpoint.
+    """
+    log_queue_handler = setup_logging()
     # Initialize all dependencies
-    db = DBConnection()
-    iqp = SQSQueuePublisher()
-    atm = AnalysisTaskManager(iqp)
-    sqs_consumer = SqsQueueConsumer()
+    sqs = s3 = None
+    if local:
+        use_local_queue_urls()
+        sqs = LocalSQSClient()
+        s3 = LocalS3Client()
+        db = LocalDBConnection()
+    else:
+        db = DBConnection()
+    lanes = PriorityLanes()
+    iqp = SQSQueuePublisher(client=sqs, lanes=lanes)
+    reply_router = ReplyRouter(node_id=node_id, client=sqs)
+    atm = AnalysisTaskManager(iqp, reply_router=reply_router, lanes=lanes)
+    sqs_consumer = SqsQueueConsumer(client=sqs)
     session_manager = SessionManager()  # Initialize SessionManager
+    topic_manager = TopicManager(session_manager)
+    admission_controller = AdmissionController()
+    load_shedder = LoadShedder()
+    # A reconnect may land on another worker sharing the port, which does not know
+    # the session; the jobs of a session that never resumes here are not cancelled
+    cancellation_manager = CancellationManager(db, iqp, session_manager, admission_controller,
+                                               cancel_on_disconnect=CANCEL_ON_DISCONNECT and not reuse_port)
 
-    analysis_router = AnalysisRouter(db, atm)
-    server = WebSocketServer(analysis_router, session_manager)  # Pass session_manager
+    tracer = Tracer.from_config() if TRACING_ENABLED else None
+    result_streamer = ResultStreamer(session_manager, s3_client=s3)
+
+    analysis_router = AnalysisRouter(db, atm, load_shedder, cancellation_manager, s3_client=s3)
+    server = WebSocketServer(analysis_router, session_manager, topic_manager, admission_controller,
+                             load_shedder, cancellation_manager, tracer=tracer, result_streamer=result_streamer)
 
     # Initialize Workers
-    response_worker = ResponseWorker(queue_consumer=sqs_consumer, session_manager=session_manager)
+    partial_coalescer = PartialResultCoalescer(session_manager)
+    response_worker = ResponseWorker(
+        queue_consumer=sqs_consumer,
+        session_manager=session_manager,
+        job_repository=db,
+        reply_router=reply_router,
+        topic_manager=topic_manager,
+        admission_controller=admission_controller,
+        cancellation_manager=cancellation_manager,
+        lanes=lanes,
+        partial_coalescer=partial_coalescer,
+        tracer=tracer,
+        result_streamer=result_streamer,
+    )
+    drain_manager = DrainManager(server, session_manager, response_worker=response_worker,
+                                 partial_coalescer=partial_coalescer, result_streamer=result_streamer)
+    # Supervised workers drain on the supervisor's SIGTERM only (see run_worker)
+    drain_manager.install_signal_handlers((signal.SIGTERM,) if reuse_port else (signal.SIGTERM, signal.SIGINT))
+
+    prewarm_task = None
+    if not local:
+        # Open the S3 and SQS connections while the server starts listening
+        prewarm_task = asyncio.create_task(asyncio.to_thread(
+            aws_clients.prewarm,
+            queue_urls=[input_tasks_queue.url, *reply_router.listen_queue_urls()],
+            bucket=S3_BUCKET_NAME,
+        ))
 
-    server_task = asyncio.create_task(server.run())
+    server_task = asyncio.create_task(server.run(reuse_port=reuse_port))
     response_worker_task = asyncio.create_task(response_worker.start_listening())
- 
-    # Run all tasks concurrently until one raises an exception
-    done, pending = await asyncio.wait(
-        [server_task, response_worker_task],
-        return_when=asyncio.FIRST_EXCEPTION
-    )
+    tasks = [server_task, response_worker_task]
+    if METRICS_ENABLED:
+        register_gateway_metrics(
+            session_manager=session_manager,
+            admission_controller=admission_controller,
+            load_shedder=load_shedder,
+            response_worker=response_worker,
+            lanes=lanes,
+            topic_manager=topic_manager,
+            partial_coalescer=partial_coalescer,
+            log_handler=log_queue_handler,
+            drain_manager=drain_manager,
+            queue_consumer=sqs_consumer,
+            result_streamer=result_streamer,
+        )
+        tasks.append(asyncio.create_task(MetricsServer(host=METRICS_HOST, port=metrics_port).run()))
+    loop_monitor = None
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor = LoopMonitor()
+        tasks.append(asyncio.create_task(loop_monitor.run()))
+    if ADMIN_SOCKET_PATH:
+        admin_server = AdminServer(ADMIN_SOCKET_PATH.format(node_id=node_id), loop_monitor=loop_monitor,
+                                   session_manager=session_manager)
+        tasks.append(asyncio.create_task(admin_server.run()))
+    if local:
+        local_worker = LocalAnalysisWorker(SqsQueueConsumer(client=sqs, wait_time=1), iqp, lanes=lanes,
+                                           latency=worker_latency, s3_client=s3, result_bytes=result_bytes)
+        tasks.append(asyncio.create_task(local_worker.start()))
+
+    # Run all tasks concurrently until one raises an exception or a drain stops the server
+    pending = set(tasks)
+    while server_task in pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
 
-    # Handle task completion or exceptions
-    for task in done:
-        if task.exception():
-            logger.error(f"Task failed: {task.exception()}")
-            # Optionally, cancel other pending tasks
-            for pending_task in pending:
-                pending_task.cancel()
-            raise task.exception()
+        # Handle task completion or exceptions
+        for task in done:
+            if task.exception():
+                logger.error(f"Task failed: {task.exception()}")
+                # Optionally, cancel other pending tasks
+                for pending_task in pending:
+                    pending_task.cancel()
+                if prewarm_task is not None:
+                    prewarm_task.cancel()
+                raise task.exception()
 
+    if drain_manager.task is not None:
+        await drain_manager.task  # Finishes handing prefetched results back to the queue
+    if prewarm_task is not None:
+        pending.add(prewarm_task)  # Still running if the server stopped during start-up
+    for pending_task in pending:
+        pending_task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
     # Close DB connections if necessary
     db.close_connection()
+    logger.info("Gateway stopped")
 
-if __name__ == "__main__":
+def run_worker(index):
+    """
+    Entry point of a supervised worker process. Each worker has its own node id,
+    so results are routed back to the process that holds the websocket through
+    its reply queue (SQS_REPLY_QUEUE_URL_TEMPLATE is required in this mode).
+
+    Sessions live in the worker that issued them, and the kernel picks the worker
+    for each new connection. A client that reconnects to another worker cannot
+    resume its session there: it gets a new one, and results of jobs it submitted
+    before are replayed only if it reconnects to the original worker before the
+    session expires (job_history still lists them). Disconnect-cancel is off, as
+    the original worker cannot tell a client that went away from one that moved.
+    """
+    # Ctrl-C in a terminal reaches every worker as well as the supervisor, which
+    # then sends SIGTERM; ignore SIGINT so the two do not count as a forced drain
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
     try:
-        asyncio.run(main())
+        asyncio.run(main(node_id=f"{NODE_ID}-{index}", reuse_port=True, metrics_port=METRICS_PORT + index))
     except KeyboardInterrupt:
-        logger.info("Shutting down due to KeyboardInterrupt")
-    except Exception as e:
-        logger.error(f"Shutting down due to error: {e}")
+        logger.info(f"Worker {index} shutting down due to KeyboardInterrupt")
+
+if __name__ == "__main__":
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Alpha Agents API gateway")
+    parser.add_argument("--workers", type=int, default=GATEWAY_WORKERS,
+                        help="Worker processes sharing the port via SO_REUSEPORT")
+    parser.add_argument("--local", action="store_true",
+                        help="Run against in-memory S3, SQS and Postgres with a local analysis worker")
+    parser.add_argument("--worker-latency", type=float, default=0.5,
+                        help="Simulated analysis time in seconds (with --local)")
+    parser.add_argument("--result-bytes", type=int, default=0,
+                        help="Deliver results as claim-checks of this size in S3 (with --local)")
+    args = parser.parse_args()
+    if args.local and args.workers > 1:
+        parser.error("--local keeps queues in memory and cannot be combined with --workers")
+    if args.workers > 1:
+        # Without per-worker reply queues, results would bounce between workers via the shared queue
+        problem = ReplyRouter.template_problem(SQS_REPLY_QUEUE_URL_TEMPLATE)
+        if problem:
+            parser.error(f"--workers needs a reply queue per worker: {problem}")
+
+    if args.workers > 1:
+        # Worker failures are handled by restarting the process, not by exiting
+        Supervisor(run_worker, args.workers).run()
+    else:
+        try:
+            asyncio.run(main(local=args.local, worker_latency=args.worker_latency, result_bytes=args.result_bytes))
+        except KeyboardInterrupt:
+            logger.info("Shutting down due to KeyboardInterrupt")
+        except Exception as e:
+            logger.error(f"Shutting down due to error: {e}")
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+import pytest
+
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from trading_view_extension.managers.load_shedder import LoadShedder
+from trading_view_extension.routers import analysis_router
+from trading_view_extension.routers.analysis_router import AnalysisRouter
+
+
+class FakeDB:
+    def __init__(self, ok=True):
+        self.ok = ok
+        self.inserted = []
+
+    def insert_job(self, data):
+        self.inserted.append(data["job_id"])
+        return self.ok
+
+
+class FakeTaskManager:
+    def __init__(self):
+        self.published = []
+
+    async def publish_analysis_task(self, **data):
+        self.published.append(data["job_id"])
+
+
+def make_router(db=None, breakers=None):
+    breakers = breakers or {name: CircuitBreaker(name, min_calls=2, window=2, open_seconds=60)
+                            for name in LoadShedder.DEPENDENCIES}
+    return AnalysisRouter(db or FakeDB(), FakeTaskManager(), load_shedder=LoadShedder(breakers=breakers))
+
+
+def test_blocking_steps_run_off_the_event_loop(monkeypatch):
+    # Both uploads must be in progress at once to get past the barrier
+    barrier = threading.Barrier(2, timeout=5)
+
+    def upload(file_paths, client=None):
+        barrier.wait()
+        return [f"s3://bucket/{path}" for path in file_paths]
+
+    monkeypatch.setattr(analysis_router, "upload_to_s3", upload)
+    router = make_router()
+
+    async def main():
+        await asyncio.gather(
+            router.create_analysis({"job_id": "job-1", "file_paths": ["a"]}),
+            router.create_analysis({"job_id": "job-2", "file_paths": ["b"]}),
+        )
+
+    asyncio.run(main())
+    assert sorted(router.task_manager.published) == ["job-1", "job-2"]
+    assert router.load_shedder.breaker("s3").calls == 2
+
+
+def test_failed_insert_counts_against_the_db_breaker(monkeypatch):
+    monkeypatch.setattr(analysis_router, "upload_to_s3", lambda file_paths, client=None: [])
+    router = make_router(db=FakeDB(ok=False))
+
+    async def main():
+        await router.create_analysis({"job_id": "job-1"})
+        await router.create_analysis({"job_id": "job-2"})
+        with pytest.raises(CircuitOpenError):
+            await router.create_analysis({"job_id": "job-3"})
+
+    asyncio.run(main())
+    # The job is still published without its history row
+    assert router.task_manager.published == ["job-1", "job-2"]
+    assert router.db.inserted == ["job-1", "job-2"]
@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+from trading_view_extension.managers.load_shedder import LoadShedder
+
+
+def make_breaker(**kwargs):
+    options = dict(failure_rate=0.5, slow_call_seconds=1.0, window=4, min_calls=4, open_seconds=60)
+    options.update(kwargs)
+    return CircuitBreaker("test", **options)
+
+
+def test_stays_closed_below_min_calls():
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record(False, 0.0)
+
+    assert breaker.state == CLOSED
+    breaker.before_call()
+
+
+def test_opens_at_failure_rate():
+    breaker = make_breaker()
+    breaker.record(True, 0.0)
+    breaker.record(True, 0.0)
+    breaker.record(False, 0.0)
+    assert breaker.state == CLOSED
+    breaker.record(False, 0.0)
+
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as excinfo:
+        breaker.before_call()
+    assert excinfo.value.name == "test"
+    assert 0 < excinfo.value.retry_after <= 60
+    assert breaker.rejections == 1
+
+
+def test_slow_calls_count_as_bad():
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record(True, 2.0)
+
+    assert breaker.state == OPEN
+    assert breaker.stats()["slow_calls"] == 4
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = make_breaker(open_seconds=0)
+    for _ in range(4):
+        breaker.record(False, 0.0)
+    assert breaker.state == HALF_OPEN
+
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record(True, 0.0)
+    assert breaker.state == CLOSED
+    assert breaker.failure_rate == 0.0
+
+
+def test_failed_probe_reopens():
+    breaker = make_breaker(open_seconds=0)
+    for _ in range(4):
+        breaker.record(False, 0.0)
+    breaker.before_call()
+    breaker.open_seconds = 60
+
+    breaker.record(False, 0.0)
+
+    assert breaker.state == OPEN
+    assert not breaker.probe_in_flight
+
+
+def test_call_records_failures_and_reraises():
+    breaker = make_breaker()
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        breaker.call(fail)
+    assert breaker.call(lambda x: x * 2, 21) == 42
+    assert breaker.stats()["calls"] == 2
+    assert breaker.stats()["failures"] == 1
+
+
+def test_call_async():
+    breaker = make_breaker()
+
+    async def double(x):
+        return x * 2
+
+    assert asyncio.run(breaker.call_async(double, 21)) == 42
+    assert breaker.calls == 1
+
+
+def test_cancelled_probe_frees_half_open():
+    breaker = make_breaker(open_seconds=0)
+    for _ in range(4):
+        breaker.record(False, 0.0)
+
+    async def cancelled():
+        raise asyncio.CancelledError
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(breaker.call_async(cancelled))
+    assert not breaker.probe_in_flight
+    breaker.before_call()
+
+
+def test_load_shedder_limits_inflight_pipelines():
+    shedder = LoadShedder(max_inflight=2, breakers={"s3": make_breaker()})
+
+    assert shedder.try_acquire() is None
+    assert shedder.try_acquire() is None
+    rejection = shedder.try_acquire()
+    assert rejection["code"] == "overloaded"
+
+    shedder.release()
+    assert shedder.try_acquire() is None
+    assert shedder.shed == 1
+
+
+def test_load_shedder_degrades_while_a_breaker_is_open():
+    breaker = make_breaker()
+    shedder = LoadShedder(max_inflight=2, breakers={"s3": breaker})
+    for _ in range(4):
+        breaker.record(False, 0.0)
+
+    assert shedder.degraded
+    rejection = shedder.try_acquire()
+    assert rejection["code"] == "degraded"
+    assert 0 < rejection["retry_after"] <= 60
+    assert shedder.inflight == 0
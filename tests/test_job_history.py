@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+from utils.websocket import WebSocketServer
+from trading_view_extension.repository.db_connection import JOB_HISTORY_COLUMNS
+from trading_view_extension.repository.local_db_connection import LocalDBConnection
+from trading_view_extension.routers.analysis_router import AnalysisRouter
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send(self, message):
+        self.frames.append(json.loads(message))
+
+
+def make_db(jobs_per_user=5):
+    db = LocalDBConnection()
+    for user_id in ("user-1", "user-2"):
+        for index in range(jobs_per_user):
+            db.insert_job({
+                "job_id": f"{user_id}-job-{index}", "user_id": user_id, "tab_id": "tab-1",
+                "websocket_id": "routing-id", "agent": "agent", "status": "PENDING",
+                "action_type": "analysis", "filenames": [], "s3_urls": [],
+            })
+    return db
+
+
+def test_history_rows_have_the_production_columns():
+    db = make_db()
+
+    rows = [row for chunk in db.iter_job_history("user-1") for row in chunk]
+
+    assert len(rows) == 5
+    assert all(tuple(row) == JOB_HISTORY_COLUMNS for row in rows)
+    assert all("websocket_id" not in row and "user_id" not in row for row in rows)
+
+
+def test_history_is_streamed_in_pages_with_a_cursor():
+    router = AnalysisRouter(make_db(), task_manager=None)
+    websocket = FakeWebSocket()
+
+    asyncio.run(router.stream_job_history(websocket, "user-1", limit=3))
+    end = websocket.frames[-1]
+    assert end["type"] == "job_history_end"
+    assert end["count"] == 3
+    first_page = [job["job_id"] for frame in websocket.frames[:-1] for job in frame["jobs"]]
+
+    websocket = FakeWebSocket()
+    asyncio.run(router.stream_job_history(websocket, "user-1", cursor=end["next_cursor"], limit=3))
+    second_page = [job["job_id"] for frame in websocket.frames[:-1] for job in frame["jobs"]]
+
+    assert websocket.frames[-1]["next_cursor"] is None
+    assert len(second_page) == 2
+    assert sorted(first_page + second_page) == [f"user-1-job-{index}" for index in range(5)]
+
+
+def test_history_request_validation():
+    problem = WebSocketServer.history_request_problem
+
+    assert problem(10, None) is None
+    assert problem(10, {"created_at": "2026-01-01T00:00:00+00:00", "job_id": "job-1"}) is None
+    assert problem(0, None)
+    assert problem(True, None)
+    assert problem("10", None)
+    assert problem(10, {"created_at": "yesterday", "job_id": "job-1"})
+    assert problem(10, {"created_at": "2026-01-01T00:00:00+00:00"})
@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+from utils.admin_server import AdminServer
+from utils.metrics import MetricsRegistry, register_gateway_metrics
+from trading_view_extension.managers.outbound_queue import OutboundQueue, DROP_OLDEST, COALESCE
+from trading_view_extension.managers.session_manager import SessionManager
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+def test_overflow_drops_oldest_non_essential_frame():
+    async def main():
+        queue = OutboundQueue(FakeWebSocket(), max_size=2, policy=DROP_OLDEST)
+        queue.put("progress")
+        queue.put("result", essential=True)
+        queue.put("newer progress")
+        return queue.close(), queue.dropped
+
+    assert asyncio.run(main()) == (["result", "newer progress"], 1)
+
+
+def test_essential_frames_are_never_dropped():
+    async def main():
+        queue = OutboundQueue(FakeWebSocket(), max_size=2, policy=DROP_OLDEST)
+        queue.put("result-1", essential=True)
+        queue.put("result-2", essential=True)
+        queue.put("progress")
+        queue.put("result-3", essential=True)
+        return queue.close(), queue.dropped
+
+    assert asyncio.run(main()) == (["result-1", "result-2", "result-3"], 1)
+
+
+def test_coalesce_replaces_pending_frame_with_same_key():
+    async def main():
+        websocket = FakeWebSocket()
+        queue = OutboundQueue(websocket, max_size=10, policy=COALESCE)
+        queue.put("status 1", coalesce_key="job")
+        queue.put("status 2", coalesce_key="job")
+        queue.put("other")
+        await queue.flush(timeout=1)
+        queue.close()
+        return websocket.sent, queue.coalesced
+
+    assert asyncio.run(main()) == (["status 2", "other"], 1)
+
+
+class StalledWebSocket:
+    """A client that never reads, so its frames stay queued."""
+    async def send(self, message):
+        await asyncio.Event().wait()
+
+
+def fill_sessions(manager, depths):
+    for index, depth in enumerate(depths):
+        websocket_id = f"ws-{index}"
+        manager.register_websocket(websocket_id, StalledWebSocket())
+        for frame in range(depth):
+            manager.send(websocket_id, f"frame {frame}")
+
+
+def test_outbound_stats_report_the_deepest_queues():
+    async def main():
+        manager = SessionManager()
+        fill_sessions(manager, [3, 1, 5, 2])
+        stats = manager.outbound_stats(top=2)
+        for session in manager.sessions.values():
+            session.outbound.close()
+        return stats
+
+    stats = asyncio.run(main())
+    assert [(entry["websocket_id"], entry["depth"]) for entry in stats] == [("ws-2", 5), ("ws-0", 3)]
+
+
+def test_per_connection_metrics_and_admin_command():
+    async def main():
+        manager = SessionManager()
+        fill_sessions(manager, [3, 1, 5])
+        registry = MetricsRegistry()
+        register_gateway_metrics(registry, session_manager=manager)
+        admin = AdminServer("/unused", session_manager=manager)
+        rendered = registry.render()
+        connections = json.loads(await admin.execute(["connections", "1"]))
+        for session in manager.sessions.values():
+            session.outbound.close()
+        return rendered, connections
+
+    rendered, connections = asyncio.run(main())
+    assert 'gateway_outbound_queue_depth{connection="ws-2"} 5' in rendered
+    assert 'gateway_outbound_send_seconds_max{connection="ws-0"}' in rendered
+    assert [entry["websocket_id"] for entry in connections] == ["ws-2"]
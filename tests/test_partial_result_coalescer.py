@@ -0,0 +1,175 @@
+import asyncio
+import json
+import time
+
+from trading_view_extension.managers.partial_result_coalescer import PartialResultCoalescer
+
+
+class FakeSession:
+    def __init__(self, websocket_id, websocket=True):
+        self.websocket_id = websocket_id
+        self.websocket = websocket
+
+
+class FakeSessionManager:
+    def __init__(self, *websocket_ids):
+        self.sessions = {websocket_id: FakeSession(websocket_id) for websocket_id in websocket_ids}
+        self.sent = []
+
+    def get_session(self, websocket_id):
+        return self.sessions.get(websocket_id)
+
+    def send(self, websocket_id, message):
+        self.sent.append((websocket_id, json.loads(message)["results"]))
+        return True
+
+
+def update(job_id, seq, message_type="partial"):
+    return {"job_id": job_id, "seq": seq, "message_type": message_type}
+
+
+def seqs(results):
+    return [(result["job_id"], result["seq"]) for result in results]
+
+
+def run(test):
+    """Run a test body inside an event loop, as add() schedules flushes on it."""
+    async def main():
+        test()
+    asyncio.run(main())
+
+
+def test_first_update_is_sent_immediately_and_later_ones_batched():
+    def test():
+        sessions = FakeSessionManager("ws")
+        coalescer = PartialResultCoalescer(sessions, interval=60)
+
+        assert coalescer.add("ws", update("job", 0))
+        assert seqs(sessions.sent[0][1]) == [("job", 0)]
+
+        assert coalescer.add("ws", update("job", 2))
+        assert coalescer.add("ws", update("job", 1))
+        assert len(sessions.sent) == 1
+        assert "ws" in coalescer.timers
+
+        coalescer.flush("ws")
+        assert seqs(sessions.sent[1][1]) == [("job", 1), ("job", 2)]
+        assert coalescer.stats() == {"received": 3, "frames": 2, "pending_sessions": 0}
+    run(test)
+
+
+def test_stale_and_duplicate_updates_leave_no_entries():
+    def test():
+        sessions = FakeSessionManager("ws")
+        coalescer = PartialResultCoalescer(sessions, interval=60)
+        coalescer.add("ws", update("job", 5))
+
+        assert not coalescer.add("ws", update("job", 5))
+        assert not coalescer.add("ws", update("job", 3))
+        assert coalescer.pending == {}
+        assert coalescer.received == 1
+    run(test)
+
+
+def test_progress_supersedes_older_progress():
+    def test():
+        sessions = FakeSessionManager("ws")
+        coalescer = PartialResultCoalescer(sessions, interval=60)
+        coalescer.add("ws", update("job", 0))
+
+        assert coalescer.add("ws", update("job", 1, "progress"))
+        assert coalescer.add("ws", update("job", 3, "progress"))
+        assert not coalescer.add("ws", update("job", 2, "progress"))
+        assert coalescer.add("ws", update("job", 4))
+
+        coalescer.flush("ws")
+        assert seqs(sessions.sent[1][1]) == [("job", 3), ("job", 4)]
+    run(test)
+
+
+def test_unnumbered_updates_keep_arrival_order():
+    def test():
+        sessions = FakeSessionManager("ws")
+        coalescer = PartialResultCoalescer(sessions, interval=60)
+        for name in ("a", "b", "c"):
+            coalescer.add("ws", {"job_id": "job", "name": name})
+        coalescer.flush("ws")
+
+        assert [result["name"] for _, results in sessions.sent for result in results] == ["a", "b", "c"]
+    run(test)
+
+
+def test_final_result_waits_for_the_frame_with_its_partials():
+    def test():
+        sessions = FakeSessionManager("ws")
+        coalescer = PartialResultCoalescer(sessions, interval=60)
+        coalescer.add("ws", update("job-1", 0))
+        coalescer.add("ws", update("job-1", 1))
+        coalescer.add("ws", update("job-1", 2, "progress"))
+        coalescer.add("ws", update("job-2", 0))
+        delivered = []
+
+        assert coalescer.finish_job("ws", "job-1", lambda: delivered.append(len(sessions.sent)))
+        # No extra frame inside the interval
+        assert len(sessions.sent) == 1
+        assert delivered == []
+
+        coalescer.flush("ws")  # The scheduled frame
+        assert seqs(sessions.sent[-1][1]) == [("job-1", 1), ("job-2", 0)]
+        assert delivered == [2]
+        assert "job-1" not in coalescer.delivered_seq
+        assert coalescer.frames == 2
+    run(test)
+
+
+def test_final_result_drops_pending_progress_and_is_sent_at_once():
+    def test():
+        sessions = FakeSessionManager("ws")
+        coalescer = PartialResultCoalescer(sessions, interval=60)
+        coalescer.add("ws", update("job-1", 0))
+        coalescer.add("ws", update("job-1", 1, "progress"))
+
+        assert not coalescer.finish_job("ws", "job-1", lambda: None)
+        assert coalescer.pending == {}
+        assert coalescer.timers == {}
+        assert "job-1" not in coalescer.delivered_seq
+        assert len(sessions.sent) == 1
+    run(test)
+
+
+def test_final_result_without_pending_updates_is_sent_at_once():
+    def test():
+        coalescer = PartialResultCoalescer(FakeSessionManager("ws"), interval=60)
+
+        assert not coalescer.finish_job("ws", "job-1", lambda: None)
+        assert not coalescer.finish_job(None, "job-1", lambda: None)
+    run(test)
+
+
+def test_updates_for_detached_session_are_discarded():
+    def test():
+        sessions = FakeSessionManager("ws")
+        sessions.sessions["ws"].websocket = None
+        coalescer = PartialResultCoalescer(sessions, interval=60)
+
+        coalescer.add("ws", update("job", 0))
+
+        assert sessions.sent == []
+        assert "ws" not in coalescer.last_flush
+        assert not coalescer.add("ws", update("job", 0))
+    run(test)
+
+
+def test_quiet_sessions_are_forgotten():
+    def test():
+        sessions = FakeSessionManager("ws-1", "ws-2")
+        coalescer = PartialResultCoalescer(sessions, interval=0.01)
+        coalescer.add("ws-1", update("job-1", 0))
+        assert list(coalescer.last_flush) == ["ws-1"]
+
+        time.sleep(0.02)
+        coalescer.add("ws-2", update("job-2", 0))
+
+        assert list(coalescer.last_flush) == ["ws-2"]
+        assert len(sessions.sent) == 2
+    run(test)
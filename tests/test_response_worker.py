@@ -0,0 +1,126 @@
+import asyncio
+import json
+
+from trading_view_extension.managers.session_manager import SessionManager
+from trading_view_extension.queue.local_sqs import LocalSQSClient
+from trading_view_extension.queue.reply_router import ReplyRouter
+from trading_view_extension.repository.local_db_connection import LocalDBConnection
+from trading_view_extension.workers.response_worker import ResponseWorker
+
+QUEUE_URL = "local://output"
+
+
+class RecordingConsumer:
+    """Hands out the given messages once and records what happens to them."""
+    max_messages = 10
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.deleted = []
+        self.released = []
+
+    async def receive_messages(self, queue_url, wait_time=None):
+        messages, self.messages = self.messages, []
+        return messages
+
+    async def delete_message(self, queue_url, message):
+        self.deleted.append(message["MessageId"])
+
+    async def release_message(self, queue_url, message, delay=None):
+        self.released.append((message["MessageId"], delay))
+
+
+def result_message(message_id, body):
+    return {"MessageId": message_id, "ReceiptHandle": f"rh-{message_id}", "Body": json.dumps(body)}
+
+
+def make_worker(messages, template=None, handoff_delay=2, job_repository=None):
+    sqs = LocalSQSClient()
+    router = ReplyRouter(node_id="node-a", reply_queue_url_template=template, client=sqs)
+    consumer = RecordingConsumer(messages)
+    worker = ResponseWorker(consumer, SessionManager(), job_repository=job_repository, reply_router=router,
+                            handoff_delay=handoff_delay)
+    return worker, consumer, sqs
+
+
+def test_other_nodes_result_is_handed_back_after_a_delay():
+    message = result_message("m-1", {"job_id": "job-1", "reply_to": "node-b", "status": "COMPLETED"})
+    worker, consumer, _ = make_worker([message])
+
+    assert asyncio.run(worker.poll_queue(QUEUE_URL)) == 1
+    # Not at once: the nodes sharing the queue would spin on it
+    assert consumer.released == [("m-1", 2)]
+    assert consumer.deleted == []
+    assert worker.results_handed_back == 1
+
+
+def test_other_nodes_result_is_forwarded_to_its_reply_queue():
+    message = result_message("m-1", {"job_id": "job-1", "reply_to": "node-b", "status": "COMPLETED"})
+    worker, consumer, sqs = make_worker([message], template="local://replies-{node_id}")
+
+    asyncio.run(worker.poll_queue(QUEUE_URL))
+
+    assert consumer.deleted == ["m-1"]
+    assert worker.results_handed_back == 0
+    forwarded = sqs.receive_message(QueueUrl="local://replies-node-b")["Messages"]
+    assert json.loads(forwarded[0]["Body"])["job_id"] == "job-1"
+
+
+def test_processing_failure_is_retried_with_backoff():
+    message = {"MessageId": "m-1", "ReceiptHandle": "rh-m-1", "Body": json.dumps({"job_id": "job-1"})}
+    worker, consumer, _ = make_worker([message])
+
+    async def fail(data, message):
+        raise RuntimeError("boom")
+    worker.manage_processed_job = fail
+
+    asyncio.run(worker.poll_queue(QUEUE_URL))
+
+    # No explicit delay: the consumer's backoff for the receive count applies
+    assert consumer.released == [("m-1", None)]
+
+
+def make_db():
+    db = LocalDBConnection()
+    db.insert_job({
+        "job_id": "job-1", "user_id": "user-1", "tab_id": "tab-1", "websocket_id": "ws-before-restart",
+        "agent": "agent", "status": "PENDING", "action_type": "analysis", "filenames": [], "s3_urls": [],
+    })
+    return db
+
+
+def test_result_for_unknown_session_is_kept_for_job_history():
+    db = make_db()
+    body = {"job_id": "job-1", "websocket_id": "ws-before-restart", "reply_to": "node-a",
+            "status": "COMPLETED", "analysis": "done"}
+    worker, consumer, _ = make_worker([result_message("m-1", body)], job_repository=db)
+
+    asyncio.run(worker.poll_queue(QUEUE_URL))
+
+    assert consumer.deleted == ["m-1"]
+    [job] = next(db.iter_job_history("user-1"))
+    assert job["status"] == "COMPLETED"
+    assert job["result"] == {"job_id": "job-1", "status": "COMPLETED", "analysis": "done"}
+
+
+def test_result_without_a_job_record_is_dropped():
+    body = {"job_id": "unknown-job", "websocket_id": "ws-before-restart", "status": "COMPLETED"}
+    worker, consumer, _ = make_worker([result_message("m-1", body)], job_repository=make_db())
+
+    asyncio.run(worker.poll_queue(QUEUE_URL))
+
+    assert consumer.deleted == ["m-1"]
+
+
+def test_result_that_cannot_be_saved_is_retried():
+    class FailingDB:
+        def save_result(self, job_id, status, result):
+            raise ConnectionError("database unavailable")
+
+    body = {"job_id": "job-1", "websocket_id": "ws-before-restart", "status": "COMPLETED"}
+    worker, consumer, _ = make_worker([result_message("m-1", body)], job_repository=FailingDB())
+
+    asyncio.run(worker.poll_queue(QUEUE_URL))
+
+    assert consumer.deleted == []
+    assert consumer.released == [("m-1", None)]
@@ -0,0 +1,91 @@
+import asyncio
+import json
+import struct
+
+from utils.local_s3 import LocalS3Client
+from trading_view_extension.managers.result_streamer import ResultStreamer
+from trading_view_extension.managers.session_manager import SessionManager
+
+BUCKET = "results"
+PAYLOAD = bytes(range(256)) * 10
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send(self, message):
+        self.frames.append(message)
+
+
+def chunks(frames):
+    """Decode the binary result_chunk frames into (offset, bytes) pairs."""
+    decoded = []
+    for frame in frames:
+        if isinstance(frame, bytes):
+            header_length = struct.unpack(">I", frame[:4])[0]
+            header = json.loads(frame[4:4 + header_length])
+            decoded.append((header["offset"], frame[4 + header_length:]))
+    return decoded
+
+
+def make_streamer(ref_size=len(PAYLOAD)):
+    s3 = LocalS3Client()
+    s3.put_object(Bucket=BUCKET, Key="job-1", Body=PAYLOAD)
+    sessions = SessionManager()
+    websocket = FakeWebSocket()
+    sessions.register_websocket("ws-1", websocket, user_id="user-1")
+    streamer = ResultStreamer(sessions, s3_client=s3, bucket=BUCKET, chunk_size=1000)
+    ref = {"bucket": BUCKET, "key": "job-1"}
+    if ref_size is not None:
+        ref["size"] = ref_size
+    streamer.accept({"job_id": "job-1", "user_id": "user-1", "result_ref": ref}, "ws-1")
+    return streamer, sessions.get_session("ws-1"), websocket
+
+
+async def fetch_and_wait(streamer, session, offset):
+    rejection = streamer.fetch(session, "job-1", offset)
+    if streamer.streams:
+        await asyncio.gather(*streamer.streams.values())
+    return rejection
+
+
+def test_result_is_streamed_in_chunks_from_an_offset():
+    streamer, session, websocket = make_streamer()
+
+    assert asyncio.run(fetch_and_wait(streamer, session, 500)) is None
+
+    received = chunks(websocket.frames)
+    assert [offset for offset, _ in received] == [500, 1500, 2500]
+    assert b"".join(data for _, data in received) == PAYLOAD[500:]
+    assert json.loads(websocket.frames[-1]) == {"type": "result_end", "job_id": "job-1", "size": len(PAYLOAD)}
+
+
+def test_offset_past_the_end_is_rejected():
+    streamer, session, websocket = make_streamer()
+
+    rejection = asyncio.run(fetch_and_wait(streamer, session, len(PAYLOAD) + 1))
+
+    assert rejection["code"] == "invalid_offset"
+    assert rejection["size"] == len(PAYLOAD)
+    assert websocket.frames == []
+
+
+def test_offset_past_the_end_of_an_unsized_reference_is_rejected():
+    streamer, session, websocket = make_streamer(ref_size=None)
+
+    assert asyncio.run(fetch_and_wait(streamer, session, len(PAYLOAD) + 1)) is None
+
+    [frame] = websocket.frames
+    assert json.loads(frame)["code"] == "invalid_offset"
+    assert json.loads(frame)["size"] == len(PAYLOAD)
+
+
+def test_fetch_needs_an_owning_session():
+    streamer, _, _ = make_streamer()
+    sessions = streamer.session_manager
+    sessions.register_websocket("ws-2", FakeWebSocket(), user_id="user-2")
+
+    rejection = streamer.fetch(sessions.get_session("ws-2"), "job-1", 0)
+
+    assert rejection["code"] == "result_not_found"
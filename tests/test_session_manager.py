@@ -0,0 +1,58 @@
+from trading_view_extension.managers.session_manager import SessionManager
+
+
+class FakeWebSocket:
+    async def send(self, message):
+        pass
+
+
+def test_sessions_are_indexed_by_user_and_tab():
+    manager = SessionManager()
+    first, second = FakeWebSocket(), FakeWebSocket()
+    manager.register_websocket("ws-1", first, user_id="user-1", tab_id="tab-1")
+    manager.register_websocket("ws-2", second, user_id="user-1", tab_id="tab-2")
+
+    assert manager.get_websocket("ws-1") is first
+    assert sorted(map(id, manager.get_user_websockets("user-1"))) == sorted([id(first), id(second)])
+    assert manager.get_tab_websockets("tab-2") == [second]
+    assert len(manager) == 2
+
+
+def test_reregistering_moves_index_entries():
+    manager = SessionManager()
+    websocket = FakeWebSocket()
+    manager.register_websocket("ws-1", websocket, user_id="user-1", tab_id="tab-1")
+    manager.register_websocket("ws-1", websocket, user_id="user-2", tab_id="tab-2")
+
+    assert manager.get_user_websockets("user-1") == []
+    assert manager.get_user_websockets("user-2") == [websocket]
+    assert "user-1" not in manager.sessions_by_user
+    assert "tab-1" not in manager.sessions_by_tab
+
+
+def test_job_index():
+    manager = SessionManager()
+    websocket = FakeWebSocket()
+    manager.register_websocket("ws-1", websocket, user_id="user-1")
+    manager.bind_job("ws-1", "job-1")
+    manager.bind_job("ws-1", "job-2")
+    manager.bind_job("missing", "job-3")
+
+    assert manager.get_websocket_for_job("job-1") is websocket
+    assert manager.get_session_for_job("job-3") is None
+    assert manager.release_job("job-1") == "ws-1"
+    assert manager.get_session_for_job("job-1") is None
+    assert manager.get_session("ws-1").job_ids == {"job-2"}
+
+
+def test_remove_clears_every_index():
+    manager = SessionManager()
+    manager.register_websocket("ws-1", FakeWebSocket(), user_id="user-1", tab_id="tab-1")
+    manager.bind_job("ws-1", "job-1")
+
+    assert manager.remove_websocket("ws-1").websocket_id == "ws-1"
+    assert manager.remove_websocket("ws-1") is None
+    assert manager.sessions == {}
+    assert manager.sessions_by_user == {}
+    assert manager.sessions_by_tab == {}
+    assert manager.sessions_by_job == {}
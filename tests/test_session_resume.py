@@ -0,0 +1,148 @@
+import time
+
+from trading_view_extension.managers.session_manager import SessionManager
+
+
+class FakeWebSocket:
+    async def send(self, message):
+        pass
+
+
+def open_detached(manager, user_id="user-1", tab_id="tab-1"):
+    """Open a session, drop its connection and return (websocket_id, resume_token)."""
+    websocket = FakeWebSocket()
+    websocket_id, resumed = manager.open_session(websocket, user_id=user_id, tab_id=tab_id)
+    assert not resumed
+    resume_token = manager.resume_token_for(websocket_id)
+    manager.detach_websocket(websocket)
+    return websocket_id, resume_token
+
+
+def test_resume_token_is_not_the_websocket_id():
+    manager = SessionManager()
+    websocket_id, resume_token = open_detached(manager)
+
+    assert resume_token
+    assert resume_token != websocket_id
+
+
+def test_resume_with_token_reattaches_session():
+    manager = SessionManager()
+    websocket_id, resume_token = open_detached(manager)
+    assert websocket_id in manager.detached
+
+    websocket = FakeWebSocket()
+    resumed_id, resumed = manager.open_session(websocket, user_id="user-1", session_id=websocket_id,
+                                               resume_token=resume_token)
+
+    assert (resumed_id, resumed) == (websocket_id, True)
+    assert manager.get_websocket(websocket_id) is websocket
+    assert websocket_id not in manager.detached
+    # The presented token is spent; the client gets a new one
+    assert manager.resume_token_for(websocket_id) != resume_token
+
+
+def test_resume_refused_with_websocket_id_alone():
+    manager = SessionManager()
+    websocket_id, _ = open_detached(manager)
+
+    for resume_token in (None, websocket_id, "guess"):
+        new_id, resumed = manager.open_session(FakeWebSocket(), user_id="user-1", session_id=websocket_id,
+                                               resume_token=resume_token)
+        assert not resumed
+        assert new_id != websocket_id
+    assert manager.get_websocket(websocket_id) is None
+
+
+def test_spent_token_cannot_be_replayed():
+    manager = SessionManager()
+    websocket_id, resume_token = open_detached(manager)
+    websocket = FakeWebSocket()
+    manager.open_session(websocket, user_id="user-1", session_id=websocket_id, resume_token=resume_token)
+    manager.detach_websocket(websocket)
+
+    _, resumed = manager.open_session(FakeWebSocket(), user_id="user-1", session_id=websocket_id,
+                                      resume_token=resume_token)
+
+    assert not resumed
+
+
+def test_resume_refused_for_another_user():
+    manager = SessionManager()
+    websocket_id, resume_token = open_detached(manager)
+
+    new_id, resumed = manager.open_session(FakeWebSocket(), user_id="user-2", session_id=websocket_id,
+                                           resume_token=resume_token)
+
+    assert not resumed
+    assert new_id != websocket_id
+    assert manager.get_websocket(websocket_id) is None
+
+
+def test_resume_refused_without_user():
+    manager = SessionManager()
+    websocket_id, resume_token = open_detached(manager)
+
+    _, resumed = manager.open_session(FakeWebSocket(), session_id=websocket_id, resume_token=resume_token)
+
+    assert not resumed
+
+
+def test_resume_refused_for_session_without_user():
+    manager = SessionManager()
+    websocket_id, resume_token = open_detached(manager, user_id=None)
+
+    _, resumed = manager.open_session(FakeWebSocket(), user_id="user-1", session_id=websocket_id,
+                                      resume_token=resume_token)
+
+    assert not resumed
+
+
+def test_detached_session_expires():
+    manager = SessionManager(resume_ttl=0)
+    websocket_id, resume_token = open_detached(manager)
+
+    _, resumed = manager.open_session(FakeWebSocket(), user_id="user-1", session_id=websocket_id,
+                                      resume_token=resume_token)
+
+    assert not resumed
+    assert manager.get_session(websocket_id) is None
+    assert websocket_id not in manager.detached
+
+
+def test_results_for_detached_session_are_replayed_in_order():
+    manager = SessionManager(replay_size=2)
+    websocket_id, _ = open_detached(manager)
+
+    for message in ("first", "second", "third"):
+        assert manager.send(websocket_id, message)
+
+    assert manager.drain_replay(websocket_id) == ["second", "third"]
+    assert manager.drain_replay(websocket_id) == []
+
+
+def test_replay_skips_expired_results():
+    manager = SessionManager(replay_ttl=0.01)
+    websocket_id, _ = open_detached(manager)
+    manager.buffer_result(websocket_id, "old")
+    time.sleep(0.02)
+    manager.buffer_result(websocket_id, "new")
+
+    assert manager.drain_replay(websocket_id) == ["new"]
+
+
+def test_jobs_move_to_resumed_session():
+    manager = SessionManager()
+    websocket_id, resume_token = open_detached(manager)
+
+    # A job submitted before the handshake lands in an implicit session
+    websocket = FakeWebSocket()
+    implicit_id, _ = manager.open_session(websocket, user_id="user-1")
+    manager.bind_job(implicit_id, "job-1")
+
+    resumed_id, resumed = manager.open_session(websocket, user_id="user-1", session_id=websocket_id,
+                                               resume_token=resume_token)
+
+    assert (resumed_id, resumed) == (websocket_id, True)
+    assert manager.get_session_for_job("job-1").websocket_id == websocket_id
+    assert manager.get_session(implicit_id) is None
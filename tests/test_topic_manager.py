@@ -0,0 +1,91 @@
+import json
+import zlib
+
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+
+from trading_view_extension.managers.topic_manager import TopicManager
+
+
+class FakeWebSocket:
+    def __init__(self, extensions=()):
+        self.extensions = list(extensions)
+
+
+class FakeSession:
+    def __init__(self, websocket_id, websocket):
+        self.websocket_id = websocket_id
+        self.websocket = websocket
+
+
+class FakeSessionManager:
+    def __init__(self):
+        self.sessions = {}
+        self.sent = []
+
+    def add(self, websocket_id, websocket):
+        self.sessions[websocket_id] = FakeSession(websocket_id, websocket)
+
+    def get_session(self, websocket_id):
+        return self.sessions.get(websocket_id)
+
+    def send(self, websocket_id, message):
+        self.sent.append((websocket_id, message))
+        return True
+
+
+RESULT = {
+    "job_id": "job-1", "asset": "BTC", "status": "COMPLETED", "analysis": "x" * 2000,
+    "websocket_id": "private", "user_id": "user-1", "tab_id": "tab-1", "s3_urls": ["s3://bucket/key"],
+}
+
+
+def test_broadcast_carries_only_public_fields():
+    sessions = FakeSessionManager()
+    sessions.add("ws-1", FakeWebSocket())
+    topics = TopicManager(sessions)
+    topics.subscribe("ws-1", ["BTC"])
+
+    assert topics.publish("BTC", RESULT) == 1
+    data = json.loads(sessions.sent[0][1])["data"]
+    assert set(data) == {"job_id", "asset", "status", "analysis"}
+
+
+def test_compressed_frame_is_built_once_and_skipped_on_deflate_connections():
+    sessions = FakeSessionManager()
+    sessions.add("ws-1", FakeWebSocket())
+    sessions.add("ws-2", FakeWebSocket())
+    sessions.add("ws-3", FakeWebSocket([PerMessageDeflate(False, False, 15, 15)]))
+    topics = TopicManager(sessions, compression_min_bytes=100)
+    for websocket_id in ("ws-1", "ws-2", "ws-3"):
+        topics.subscribe(websocket_id, ["BTC"], compress=True)
+
+    assert topics.publish("BTC", RESULT, exclude="ws-1") == 2
+    frames = dict(sessions.sent)
+    assert isinstance(frames["ws-2"], bytes)
+    assert json.loads(zlib.decompress(frames["ws-2"]))["asset"] == "BTC"
+    # permessage-deflate compresses the text frame; a zlib frame would be compressed twice
+    assert isinstance(frames["ws-3"], str)
+    assert not topics.compresses("ws-3", "BTC")
+
+
+def test_subscriptions_per_session_are_capped():
+    sessions = FakeSessionManager()
+    sessions.add("ws-1", FakeWebSocket())
+    topics = TopicManager(sessions, max_topics=2)
+
+    assert topics.subscribe("ws-1", ["BTC", "ETH"]) == ["BTC", "ETH"]
+    assert topics.subscribe("ws-1", ["BTC"]) == ["BTC", "ETH"]
+    assert topics.subscribe("ws-1", ["SOL"]) is None
+    assert topics.subscriber_count("SOL") == 0
+    assert topics.unsubscribe("ws-1", ["ETH"]) == ["BTC"]
+    assert topics.subscribe("ws-1", ["SOL"]) == ["BTC", "SOL"]
+
+
+def test_expired_sessions_are_unsubscribed_lazily():
+    sessions = FakeSessionManager()
+    topics = TopicManager(sessions)
+    topics.subscribe("gone", ["BTC"])
+
+    assert topics.publish("BTC", RESULT) == 0
+    assert topics.subscribers == {}
+    assert topics.topics_by_session == {}
@@ -0,0 +1,146 @@
+import math
+import time
+from collections import OrderedDict
+from config import (
+    logger,
+    RATE_LIMIT_PER_USER,
+    RATE_LIMIT_BURST,
+    MAX_INFLIGHT_PER_USER,
+    MAX_INFLIGHT_PER_TAB,
+    MAX_INFLIGHT_GLOBAL,
+    INFLIGHT_TTL,
+)
+
+# Suggested retry delay when a concurrency limit (rather than the rate) rejects a job
+INFLIGHT_RETRY_AFTER = 1.0
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def take(self, now):
+        """
+        Take one token. Returns 0 on success, or the seconds until a token is available.
+        """
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    Decides whether a new analysis job may be accepted.
+
+    Each user has a token bucket limiting the submission rate, and the number of
+    in-flight jobs is capped per user, per tab and globally. Jobs hold their
+    in-flight slot until release() is called with the job_id (when the result is
+    delivered or the job fails) or until INFLIGHT_TTL expires.
+    """
+    def __init__(self, rate=RATE_LIMIT_PER_USER, burst=RATE_LIMIT_BURST,
+                 max_per_user=MAX_INFLIGHT_PER_USER, max_per_tab=MAX_INFLIGHT_PER_TAB,
+                 max_global=MAX_INFLIGHT_GLOBAL, inflight_ttl=INFLIGHT_TTL):
+        self.rate = rate
+        self.burst = burst
+        self.max_per_user = max_per_user
+        self.max_per_tab = max_per_tab
+        self.max_global = max_global
+        self.inflight_ttl = inflight_ttl
+        self.buckets = {}               # {user_id: TokenBucket}
+        self.inflight = OrderedDict()   # {job_id: (user_id, tab_key, admitted_at)}, oldest first
+        self.inflight_by_user = {}      # {user_id: count}
+        self.inflight_by_tab = {}       # {(user_id, tab_id): count}
+        self.admitted = 0
+        self.rejected = 0
+        logger.info("AdmissionController initialized")
+
+    def try_admit(self, user_id, tab_id, job_id):
+        """
+        Admit a job or explain why not.
+
+        Returns:
+            None if the job was admitted, otherwise a rejection dictionary with a
+            machine-readable "code" and "retry_after" in seconds, ready to send to
+            the client.
+        """
+        now = time.monotonic()
+        self._expire(now)
+        tab_key = (user_id, tab_id)
+
+        if len(self.inflight) >= self.max_global:
+            return self._reject("overloaded", INFLIGHT_RETRY_AFTER, "Server is at capacity.")
+        if self.inflight_by_user.get(user_id, 0) >= self.max_per_user:
+            return self._reject("too_many_inflight", INFLIGHT_RETRY_AFTER, "Too many analyses in progress.")
+        if self.inflight_by_tab.get(tab_key, 0) >= self.max_per_tab:
+            return self._reject("too_many_inflight", INFLIGHT_RETRY_AFTER, "Too many analyses in progress for this tab.")
+
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = TokenBucket(self.rate, self.burst, now)
+        wait = bucket.take(now)
+        if wait:
+            return self._reject("rate_limited", wait, "Too many requests.")
+
+        self.inflight[job_id] = (user_id, tab_key, now)
+        self.inflight_by_user[user_id] = self.inflight_by_user.get(user_id, 0) + 1
+        self.inflight_by_tab[tab_key] = self.inflight_by_tab.get(tab_key, 0) + 1
+        self.admitted += 1
+        if self.admitted % 1000 == 0:
+            self._prune_buckets(now)
+        return None
+
+    def release(self, job_id):
+        """
+        Free the in-flight slot held by job_id. Unknown job ids are ignored.
+        """
+        entry = self.inflight.pop(job_id, None)
+        if entry is None:
+            return
+        user_id, tab_key, _ = entry
+        self._decrement(self.inflight_by_user, user_id)
+        self._decrement(self.inflight_by_tab, tab_key)
+
+    def _reject(self, code, retry_after, message):
+        self.rejected += 1
+        # Round up so clients never retry a moment too early
+        return {"type": "error", "code": code, "retry_after": math.ceil(retry_after * 1000) / 1000, "message": message}
+
+    def _expire(self, now):
+        """
+        Reclaim slots of jobs whose result never came back.
+        """
+        cutoff = now - self.inflight_ttl
+        while self.inflight:
+            job_id, (_, _, admitted_at) = next(iter(self.inflight.items()))
+            if admitted_at > cutoff:
+                break
+            logger.warning("In-flight slot of job %s expired without a result", job_id)
+            self.release(job_id)
+
+    def _prune_buckets(self, now):
+        """
+        Drop buckets that have refilled completely; they are recreated on demand.
+        """
+        for user_id, bucket in list(self.buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self.buckets[user_id]
+
+    @staticmethod
+    def _decrement(counts, key):
+        remaining = counts.get(key, 0) - 1
+        if remaining > 0:
+            counts[key] = remaining
+        else:
+            counts.pop(key, None)
@@ -1,6 +1,9 @@
 from typing import List
 from trading_view_extension.queue.sqs_queue_publisher_interface import IQueuePublisher
 from trading_view_extension.queue.sqs_queue_publisher import SQSQueuePublisher
+from trading_view_extension.queue.reply_router import ReplyRouter
+from trading_view_extension.queue.priority_lanes import PriorityLanes
+from utils.tracing import Trace
 
 from config import logger
 
@@ -8,8 +11,11 @@ class AnalysisTaskManager:
     """
     Business facade for orchestrating creation and publication of new analysis tasks.
     """
-    def __init__(self,queue_publisher: SQSQueuePublisher):
+    def __init__(self,queue_publisher: SQSQueuePublisher, reply_router: ReplyRouter = None,
+                 lanes: PriorityLanes = None):
         self.queue_publisher = queue_publisher
+        self.reply_router = reply_router
+        self.lanes = lanes
         logger.info("AnalysisTaskManager initialized")
 
     async def publish_analysis_task(self,
@@ -23,9 +29,16 @@ class AnalysisTaskManager:
                                     status:str,
                                     websocket_id:str,
                                     filenames:List[str],
-                                    file_paths:List[str]) -> None:
+                                    file_paths:List[str],
+                                    expires_at: float = None,
+                                    user_tier: str = None,
+                                    trace: Trace = None) -> None:
         """
         Publish a new analysis job to the “analysis-tasks” queue.
+
+        When expires_at (epoch seconds) is set, nobody is waiting for the result
+        after that moment; workers should skip jobs that are already past it.
+        A trace's context travels with the job as SQS message attributes.
         """
         job = {
             "task_type": "analysis_task",
@@ -39,7 +52,12 @@ class AnalysisTaskManager:
             "status": status,
             "websocket_id": websocket_id,
             "filenames" : filenames,
-            "file_paths":file_paths
+            "file_paths":file_paths,
+            "expires_at": expires_at
         }
-        await self.queue_publisher.publish_task(job)
-        logger.info(f"Published analysis task for job {job_id}")
\ No newline at end of file
+        if self.lanes:
+            self.lanes.stamp(job, user_tier=user_tier)
+        if self.reply_router:
+            self.reply_router.stamp(job)
+        await self.queue_publisher.publish_task(job, message_attributes=trace.message_attributes() if trace else None)
+        logger.info("Published analysis task for job %s", job_id)
\ No newline at end of file
@@ -0,0 +1,111 @@
+import asyncio
+import time
+from collections import OrderedDict
+from config import logger, CANCEL_ON_DISCONNECT, CANCEL_GRACE_PERIOD, INFLIGHT_TTL
+from trading_view_extension.repository.db_connection import DBConnection
+from trading_view_extension.queue.sqs_queue_publisher_interface import IQueuePublisher
+from trading_view_extension.managers.session_manager import SessionManager
+from trading_view_extension.managers.admission_controller import AdmissionController
+
+CANCELLED = "CANCELLED"
+
+
+class CancellationManager:
+    """
+    Cancels jobs on request or, when enabled, when their tab goes away.
+
+    A cancelled job is marked CANCELLED in the repository, a lightweight
+    {"task_type": "cancel_task"} notice is published for the analysis workers, and
+    the gateway remembers the job id so a pipeline that has not published yet
+    skips publishing and a late result is dropped instead of delivered.
+    """
+    def __init__(self, db: DBConnection, queue_publisher: IQueuePublisher, session_manager: SessionManager,
+                 admission_controller: AdmissionController = None, grace_period=CANCEL_GRACE_PERIOD,
+                 remember_for=INFLIGHT_TTL, cancel_on_disconnect=CANCEL_ON_DISCONNECT):
+        """
+        Args:
+            cancel_on_disconnect: Cancel the jobs of sessions that do not resume within
+                `grace_period` (see CANCEL_ON_DISCONNECT). Only sound when a
+                reconnecting client is sure to reach this process again.
+        """
+        self.db = db
+        self.queue_publisher = queue_publisher
+        self.session_manager = session_manager
+        self.admission_controller = admission_controller
+        self.grace_period = grace_period
+        self.remember_for = remember_for
+        self.cancel_on_disconnect = cancel_on_disconnect
+        self.cancelled = OrderedDict()  # {job_id: cancelled_at}, oldest first
+        self.pending_timers = {}        # {websocket_id: asyncio.Task}
+        logger.info("CancellationManager initialized")
+
+    def is_cancelled(self, job_id):
+        self._forget_old()
+        return job_id in self.cancelled
+
+    async def cancel(self, job_id, reason="user"):
+        """
+        Cancel a job. Cancelling an already cancelled job is a no-op.
+
+        Returns:
+            True if the job was cancelled by this call.
+        """
+        if job_id is None or self.is_cancelled(job_id):
+            return False
+        self.cancelled[job_id] = time.monotonic()
+        self.session_manager.release_job(job_id)
+        if self.admission_controller:
+            self.admission_controller.release(job_id)
+        await asyncio.to_thread(self.db.update_job_status, job_id, CANCELLED)
+        try:
+            await self.queue_publisher.publish_task({
+                "task_type": "cancel_task",
+                "action_type": "cancel",
+                "job_id": job_id,
+                "reason": reason,
+            })
+        except Exception as e:
+            # Workers still see the CANCELLED status in the repository
+            logger.error("Failed to publish cancellation notice for job %s: %s", job_id, e)
+        logger.info("Cancelled job %s (%s)", job_id, reason)
+        return True
+
+    def schedule_disconnect_cancel(self, websocket_id):
+        """
+        Cancel the in-flight jobs of a disconnected session unless it resumes
+        within the grace period. Does nothing unless cancel_on_disconnect is set.
+        """
+        if not self.cancel_on_disconnect:
+            return
+        session = self.session_manager.get_session(websocket_id)
+        if session is None or not session.job_ids or websocket_id in self.pending_timers:
+            return
+        self.pending_timers[websocket_id] = asyncio.create_task(self._cancel_after_grace(websocket_id))
+
+    def on_resume(self, websocket_id):
+        """
+        Keep the jobs of a session that came back within the grace period.
+        """
+        timer = self.pending_timers.pop(websocket_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    async def _cancel_after_grace(self, websocket_id):
+        try:
+            await asyncio.sleep(self.grace_period)
+        except asyncio.CancelledError:
+            return
+        self.pending_timers.pop(websocket_id, None)
+        session = self.session_manager.get_session(websocket_id)
+        if session is None or session.websocket is not None or not session.job_ids:
+            return
+        for job_id in list(session.job_ids):
+            await self.cancel(job_id, reason="disconnected")
+
+    def _forget_old(self):
+        cutoff = time.monotonic() - self.remember_for
+        while self.cancelled:
+            job_id, cancelled_at = next(iter(self.cancelled.items()))
+            if cancelled_at > cutoff:
+                break
+            del self.cancelled[job_id]
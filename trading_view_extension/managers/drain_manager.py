@@ -0,0 +1,139 @@
+import asyncio
+import json
+import signal
+import time
+from config import (
+    logger,
+    DRAIN_PIPELINE_TIMEOUT,
+    DRAIN_GRACE_PERIOD,
+    DRAIN_FLUSH_TIMEOUT,
+    DRAIN_RECONNECT_DELAY,
+)
+from trading_view_extension.managers.session_manager import SessionManager
+from trading_view_extension.managers.partial_result_coalescer import PartialResultCoalescer
+from trading_view_extension.workers.response_worker import ResponseWorker
+from trading_view_extension.managers.result_streamer import ResultStreamer
+
+SERVICE_RESTART = 1012  # WebSocket close code: the server is restarting, reconnect
+
+
+class DrainManager:
+    """
+    Takes a gateway process out of service without losing jobs or results.
+
+    Draining runs in steps, each bounded so a deploy never hangs:
+      1. Stop listening and refuse new uploads; other processes on the port (or
+         the next deployment) take new connections.
+      2. Let uploads already being processed finish, so their S3 upload, DB
+         insert and SQS publish all complete.
+      3. Keep delivering results while this process still has jobs in flight,
+         for up to `grace_period` seconds.
+      4. Stop the ResponseWorker after its current round, so every received
+         result is deleted from (or released back to) its queue.
+      5. Flush pending partial results, let running result streams finish, send
+         each session a reconnect hint and wait for outbound queues to empty.
+         Sessions do not survive the restart: results that arrive afterwards
+         are kept by the ResponseWorker for job_history.
+      6. Close every connection with 1012 (service restart) and stop the server.
+      7. Hand prefetched results back to the queue for other gateways.
+
+    A second signal skips whatever waiting is left.
+    """
+    def __init__(self, server, session_manager: SessionManager, response_worker: ResponseWorker = None,
+                 partial_coalescer: PartialResultCoalescer = None, result_streamer: ResultStreamer = None,
+                 pipeline_timeout=DRAIN_PIPELINE_TIMEOUT,
+                 grace_period=DRAIN_GRACE_PERIOD, flush_timeout=DRAIN_FLUSH_TIMEOUT,
+                 reconnect_delay=DRAIN_RECONNECT_DELAY):
+        self.server = server
+        self.session_manager = session_manager
+        self.response_worker = response_worker
+        self.partial_coalescer = partial_coalescer
+        self.result_streamer = result_streamer
+        self.pipeline_timeout = pipeline_timeout
+        self.grace_period = grace_period
+        self.flush_timeout = flush_timeout
+        self.reconnect_delay = reconnect_delay
+        self.draining = False
+        self.forced = False
+        self.task = None
+        logger.info("DrainManager initialized")
+
+    def install_signal_handlers(self, signals=(signal.SIGTERM, signal.SIGINT)):
+        loop = asyncio.get_running_loop()
+        for sig in signals:
+            loop.add_signal_handler(sig, self.request_drain, sig.name)
+
+    def request_drain(self, reason="admin"):
+        """
+        Start draining, or skip the remaining waits if a drain is already running.
+        """
+        if self.draining:
+            self.forced = True
+            logger.warning(f"Received {reason} while draining; closing without further waiting")
+            return
+        logger.info(f"Received {reason}; draining")
+        self.draining = True
+        self.task = asyncio.create_task(self.drain())
+
+    async def drain(self) -> None:
+        started = time.monotonic()
+        self.server.stop_accepting()
+
+        await self.wait_until(lambda: self.server.pipelines == 0, self.pipeline_timeout,
+                              "in-flight uploads", lambda: self.server.pipelines)
+        await self.wait_until(lambda: not self.session_manager.sessions_by_job, self.grace_period,
+                              "results of in-flight jobs", lambda: len(self.session_manager.sessions_by_job))
+        if self.response_worker is not None:
+            await self.response_worker.stop(timeout=self.pipeline_timeout)
+
+        if self.partial_coalescer is not None:
+            for websocket_id in list(self.partial_coalescer.pending):
+                self.partial_coalescer.flush(websocket_id)
+        if self.result_streamer is not None:
+            await self.wait_until(lambda: not self.result_streamer.streams, self.flush_timeout,
+                                  "result streams", lambda: len(self.result_streamer.streams))
+        hint = json.dumps({
+            "type": "reconnect",
+            "reason": "server_restart",
+            "retry_after": self.reconnect_delay,
+            # Sessions live in process memory and do not survive the restart
+            "session_resumable": False,
+            "message": "Server is restarting; reconnect. Results of jobs still running "
+                       "will be listed by job_history.",
+        })
+        for session in list(self.session_manager.sessions.values()):
+            if session.websocket is not None:
+                self.session_manager.send(session.websocket_id, hint)
+        await self.flush_outbound()
+
+        await self.server.close_connections(SERVICE_RESTART, "Service restart")
+        if self.response_worker is not None:
+            # May wait out a long poll, so it comes after the clients are gone
+            await self.response_worker.close()
+        logger.info(f"Drain finished in {time.monotonic() - started:.2f}s "
+                    f"({len(self.session_manager.sessions_by_job)} jobs still in flight)")
+
+    async def wait_until(self, condition, timeout, what, remaining) -> None:
+        """
+        Poll `condition` until it holds, `timeout` passes or the drain is forced.
+        """
+        deadline = time.monotonic() + timeout
+        while not condition() and not self.forced:
+            if time.monotonic() >= deadline:
+                logger.warning(f"Gave up waiting for {what} after {timeout}s ({remaining()} left)")
+                return
+            await asyncio.sleep(0.05)
+
+    async def flush_outbound(self) -> None:
+        queues = [session.outbound for session in self.session_manager.sessions.values()
+                  if session.outbound is not None]
+        if not queues or self.forced:
+            return
+        results = await asyncio.gather(*(outbound.flush(self.flush_timeout) for outbound in queues),
+                                       return_exceptions=True)
+        stuck = sum(1 for result in results if isinstance(result, Exception))
+        if stuck:
+            logger.warning(f"{stuck} connections still had unsent frames after {self.flush_timeout}s")
+
+    def stats(self) -> dict:
+        return {"draining": self.draining, "forced": self.forced}
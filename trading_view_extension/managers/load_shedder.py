@@ -0,0 +1,69 @@
+from config import logger, MAX_INFLIGHT_PIPELINES
+from utils.circuit_breaker import CircuitBreaker, OPEN
+
+
+class LoadShedder:
+    """
+    Overload protection for the upload pipeline.
+
+    Holds one circuit breaker per upstream dependency and a global limit on
+    upload pipelines running at once. While any breaker is open the gateway is
+    degraded: new uploads are rejected immediately, but results keep flowing.
+    """
+    DEPENDENCIES = ("s3", "db", "sqs")
+
+    def __init__(self, max_inflight=MAX_INFLIGHT_PIPELINES, breakers=None):
+        self.max_inflight = max_inflight
+        self.breakers = breakers or {name: CircuitBreaker(name) for name in self.DEPENDENCIES}
+        self.inflight = 0
+        self.shed = 0
+        logger.info("LoadShedder initialized")
+
+    def breaker(self, name):
+        return self.breakers[name]
+
+    @property
+    def degraded(self):
+        return any(breaker.state == OPEN for breaker in self.breakers.values())
+
+    def try_acquire(self):
+        """
+        Reserve a pipeline slot.
+
+        Returns:
+            None if the upload may proceed (call release() when it finishes),
+            otherwise a rejection dictionary ready to send to the client.
+        """
+        open_breakers = [b for b in self.breakers.values() if b.state == OPEN]
+        if open_breakers:
+            self.shed += 1
+            return self.degraded_rejection(max(b.retry_after() for b in open_breakers))
+        if self.inflight >= self.max_inflight:
+            self.shed += 1
+            return {"type": "error", "code": "overloaded", "retry_after": 1.0, "message": "Server is busy."}
+        self.inflight += 1
+        return None
+
+    @staticmethod
+    def degraded_rejection(retry_after):
+        """
+        Rejection sent for an upload refused because a dependency's breaker is open,
+        up front or part-way through the pipeline (CircuitOpenError).
+        """
+        return {
+            "type": "error",
+            "code": "degraded",
+            "retry_after": round(retry_after, 3),
+            "message": "Uploads are temporarily unavailable; results are still delivered.",
+        }
+
+    def release(self):
+        self.inflight = max(0, self.inflight - 1)
+
+    def stats(self):
+        return {
+            "degraded": self.degraded,
+            "inflight_pipelines": self.inflight,
+            "shed": self.shed,
+            "breakers": {name: breaker.stats() for name, breaker in self.breakers.items()},
+        }
@@ -0,0 +1,190 @@
+import asyncio
+import time
+from collections import deque
+from config import logger, OUTBOUND_QUEUE_SIZE, OUTBOUND_OVERFLOW_POLICY
+from utils.metrics import REGISTRY, STAGE_SECONDS
+
+RESULT_SEND_SECONDS = STAGE_SECONDS.labels("result_send")
+RESULT_QUEUE_WAIT_SECONDS = STAGE_SECONDS.labels("result_queue_wait")
+OUTBOUND_FRAMES = REGISTRY.counter(
+    "gateway_outbound_frames_total", "Outbound frames by outcome.", labels=("outcome",)
+)
+FRAMES_DROPPED = OUTBOUND_FRAMES.labels("dropped")
+FRAMES_COALESCED = OUTBOUND_FRAMES.labels("coalesced")
+FRAMES_SENT = OUTBOUND_FRAMES.labels("sent")
+
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+
+class _Frame:
+    __slots__ = ("message", "key", "enqueued_at", "essential")
+
+    def __init__(self, message, key, enqueued_at, essential=False):
+        self.message = message
+        self.key = key
+        self.enqueued_at = enqueued_at
+        self.essential = essential
+
+
+class OutboundQueue:
+    """
+    Bounded queue of outgoing frames for one connection, drained by its own writer
+    task, so a slow or stalled client only ever delays its own messages.
+
+    Overflow policies:
+      - "drop_oldest": discard the oldest pending frame.
+      - "coalesce": a frame with a coalesce key replaces the pending frame with the
+        same key (e.g. superseded status updates for one job); on overflow the
+        oldest frame is discarded.
+      - "disconnect": close the connection of a consumer that cannot keep up.
+
+    Essential frames (final results, which are not sent again) are never
+    discarded: overflow discards the oldest other frame instead, or the incoming
+    frame if every pending one is essential. Essential frames may therefore take
+    the queue past `max_size`; admission control bounds how many there can be.
+    """
+    def __init__(self, websocket, websocket_id=None, max_size=OUTBOUND_QUEUE_SIZE, policy=OUTBOUND_OVERFLOW_POLICY):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown outbound overflow policy '{policy}', expected one of {OVERFLOW_POLICIES}")
+        self.websocket = websocket
+        self.websocket_id = websocket_id
+        self.max_size = max_size
+        self.policy = policy
+        self.frames = deque()
+        self.pending_by_key = {}  # {coalesce_key: _Frame}, only used by the coalesce policy
+        self.ready = asyncio.Event()
+        self.closed = False
+        # Per-connection statistics
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.last_send_latency = 0.0
+        self.max_send_latency = 0.0
+        self.total_send_latency = 0.0
+        self.total_queue_delay = 0.0
+        self.writer = asyncio.create_task(self._drain())
+
+    def __len__(self):
+        return len(self.frames)
+
+    def put(self, message, coalesce_key=None, essential=False):
+        """
+        Queue a frame for sending without waiting for the client.
+
+        Args:
+            message: The frame to send.
+            coalesce_key: Optional key; a pending frame with the same key is replaced.
+            essential: Never discard this frame on overflow.
+
+        Returns:
+            False if the queue is already closed, True otherwise.
+        """
+        if self.closed:
+            return False
+        if coalesce_key is not None and self.policy == COALESCE:
+            pending = self.pending_by_key.get(coalesce_key)
+            if pending is not None:
+                pending.message = message
+                self.coalesced += 1
+                FRAMES_COALESCED.inc()
+                return True
+
+        if len(self.frames) >= self.max_size:
+            if self.policy == DISCONNECT:
+                logger.warning("Outbound queue full for WebSocket %s; disconnecting slow consumer", self.websocket_id)
+                # Pending frames stay queued so close() can hand them over for replay
+                self.frames.append(_Frame(message, coalesce_key, time.monotonic(), essential))
+                self.closed = True
+                self.writer.cancel()
+                asyncio.ensure_future(self.websocket.close(code=1013, reason="Slow consumer"))
+                return True
+            victim = next((frame for frame in self.frames if not frame.essential), None)
+            if victim is None and not essential:
+                # Only essential frames are pending; this one is the oldest that may go
+                self._count_drop()
+                return True
+            if victim is not None:
+                self.frames.remove(victim)
+                if victim.key is not None and self.pending_by_key.get(victim.key) is victim:
+                    del self.pending_by_key[victim.key]
+                self._count_drop()
+
+        frame = _Frame(message, coalesce_key, time.monotonic(), essential)
+        self.frames.append(frame)
+        if coalesce_key is not None and self.policy == COALESCE:
+            self.pending_by_key[coalesce_key] = frame
+        self.ready.set()
+        return True
+
+    def _count_drop(self):
+        self.dropped += 1
+        FRAMES_DROPPED.inc()
+        if self.dropped == 1:
+            logger.warning("Outbound queue full for WebSocket %s; dropping frames", self.websocket_id)
+
+    def close(self):
+        """
+        Stop the writer and return the frames that were never sent, oldest first.
+        """
+        self.closed = True
+        self.writer.cancel()
+        unsent = [frame.message for frame in self.frames]
+        self.frames.clear()
+        self.pending_by_key.clear()
+        return unsent
+
+    async def flush(self, timeout=None):
+        """
+        Wait until every queued frame has been written (or the queue is closed).
+        """
+        async def wait_empty():
+            while self.frames and not self.closed:
+                await asyncio.sleep(0.01)
+        await asyncio.wait_for(wait_empty(), timeout)
+
+    def stats(self):
+        return {
+            "websocket_id": self.websocket_id,
+            "depth": len(self.frames),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "last_send_ms": round(self.last_send_latency * 1000, 3),
+            "max_send_ms": round(self.max_send_latency * 1000, 3),
+            "avg_send_ms": round(self.total_send_latency * 1000 / self.sent, 3) if self.sent else 0.0,
+            "avg_queue_delay_ms": round(self.total_queue_delay * 1000 / self.sent, 3) if self.sent else 0.0,
+        }
+
+    async def _drain(self):
+        try:
+            while True:
+                if not self.frames:
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+                frame = self.frames.popleft()
+                if frame.key is not None and self.pending_by_key.get(frame.key) is frame:
+                    del self.pending_by_key[frame.key]
+                started = time.monotonic()
+                try:
+                    await self.websocket.send(frame.message)
+                except Exception:
+                    self.frames.appendleft(frame)  # Hand it back to close() for replay
+                    raise
+                finished = time.monotonic()
+                self.sent += 1
+                FRAMES_SENT.inc()
+                self.last_send_latency = finished - started
+                self.max_send_latency = max(self.max_send_latency, self.last_send_latency)
+                self.total_send_latency += self.last_send_latency
+                self.total_queue_delay += started - frame.enqueued_at
+                RESULT_SEND_SECONDS.observe(self.last_send_latency)
+                RESULT_QUEUE_WAIT_SECONDS.observe(started - frame.enqueued_at)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.info("Writer for WebSocket %s stopped: %s", self.websocket_id, e)
+            self.closed = True
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from config import logger, PARTIAL_FLUSH_INTERVAL
+
+# Jobs whose last delivered sequence number is remembered, to drop redelivered partials
+MAX_TRACKED_JOBS = 10_000
+
+
+class PartialResultCoalescer:
+    """
+    Merges high-frequency intermediate results into at most one frame per
+    connection per `interval`.
+
+    Workers may send any number of "progress" and "partial" messages for a job
+    (same job_id, increasing "seq") before its final result. Progress supersedes
+    earlier progress, so only the latest is kept; partial outputs are additive and
+    all of them are kept. A connection's pending updates go out as one frame:
+
+        {"type": "partial_results", "results": [...]}  # ordered by job, then seq
+
+    The first update after a quiet period is sent immediately, so the client sees
+    the analysis start without waiting a full interval. Updates whose seq is not
+    newer than what was already delivered (SQS redeliveries, stragglers) are dropped.
+    A final result that still has partial outputs pending waits for the frame
+    that carries them (see finish_job), so it never forces an extra frame.
+    """
+    def __init__(self, session_manager, interval=PARTIAL_FLUSH_INTERVAL):
+        self.session_manager = session_manager
+        self.interval = interval
+        self.pending = {}                   # {websocket_id: {job_id: {seq: message}}}
+        self.last_flush = OrderedDict()     # {websocket_id: monotonic time of the last frame}, oldest first
+        self.timers = {}                    # {websocket_id: asyncio.TimerHandle}
+        self.held_results = {}              # {websocket_id: [callback, ...]} run after the next frame
+        self.delivered_seq = OrderedDict()  # {job_id: highest seq sent}
+        self.received = 0
+        self.frames = 0
+        logger.info("PartialResultCoalescer initialized")
+
+    def add(self, websocket_id, data: dict) -> bool:
+        """
+        Queue an intermediate result for the session's next frame.
+
+        Returns:
+            False if the update was dropped as stale or duplicate.
+        """
+        job_id = data.get("job_id")
+        updates = self.pending.get(websocket_id, {}).get(job_id, {})
+        delivered = self.delivered_seq.get(job_id, -1)
+        seq = data.get("seq")
+        if not isinstance(seq, int) or isinstance(seq, bool):
+            # Unnumbered updates are kept in arrival order
+            seq = max(max(updates, default=-1), delivered) + 1
+        elif seq <= delivered:
+            return False
+
+        superseded = []
+        if data.get("message_type") == "progress":
+            # Only the newest progress report of a job is worth sending
+            for pending_seq, message in updates.items():
+                if message.get("message_type") == "progress":
+                    if pending_seq > seq:
+                        return False
+                    superseded.append(pending_seq)
+        self.received += 1
+        # Entries are only created for updates that are kept
+        updates = self.pending.setdefault(websocket_id, {}).setdefault(job_id, {})
+        for pending_seq in superseded:
+            del updates[pending_seq]
+        updates[seq] = data
+
+        if websocket_id not in self.timers:
+            self._forget_quiet()
+            wait = self.last_flush.get(websocket_id, float("-inf")) + self.interval - time.monotonic()
+            if wait <= 0:
+                self.flush(websocket_id)
+            else:
+                self.timers[websocket_id] = asyncio.get_running_loop().call_later(wait, self.flush, websocket_id)
+        return True
+
+    def flush(self, websocket_id):
+        """
+        Send the session's pending updates now, start its next interval and then
+        deliver the final results that were waiting for them.
+        """
+        timer = self.timers.pop(websocket_id, None)
+        if timer is not None:
+            timer.cancel()
+        jobs = self.pending.pop(websocket_id, {})
+        try:
+            self._send(websocket_id, jobs)
+        finally:
+            for deliver in self.held_results.pop(websocket_id, ()):
+                try:
+                    deliver()
+                except Exception as e:
+                    logger.exception("Failed to deliver a held result to WebSocket %s: %s", websocket_id, e)
+
+    def _send(self, websocket_id, jobs):
+        results = []
+        for pending_job_id, updates in jobs.items():
+            if not updates:
+                continue
+            for seq in sorted(updates):
+                results.append(updates[seq])
+            self._remember(pending_job_id, max(updates))
+        if not results:
+            return
+
+        session = self.session_manager.get_session(websocket_id)
+        if session is None or session.websocket is None:
+            # Intermediate results are not worth replaying after a reconnect
+            self.last_flush.pop(websocket_id, None)
+            return
+        self.session_manager.send(websocket_id, json.dumps({"type": "partial_results", "results": results}))
+        self.last_flush[websocket_id] = time.monotonic()
+        self.last_flush.move_to_end(websocket_id)
+        self.frames += 1
+
+    def finish_job(self, websocket_id, job_id, deliver):
+        """
+        Forget a job that got its final result, and tell the caller when to send it.
+
+        The final result supersedes the job's pending progress reports, which are
+        dropped. Pending partial outputs must reach the client first; they stay
+        in the session's next scheduled frame, and `deliver` is called right after
+        that frame instead of forcing one inside the current interval.
+
+        Returns:
+            True if `deliver` was held back to run after the next frame, False if
+            the caller should send the final result now.
+        """
+        session_jobs = self.pending.get(websocket_id) if websocket_id is not None else None
+        updates = session_jobs.get(job_id) if session_jobs else None
+        if updates:
+            for seq in [seq for seq, message in updates.items() if message.get("message_type") == "progress"]:
+                del updates[seq]
+        if updates:
+            def release():
+                # Forgotten only now, as sending the frame records the job's seq
+                self.delivered_seq.pop(job_id, None)
+                deliver()
+            self.held_results.setdefault(websocket_id, []).append(release)
+            if websocket_id not in self.timers:
+                # Pending updates always have a frame scheduled; never strand the result
+                self.flush(websocket_id)
+            return True
+        self.delivered_seq.pop(job_id, None)
+        if updates is None:
+            return False
+        del session_jobs[job_id]
+        if not session_jobs:
+            # Nothing left for the scheduled frame
+            del self.pending[websocket_id]
+            timer = self.timers.pop(websocket_id, None)
+            if timer is not None:
+                timer.cancel()
+        return False
+
+    def stats(self):
+        return {"received": self.received, "frames": self.frames, "pending_sessions": len(self.pending)}
+
+    def _forget_quiet(self):
+        """
+        Drop last_flush entries older than one interval: they no longer delay the
+        next frame, and sessions that expired are never left behind.
+        """
+        cutoff = time.monotonic() - self.interval
+        while self.last_flush:
+            websocket_id, flushed_at = next(iter(self.last_flush.items()))
+            if flushed_at > cutoff:
+                break
+            del self.last_flush[websocket_id]
+
+    def _remember(self, job_id, seq):
+        if seq > self.delivered_seq.get(job_id, -1):
+            self.delivered_seq[job_id] = seq
+            self.delivered_seq.move_to_end(job_id)
+        while len(self.delivered_seq) > MAX_TRACKED_JOBS:
+            self.delivered_seq.popitem(last=False)
@@ -0,0 +1,224 @@
+import asyncio
+import json
+import struct
+import time
+from collections import OrderedDict
+import websockets
+from config import (
+    logger,
+    aws_clients,
+    S3_RESULTS_BUCKET_NAME,
+    RESULT_CHUNK_SIZE,
+    RESULT_STREAM_CONCURRENCY,
+    RESULT_REF_TTL,
+    MAX_RESULT_REFS,
+)
+from trading_view_extension.managers.session_manager import SessionManager
+
+OUTBOUND_FLUSH_TIMEOUT = 30  # Seconds to wait for the result message to go out before its chunks
+
+
+class ResultStreamer:
+    """
+    Delivers claim-check results: results an analysis worker stored in S3, whose
+    queue message carries only {"result_ref": {"bucket", "key", "size",
+    "content_type"}} instead of the payload.
+
+    The client gets the result message with "result_ref" replaced by
+    "result_stream": {"size", "content_type", "chunk_size", "streaming"}. When
+    "streaming" is true the object follows as binary frames in the upload format
+    (4-byte big-endian header length, header JSON {"type": "result_chunk",
+    "job_id", "offset"}, then the bytes), and {"type": "result_end", "job_id",
+    "size"} closes the stream. A client that got the message without the stream
+    (e.g. replayed after a reconnect), or lost the connection part-way, sends
+    {"command": "fetch_result", "job_id", "offset"} to get the rest.
+
+    Each chunk is a ranged GET, and the next chunk is read while the current one
+    is sent, so a stream holds at most two chunks whatever the result size.
+    websocket.send() waits for the transport to drain, so a slow client only
+    slows down its own stream.
+    """
+    def __init__(self, session_manager: SessionManager, s3_client=None, bucket=S3_RESULTS_BUCKET_NAME,
+                 chunk_size=RESULT_CHUNK_SIZE, concurrency=RESULT_STREAM_CONCURRENCY,
+                 ref_ttl=RESULT_REF_TTL, max_refs=MAX_RESULT_REFS):
+        self.session_manager = session_manager
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.chunk_size = chunk_size
+        self.ref_ttl = ref_ttl
+        self.max_refs = max_refs
+        self.slots = asyncio.Semaphore(concurrency)
+        self.refs = OrderedDict()  # {job_id: (result_ref, user_id, websocket_id, stored_at)}, oldest first
+        self.streams = {}          # {(websocket_id, job_id): asyncio.Task}
+        self.bytes_sent = 0
+        self.completed = 0
+        self.interrupted = 0
+        self.refused = 0
+        logger.info("ResultStreamer initialized")
+
+    @staticmethod
+    def is_claim_check(data: dict) -> bool:
+        return isinstance(data.get("result_ref"), dict)
+
+    def accept(self, data: dict, websocket_id) -> dict:
+        """
+        Remember the reference of a claim-check result and build the message for
+        the client.
+
+        Returns:
+            The result message without "result_ref". It has "result_stream" if
+            the object can be streamed, or "result_error" if the reference was refused.
+        """
+        message = dict(data)
+        ref = message.pop("result_ref")
+        job_id = data.get("job_id")
+        if ref.get("bucket") != self.bucket or not ref.get("key"):
+            # Only objects in the results bucket may be handed to clients
+            self.refused += 1
+            logger.error("Refused result reference of job %s: %s/%s", job_id, ref.get('bucket'), ref.get('key'))
+            message["result_error"] = "result_unavailable"
+            return message
+        self._forget_old()
+        self.refs[job_id] = (ref, data.get("user_id"), websocket_id, time.monotonic())
+        self.refs.move_to_end(job_id)
+        session = self.session_manager.get_session(websocket_id)
+        message["result_stream"] = {
+            "size": ref.get("size"),
+            "content_type": ref.get("content_type", "application/octet-stream"),
+            "chunk_size": self.chunk_size,
+            "streaming": session is not None and session.websocket is not None,
+        }
+        return message
+
+    def start(self, websocket_id, job_id, offset=0) -> bool:
+        """
+        Stream a remembered result to the session's connection in the background,
+        replacing a stream of the same result that is still running.
+        """
+        entry = self.refs.get(job_id)
+        session = self.session_manager.get_session(websocket_id)
+        if entry is None or session is None or session.websocket is None:
+            return False
+        key = (session.websocket_id, job_id)
+        previous = self.streams.pop(key, None)
+        if previous is not None:
+            previous.cancel()
+        task = asyncio.create_task(self._stream(session, job_id, entry[0], offset))
+        self.streams[key] = task
+        task.add_done_callback(lambda done: self.streams.pop(key, None) if self.streams.get(key) is done else None)
+        return True
+
+    def fetch(self, session, job_id, offset=0):
+        """
+        Handle a client's "fetch_result": restart a result stream at `offset`.
+
+        Returns:
+            None if the stream was started, otherwise an error message for the client.
+        """
+        entry = self.refs.get(job_id)
+        owned = session is not None and entry is not None and (
+            entry[2] == session.websocket_id or (entry[1] is not None and entry[1] == session.user_id)
+        )
+        if not owned:
+            return {"type": "error", "code": "result_not_found", "job_id": job_id,
+                    "message": "No stored result for this job."}
+        if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+            return {"type": "error", "code": "invalid_offset", "job_id": job_id,
+                    "message": "'offset' must be a non-negative integer."}
+        size = entry[0].get("size")
+        if isinstance(size, int) and offset > size:
+            return self.offset_past_end(job_id, size)
+        self.start(session.websocket_id, job_id, offset)
+        return None
+
+    @staticmethod
+    def offset_past_end(job_id, size):
+        return {"type": "error", "code": "invalid_offset", "job_id": job_id, "size": size,
+                "message": "'offset' is past the end of the result."}
+
+    async def _stream(self, session, job_id, ref, offset):
+        websocket = session.websocket
+        started = time.perf_counter()
+        sent = 0
+        next_read = None
+        try:
+            if session.outbound is not None:
+                # The result message (queued just before) goes out ahead of its chunks
+                try:
+                    await session.outbound.flush(OUTBOUND_FLUSH_TIMEOUT)
+                except asyncio.TimeoutError:
+                    pass
+            async with self.slots:
+                size = ref.get("size")
+                if not isinstance(size, int):
+                    size = await asyncio.to_thread(self._object_size, ref)
+                if offset > size:
+                    await websocket.send(json.dumps(self.offset_past_end(job_id, size)))
+                    return
+                if offset < size:
+                    next_read = asyncio.ensure_future(asyncio.to_thread(self._read_range, ref, offset))
+                while next_read is not None:
+                    chunk = await next_read
+                    next_read = None
+                    if not chunk:
+                        break  # The object is shorter than its reference said
+                    following = offset + len(chunk)
+                    if following < size:
+                        next_read = asyncio.ensure_future(asyncio.to_thread(self._read_range, ref, following))
+                    header = json.dumps({"type": "result_chunk", "job_id": job_id, "offset": offset}).encode("utf-8")
+                    await websocket.send(struct.pack(">I", len(header)) + header + chunk)
+                    offset = following
+                    sent += len(chunk)
+                    self.bytes_sent += len(chunk)
+                await websocket.send(json.dumps({"type": "result_end", "job_id": job_id, "size": offset}))
+            self.completed += 1
+            logger.info("Streamed %d bytes of job %s in %.3fs", sent, job_id, time.perf_counter() - started)
+        except (websockets.exceptions.ConnectionClosed, asyncio.CancelledError):
+            # The client resumes with "fetch_result" from the last offset it got
+            self.interrupted += 1
+            logger.info("Result stream of job %s interrupted at offset %d", job_id, offset)
+        except Exception as e:
+            self.interrupted += 1
+            logger.error("Failed to stream result of job %s: %s", job_id, e)
+            try:
+                await websocket.send(json.dumps({"type": "error", "code": "result_stream_failed", "job_id": job_id,
+                                                 "offset": offset, "message": "Fetch the result again."}))
+            except websockets.exceptions.ConnectionClosed:
+                pass
+        finally:
+            if next_read is not None:
+                next_read.cancel()
+
+    def _client(self):
+        return self.s3_client or aws_clients.s3()
+
+    def _object_size(self, ref) -> int:
+        return int(self._client().head_object(Bucket=ref["bucket"], Key=ref["key"])["ContentLength"])
+
+    def _read_range(self, ref, start) -> bytes:
+        response = self._client().get_object(
+            Bucket=ref["bucket"], Key=ref["key"], Range=f"bytes={start}-{start + self.chunk_size - 1}"
+        )
+        body = response["Body"]
+        try:
+            return body.read()
+        finally:
+            body.close()
+
+    def _forget_old(self):
+        cutoff = time.monotonic() - self.ref_ttl
+        while self.refs:
+            job_id, entry = next(iter(self.refs.items()))
+            if entry[3] > cutoff and len(self.refs) < self.max_refs:
+                break
+            del self.refs[job_id]
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self.streams),
+            "completed": self.completed,
+            "interrupted": self.interrupted,
+            "refused": self.refused,
+            "bytes_sent": self.bytes_sent,
+            "stored_refs": len(self.refs),
+        }
@@ -1,42 +1,396 @@
-from config import logger
+import hmac
+import secrets
+import time
+from collections import OrderedDict, deque
+from heapq import nlargest
+from config import logger, SESSION_RESUME_TTL, REPLAY_BUFFER_SIZE, REPLAY_TTL, OUTBOUND_STATS_TOP
+from trading_view_extension.managers.outbound_queue import OutboundQueue
+
+
+class Session:
+    """
+    State kept for a single client session.
+
+    A session outlives its WebSocket connection: when the connection drops the
+    session is detached (websocket is None) and results are buffered in `replay`
+    until the client resumes with its resume token or the session expires.
+
+    The websocket_id only routes results: it travels in job messages, is stored
+    with the job and appears in logs. Resuming needs `resume_token`, a separate
+    secret that is only ever sent to the session's own connection.
+
+    Most sessions sit idle for hours, so the object uses __slots__ and only
+    allocates its job set, replay buffer and outbound queue when first needed.
+    """
+    __slots__ = ("websocket_id", "websocket", "user_id", "tab_id", "job_ids", "detached_at", "replay", "outbound",
+                 "resume_token")
+
+    def __init__(self, websocket_id, websocket, user_id=None, tab_id=None):
+        self.websocket_id = websocket_id  # Server-issued session id; routes results, not a secret
+        self.websocket = websocket
+        self.user_id = user_id
+        self.tab_id = tab_id
+        self.job_ids = None     # set of in-flight jobs submitted in this session, created on first use
+        self.detached_at = None
+        self.replay = None      # deque of (buffered_at, message), created on first use
+        self.outbound = None    # OutboundQueue of the attached connection, created on first send
+        self.resume_token = None  # Issued by open_session; never logged or published
+
 
 class SessionManager:
-    def __init__(self):
-        self.connections = {}  # Dictionary to store {websocket_id: websocket}
+    """
+    Registry of client sessions.
+
+    Sessions are keyed by a server-issued token (used as the websocket_id in job
+    messages) rather than id(websocket), which CPython reuses and which changes on
+    every reconnect. Every session is indexed by websocket_id, user_id, tab_id and
+    in-flight job_id, so all lookups on the result path are O(1) regardless of how
+    many sessions are registered.
+    """
+    def __init__(self, resume_ttl=SESSION_RESUME_TTL, replay_size=REPLAY_BUFFER_SIZE, replay_ttl=REPLAY_TTL):
+        self.sessions = {}          # {websocket_id: Session}
+        self.sessions_by_user = {}  # {user_id: {websocket_id, ...}}
+        self.sessions_by_tab = {}   # {tab_id: {websocket_id, ...}}
+        self.sessions_by_job = {}   # {job_id: websocket_id}
+        self.sessions_by_connection = {}  # {id(websocket): websocket_id}, live connections only
+        self.detached = OrderedDict()     # {websocket_id: detached_at}, oldest first
+        self.resume_ttl = resume_ttl
+        self.replay_size = replay_size
+        self.replay_ttl = replay_ttl
         logger.info("SessionManager initialized.")
 
-    def register_websocket(self, websocket_id, websocket):
+    def __len__(self):
+        return len(self.sessions)
+
+    def register_websocket(self, websocket_id, websocket, user_id=None, tab_id=None):
         """
-        Add a WebSocket connection to the manager.
-        
+        Add a WebSocket connection to the manager, or update the user/tab it
+        belongs to if it is already registered.
+
         Args:
             websocket_id: The unique identifier for the WebSocket.
             websocket: The WebSocket connection object.
+            user_id: Optional user the connection belongs to.
+            tab_id: Optional browser tab the connection belongs to.
         """
-        self.connections[str(websocket_id)] = websocket
-        logger.info(f"Registered WebSocket: {websocket} with ID: {websocket_id}")
+        websocket_id = str(websocket_id)
+        session = self.sessions.get(websocket_id)
+        if session is None:
+            session = Session(websocket_id, websocket)
+            self.sessions[websocket_id] = session
+        if user_id is not None and user_id != session.user_id:
+            self._unindex(self.sessions_by_user, session.user_id, websocket_id)
+            session.user_id = user_id
+            self.sessions_by_user.setdefault(user_id, set()).add(websocket_id)
+        if tab_id is not None and tab_id != session.tab_id:
+            self._unindex(self.sessions_by_tab, session.tab_id, websocket_id)
+            session.tab_id = tab_id
+            self.sessions_by_tab.setdefault(tab_id, set()).add(websocket_id)
+        logger.debug("Registered WebSocket ID: %s (user=%s, tab=%s)", websocket_id, session.user_id, session.tab_id)
         return websocket_id
 
+    def open_session(self, websocket, user_id=None, tab_id=None, session_id=None, resume_token=None):
+        """
+        Attach a connection to a session, resuming session `session_id` if it is
+        still known, `resume_token` matches the one it was issued and it belongs to
+        `user_id`, or starting a new session otherwise. Every call issues a fresh
+        resume token; it must only ever be sent to the session's own connection.
+
+        Args:
+            websocket: The WebSocket connection object.
+            user_id: Optional user the connection belongs to.
+            tab_id: Optional browser tab the connection belongs to.
+            session_id: websocket_id of the session a reconnecting client resumes.
+            resume_token: Resume token presented by the reconnecting client.
+
+        Returns:
+            A (websocket_id, resumed) tuple.
+        """
+        self._expire_detached()
+        current_id = self.sessions_by_connection.get(id(websocket))
+        session = self.sessions.get(str(session_id)) if session_id and resume_token else None
+        if session is not None and not self._may_resume(session, user_id, resume_token):
+            logger.warning("Refused to resume session %s for user %s: wrong resume token or user; "
+                           "starting a new one", session.websocket_id, user_id)
+            session = None
+
+        if session is None or session.websocket_id == current_id:
+            if current_id is None:
+                current_id = self.register_websocket(secrets.token_urlsafe(18), websocket)
+                self.sessions_by_connection[id(websocket)] = current_id
+            self.register_websocket(current_id, websocket, user_id=user_id, tab_id=tab_id)
+            self.sessions[current_id].resume_token = secrets.token_urlsafe(32)
+            return current_id, session is not None
+
+        if current_id is not None:
+            # Jobs submitted before the handshake move over to the resumed session
+            implicit = self.remove_websocket(current_id)
+            for job_id in implicit.job_ids or ():
+                self.bind_job(session.websocket_id, job_id)
+        if session.websocket is not None and session.websocket is not websocket:
+            # The old connection may be half-open; the new one takes over the session
+            self.sessions_by_connection.pop(id(session.websocket), None)
+        self._close_outbound(session)
+        self.detached.pop(session.websocket_id, None)
+        session.websocket = websocket
+        session.detached_at = None
+        session.resume_token = secrets.token_urlsafe(32)  # The presented one is spent
+        self.sessions_by_connection[id(websocket)] = session.websocket_id
+        self.register_websocket(session.websocket_id, websocket, user_id=user_id, tab_id=tab_id)
+        logger.info("Resumed session %s (user=%s, tab=%s)", session.websocket_id, session.user_id, session.tab_id)
+        return session.websocket_id, True
+
+    def resume_token_for(self, websocket_id):
+        """
+        Retrieve the current resume token of a session, to hand to its own connection only.
+        """
+        session = self.sessions.get(str(websocket_id))
+        return session.resume_token if session else None
+
+    def session_id_for(self, websocket):
+        """
+        Retrieve the websocket_id of the session a live connection is attached to.
+        """
+        return self.sessions_by_connection.get(id(websocket))
+
+    def detach_websocket(self, websocket):
+        """
+        Detach a closed connection from its session. The session is kept for
+        `resume_ttl` seconds so the client can resume it and collect its results.
+
+        Returns:
+            The detached Session, or None if the connection had no session.
+        """
+        websocket_id = self.sessions_by_connection.pop(id(websocket), None)
+        session = self.sessions.get(websocket_id) if websocket_id else None
+        if session is None or session.websocket is not websocket:
+            return None
+        self._close_outbound(session)
+        session.websocket = None
+        session.detached_at = time.monotonic()
+        self.detached[websocket_id] = session.detached_at
+        self._expire_detached()
+        logger.info("Detached session %s (user=%s, tab=%s)", websocket_id, session.user_id, session.tab_id)
+        return session
+
+    def buffer_result(self, websocket_id, message):
+        """
+        Keep an undelivered message for replay when the session is resumed.
+
+        Returns:
+            True if the message was buffered, False if the session is unknown.
+        """
+        session = self.sessions.get(str(websocket_id))
+        if session is None:
+            return False
+        if session.replay is None:
+            session.replay = deque(maxlen=self.replay_size)
+        elif len(session.replay) == self.replay_size:
+            logger.warning("Replay buffer full for session %s; dropping oldest result", websocket_id)
+        session.replay.append((time.monotonic(), message))
+        return True
+
+    def drain_replay(self, websocket_id):
+        """
+        Remove and return the buffered messages of a session that are still
+        within the replay TTL, oldest first.
+        """
+        session = self.sessions.get(str(websocket_id))
+        if session is None or not session.replay:
+            return []
+        cutoff = time.monotonic() - self.replay_ttl
+        messages = [message for buffered_at, message in session.replay if buffered_at >= cutoff]
+        session.replay = None
+        return messages
+
+    def send(self, websocket_id, message, coalesce_key=None, essential=False):
+        """
+        Queue a message on the session's outbound queue without waiting for the
+        client, or buffer it for replay if the session is disconnected.
+
+        Args:
+            websocket_id: The session to send to.
+            message: The frame to send.
+            coalesce_key: Optional key; a pending frame with the same key is replaced.
+            essential: The frame is never dropped when the outbound queue overflows
+                (final results, which are not sent again).
+
+        Returns:
+            True if the message was queued or buffered, False if the session is unknown.
+        """
+        session = self.sessions.get(str(websocket_id))
+        if session is None:
+            return False
+        if session.websocket is None:
+            return self.buffer_result(session.websocket_id, message)
+        if session.outbound is None:
+            session.outbound = OutboundQueue(session.websocket, session.websocket_id)
+        if not session.outbound.put(message, coalesce_key, essential):
+            # The writer stopped because the connection failed; keep the message for replay
+            return self.buffer_result(session.websocket_id, message)
+        return True
+
+    def outbound_stats(self, top=OUTBOUND_STATS_TOP):
+        """
+        Per-connection send latency and queue depth statistics of the `top`
+        connections with the deepest outbound queues (ties go to the slowest
+        sends), deepest first. Bounded so it stays cheap with many connections.
+        """
+        queues = (session.outbound for session in self.sessions.values() if session.outbound is not None)
+        worst = nlargest(top, queues, key=lambda queue: (len(queue), queue.max_send_latency))
+        return [queue.stats() for queue in worst]
+
+    def get_session(self, websocket_id):
+        """
+        Retrieve the Session for a websocket_id, or None if not found.
+        """
+        return self.sessions.get(str(websocket_id))
+
     def get_websocket(self, websocket_id):
         """
         Retrieve a WebSocket connection from the manager.
-        
+
         Args:
             websocket_id: The unique identifier for the WebSocket.
-        
+
         Returns:
             The WebSocket connection object, or None if not found.
         """
-        logger.info(f"Connections: {self.connections}")
-        return self.connections.get(str(websocket_id))  # Use .get() to avoid KeyError
+        session = self.sessions.get(str(websocket_id))
+        return session.websocket if session else None
+
+    def bind_job(self, websocket_id, job_id):
+        """
+        Record that job_id was submitted over websocket_id, so its result can be
+        routed back even without the websocket_id in the result message.
+        """
+        session = self.sessions.get(str(websocket_id))
+        if session is None:
+            logger.warning("Cannot bind job %s: no session with ID %s", job_id, websocket_id)
+            return
+        if session.job_ids is None:
+            session.job_ids = set()
+        session.job_ids.add(job_id)
+        self.sessions_by_job[job_id] = session.websocket_id
+
+    def release_job(self, job_id):
+        """
+        Forget an in-flight job once its result has been delivered.
+
+        Returns:
+            The websocket_id the job was bound to, or None.
+        """
+        websocket_id = self.sessions_by_job.pop(job_id, None)
+        session = self.sessions.get(websocket_id) if websocket_id else None
+        if session and session.job_ids:
+            session.job_ids.discard(job_id)
+        return websocket_id
+
+    def get_websocket_for_job(self, job_id):
+        """
+        Retrieve the WebSocket connection that submitted job_id, or None.
+        """
+        websocket_id = self.sessions_by_job.get(job_id)
+        return self.get_websocket(websocket_id) if websocket_id else None
+
+    def get_session_for_job(self, job_id):
+        """
+        Retrieve the Session that submitted job_id, or None.
+        """
+        websocket_id = self.sessions_by_job.get(job_id)
+        return self.sessions.get(websocket_id) if websocket_id else None
+
+    def get_user_websockets(self, user_id):
+        """
+        Retrieve all live WebSocket connections (one per open tab) of a user.
+        """
+        sessions = (self.sessions[ws_id] for ws_id in self.sessions_by_user.get(user_id, ()))
+        return [session.websocket for session in sessions if session.websocket is not None]
+
+    def get_tab_websockets(self, tab_id):
+        """
+        Retrieve all live WebSocket connections registered for a tab_id.
+        """
+        sessions = (self.sessions[ws_id] for ws_id in self.sessions_by_tab.get(tab_id, ()))
+        return [session.websocket for session in sessions if session.websocket is not None]
+
+    def send_to_user(self, user_id, message):
+        """
+        Fan a message out to every open tab of a user.
+
+        Returns:
+            The number of connections the message was queued for.
+        """
+        delivered = 0
+        for websocket_id in list(self.sessions_by_user.get(user_id, ())):
+            if self.sessions[websocket_id].websocket is not None and self.send(websocket_id, message):
+                delivered += 1
+        return delivered
 
     def remove_websocket(self, websocket_id):
         """
-        Remove a WebSocket connection from the manager.
-        
+        Remove a WebSocket connection and every index entry that refers to it.
+
         Args:
             websocket_id: The unique identifier for the WebSocket.
+
+        Returns:
+            The removed Session, or None if it was not registered.
+        """
+        session = self.sessions.pop(str(websocket_id), None)
+        if session is None:
+            return None
+        if session.outbound is not None:
+            session.outbound.close()
+            session.outbound = None
+        self.detached.pop(session.websocket_id, None)
+        if session.websocket is not None and self.sessions_by_connection.get(id(session.websocket)) == session.websocket_id:
+            del self.sessions_by_connection[id(session.websocket)]
+        self._unindex(self.sessions_by_user, session.user_id, session.websocket_id)
+        self._unindex(self.sessions_by_tab, session.tab_id, session.websocket_id)
+        for job_id in session.job_ids or ():
+            if self.sessions_by_job.get(job_id) == session.websocket_id:
+                del self.sessions_by_job[job_id]
+        logger.info("Removed WebSocket ID: %s (user=%s, tab=%s)", session.websocket_id, session.user_id, session.tab_id)
+        return session
+
+    def _close_outbound(self, session):
+        """
+        Stop the writer of a session's old connection and keep its unsent frames for replay.
+        """
+        if session.outbound is None:
+            return
+        unsent = session.outbound.close()
+        session.outbound = None
+        for message in unsent:
+            self.buffer_result(session.websocket_id, message)
+
+    def _expire_detached(self):
         """
-        if str(websocket_id) in self.connections:
-            logger.info(f"Removing WebSocket: {self.connections[str(websocket_id)]} with ID: {websocket_id}")
-            del self.connections[str(websocket_id)]
+        Drop detached sessions that were not resumed within `resume_ttl`.
+        """
+        cutoff = time.monotonic() - self.resume_ttl
+        while self.detached:
+            websocket_id, detached_at = next(iter(self.detached.items()))
+            if detached_at > cutoff:
+                break
+            self.remove_websocket(websocket_id)
+
+    @staticmethod
+    def _may_resume(session, user_id, resume_token):
+        """
+        A session is resumed only with the resume token it was issued, by the user it belongs to.
+        """
+        if session.resume_token is None or user_id is None or session.user_id != user_id:
+            return False
+        return hmac.compare_digest(session.resume_token.encode(), str(resume_token).encode())
+
+    @staticmethod
+    def _unindex(index, key, websocket_id):
+        if key is None:
+            return
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(websocket_id)
+            if not ids:
+                del index[key]
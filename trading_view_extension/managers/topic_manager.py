@@ -0,0 +1,136 @@
+import json
+import zlib
+from config import logger, BROADCAST_COMPRESSION_MIN_BYTES, MAX_TOPICS_PER_SESSION
+
+# Result fields shared with other subscribers. Anything identifying the submitter
+# (websocket_id, user_id, tab_id) or its uploads (s3_urls) must never be added here.
+BROADCAST_FIELDS = ("job_id", "asset", "agent", "action_type", "status", "analysis", "expired")
+BROADCAST_REF_FIELDS = ("size", "content_type")
+
+
+class TopicManager:
+    """
+    Asset-topic subscriptions with shared broadcast of analysis results.
+
+    A broadcast is serialized once and, for subscribers that asked for compressed
+    frames, zlib-compressed once; the same frame object is then queued on every
+    subscriber's outbound queue. Cost per extra subscriber is a queue append.
+    Connections that negotiated permessage-deflate never get the zlib frame: the
+    transport would only compress it a second time.
+
+    Subscribers get only the public part of a result (see broadcast_payload).
+    """
+    def __init__(self, session_manager, compression_min_bytes=BROADCAST_COMPRESSION_MIN_BYTES,
+                 max_topics=MAX_TOPICS_PER_SESSION):
+        self.session_manager = session_manager
+        self.compression_min_bytes = compression_min_bytes
+        self.max_topics = max_topics
+        self.subscribers = {}        # {asset: {websocket_id: compress}}
+        self.topics_by_session = {}  # {websocket_id: {asset, ...}}
+        logger.info("TopicManager initialized")
+
+    def subscribe(self, websocket_id, assets, compress=False):
+        """
+        Subscribe a session to asset topics.
+
+        Args:
+            websocket_id: The subscribing session.
+            assets: Iterable of asset symbols.
+            compress: Deliver broadcasts as zlib-compressed binary frames, unless
+                the connection already compresses with permessage-deflate.
+
+        Returns:
+            The session's topics, or None if the subscription would take the
+            session past `max_topics` (nothing is subscribed then).
+        """
+        topics = self.topics_by_session.get(websocket_id, set())
+        if len(topics.union(assets)) > self.max_topics:
+            return None
+        session = self.session_manager.get_session(websocket_id)
+        compress = compress and not (session is not None and self.negotiated_deflate(session.websocket))
+        topics = self.topics_by_session.setdefault(websocket_id, topics)
+        for asset in assets:
+            self.subscribers.setdefault(asset, {})[websocket_id] = compress
+            topics.add(asset)
+        return sorted(topics)
+
+    def unsubscribe(self, websocket_id, assets=None):
+        """
+        Unsubscribe a session from the given assets, or from all of them.
+        """
+        topics = self.topics_by_session.get(websocket_id, set())
+        for asset in list(topics if assets is None else assets):
+            subscribers = self.subscribers.get(asset)
+            if subscribers is not None:
+                subscribers.pop(websocket_id, None)
+                if not subscribers:
+                    del self.subscribers[asset]
+            topics.discard(asset)
+        if not topics:
+            self.topics_by_session.pop(websocket_id, None)
+        return sorted(topics)
+
+    def compresses(self, websocket_id, asset):
+        """
+        Whether broadcasts of `asset` go to the session as zlib binary frames.
+        """
+        return self.subscribers.get(asset, {}).get(websocket_id, False)
+
+    @staticmethod
+    def negotiated_deflate(websocket):
+        extensions = getattr(websocket, "extensions", None) or ()
+        return any(extension.name == "permessage-deflate" for extension in extensions)
+
+    def subscriber_count(self, asset):
+        return len(self.subscribers.get(asset, ()))
+
+    @staticmethod
+    def broadcast_payload(data):
+        """
+        The fields of a result that may be shown to other users: BROADCAST_FIELDS,
+        plus the size and content type of a claim-check result (its S3 location
+        stays private; only the submitter can fetch it).
+        """
+        payload = {field: data[field] for field in BROADCAST_FIELDS if field in data}
+        ref = data.get("result_ref")
+        if isinstance(ref, dict):
+            payload["result_ref"] = {field: ref[field] for field in BROADCAST_REF_FIELDS if field in ref}
+        return payload
+
+    def publish(self, asset, data, exclude=None):
+        """
+        Broadcast a result to every subscriber of an asset topic.
+
+        Args:
+            asset: The asset topic.
+            data: The result; only its broadcast_payload() is sent.
+            exclude: Optional websocket_id that already received the result directly.
+
+        Returns:
+            The number of subscribers the frame was queued for.
+        """
+        subscribers = self.subscribers.get(asset)
+        if not subscribers:
+            return 0
+        text_frame = json.dumps({"type": "topic_result", "asset": asset, "data": self.broadcast_payload(data)})
+        compressed_frame = None
+        delivered = 0
+        for websocket_id, compress in list(subscribers.items()):
+            if websocket_id == exclude:
+                continue
+            session = self.session_manager.get_session(websocket_id)
+            if session is None:
+                # The session expired; drop its subscriptions lazily
+                self.unsubscribe(websocket_id)
+                continue
+            if session.websocket is None:
+                continue  # Broadcasts are not replayed to disconnected sessions
+            frame = text_frame
+            if compress and len(text_frame) >= self.compression_min_bytes:
+                if compressed_frame is None:
+                    compressed_frame = zlib.compress(text_frame.encode("utf-8"))
+                frame = compressed_frame
+            if self.session_manager.send(websocket_id, frame):
+                delivered += 1
+        logger.debug("Broadcast %s result to %d subscribers", asset, delivered)
+        return delivered
@@ -0,0 +1,122 @@
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from config import logger
+
+
+class LocalSQSClient:
+    """
+    In-memory stand-in for the subset of the boto3 SQS client used by the gateway.
+
+    Queues are created on first use and identified by URL, so the same object can
+    be handed to SqsQueueConsumer, SQSQueuePublisher and ReplyRouter in tests and
+    local runs. Visibility timeouts, receive counts and long polling (WaitTimeSeconds)
+    are honoured.
+    """
+    def __init__(self):
+        self._lock = threading.Condition()  # Notified when messages are sent or made visible
+        self._queues = {}  # {queue_url: OrderedDict(message_id -> message)}
+        self._receipts = {}  # {receipt_handle: (queue_url, message_id)}
+        self._sequence = itertools.count(1)
+        logger.info("LocalSQSClient initialized")
+
+    def _queue(self, queue_url):
+        return self._queues.setdefault(queue_url, OrderedDict())
+
+    def send_message(self, QueueUrl, MessageBody, MessageAttributes=None, DelaySeconds=0, **kwargs):
+        message_id = str(uuid.uuid4())
+        now = time.time()
+        with self._lock:
+            self._queue(QueueUrl)[message_id] = {
+                "MessageId": message_id,
+                "Body": MessageBody,
+                "MessageAttributes": MessageAttributes or {},
+                "Attributes": {
+                    "SentTimestamp": str(int(now * 1000)),
+                    "SequenceNumber": str(next(self._sequence)),
+                    "ApproximateReceiveCount": "0",
+                },
+                "visible_at": now + DelaySeconds,
+            }
+            self._lock.notify_all()
+        return {"MessageId": message_id}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, VisibilityTimeout=30, WaitTimeSeconds=0, **kwargs):
+        deadline = time.time() + WaitTimeSeconds
+        with self._lock:
+            while True:
+                messages = self._receive(QueueUrl, MaxNumberOfMessages, VisibilityTimeout)
+                now = time.time()
+                if messages or now >= deadline:
+                    break
+                # Wake up for new messages, or when a delayed or hidden one becomes visible
+                next_visible = min((m["visible_at"] for m in self._queue(QueueUrl).values()), default=deadline)
+                self._lock.wait(max(0.001, min(deadline, next_visible) - now))
+        return {"Messages": messages} if messages else {}
+
+    def _receive(self, queue_url, max_messages, visibility_timeout):
+        # Called with the lock held
+        now = time.time()
+        messages = []
+        for message in self._queue(queue_url).values():
+            if len(messages) >= max_messages:
+                break
+            if message["visible_at"] > now:
+                continue
+            attributes = message["Attributes"]
+            attributes["ApproximateReceiveCount"] = str(int(attributes["ApproximateReceiveCount"]) + 1)
+            attributes.setdefault("ApproximateFirstReceiveTimestamp", str(int(now * 1000)))
+            message["visible_at"] = now + visibility_timeout
+            receipt_handle = str(uuid.uuid4())
+            self._receipts[receipt_handle] = (queue_url, message["MessageId"])
+            messages.append({
+                "MessageId": message["MessageId"],
+                "ReceiptHandle": receipt_handle,
+                "Body": message["Body"],
+                "Attributes": dict(attributes),
+                "MessageAttributes": message["MessageAttributes"],
+            })
+        return messages
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        with self._lock:
+            queue_url, message_id = self._receipts.pop(ReceiptHandle, (QueueUrl, None))
+            self._queue(queue_url).pop(message_id, None)
+        return {}
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        with self._lock:
+            queue_url, message_id = self._receipts.get(ReceiptHandle, (QueueUrl, None))
+            message = self._queue(queue_url).get(message_id)
+            if message is not None:
+                message["visible_at"] = time.time() + VisibilityTimeout
+                self._lock.notify_all()
+        return {}
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        successful, failed = [], []
+        with self._lock:
+            for entry in Entries:
+                queue_url, message_id = self._receipts.get(entry["ReceiptHandle"], (QueueUrl, None))
+                message = self._queue(queue_url).get(message_id)
+                if message is None:
+                    failed.append({"Id": entry["Id"], "SenderFault": True, "Code": "ReceiptHandleIsInvalid",
+                                   "Message": "The receipt handle is not valid."})
+                    continue
+                message["visible_at"] = time.time() + entry["VisibilityTimeout"]
+                successful.append({"Id": entry["Id"]})
+            self._lock.notify_all()
+        return {"Successful": successful, "Failed": failed}
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames=None):
+        now = time.time()
+        with self._lock:
+            queue = self._queue(QueueUrl)
+            visible = sum(1 for m in queue.values() if m["visible_at"] <= now)
+            return {"Attributes": {
+                "ApproximateNumberOfMessages": str(visible),
+                "ApproximateNumberOfMessagesNotVisible": str(len(queue) - visible),
+            }}
@@ -0,0 +1,129 @@
+import time
+from collections import deque
+from config import (
+    logger,
+    input_tasks_queue,
+    output_tasks_queue,
+    PRIORITY_LANE_WEIGHTS,
+    DEFAULT_PRIORITY_LANE,
+    PRIORITY_LANE_BY_TIER,
+    PRIORITY_LANE_BY_ACTION_TYPE,
+    PRIORITY_LANE_INPUT_QUEUE_URLS,
+    PRIORITY_LANE_OUTPUT_QUEUE_URLS,
+    LANE_LATENCY_WINDOW,
+)
+from utils.metrics import REGISTRY
+
+JOB_LATENCY_SECONDS = REGISTRY.histogram(
+    "gateway_job_latency_seconds",
+    "Time from job submission to its final result, per priority lane.",
+    labels=("lane",),
+    buckets=(0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 30.0, 60.0, 120.0, 300.0),
+)
+
+
+class PriorityLanes:
+    """
+    Maps jobs to priority lanes and lanes to queues.
+
+    A job's lane is chosen by action type, then by user tier, then defaults to
+    DEFAULT_PRIORITY_LANE. Each lane publishes to its own input queue and gets its
+    results on its own output queue; lanes without dedicated queues share the
+    default ones but use their own FIFO message group, so a backlog in one lane
+    does not block ordering in another. The ResponseWorker polls lanes in
+    proportion to their weights.
+
+    Per-lane latency (job submission to result arrival) and queue depth are kept
+    for stats().
+    """
+    def __init__(self, weights=PRIORITY_LANE_WEIGHTS, default_lane=DEFAULT_PRIORITY_LANE,
+                 by_tier=PRIORITY_LANE_BY_TIER, by_action_type=PRIORITY_LANE_BY_ACTION_TYPE,
+                 input_queue_urls=PRIORITY_LANE_INPUT_QUEUE_URLS, output_queue_urls=PRIORITY_LANE_OUTPUT_QUEUE_URLS,
+                 latency_window=LANE_LATENCY_WINDOW):
+        self.weights = dict(weights)
+        self.default_lane = default_lane if default_lane in self.weights else next(iter(self.weights))
+        self.by_tier = by_tier
+        self.by_action_type = by_action_type
+        self.input_queue_urls = input_queue_urls
+        self.output_queue_urls = output_queue_urls
+        self.latencies = {lane: deque(maxlen=latency_window) for lane in self.weights}
+        self.depths = {lane: {} for lane in self.weights}  # {lane: {queue_url: depth}}
+        self.completed = {lane: 0 for lane in self.weights}
+        logger.info(f"PriorityLanes initialized: {self.weights}")
+
+    @property
+    def lanes(self):
+        return list(self.weights)
+
+    def select(self, user_tier=None, action_type=None):
+        lane = self.by_action_type.get(action_type) or self.by_tier.get(user_tier) or self.default_lane
+        return lane if lane in self.weights else self.default_lane
+
+    def input_queue_url(self, lane):
+        return self.input_queue_urls.get(lane) or input_tasks_queue.url
+
+    def output_queue_url(self, lane):
+        return self.output_queue_urls.get(lane) or output_tasks_queue.url
+
+    def message_group_id(self, lane, base="analysis_tasks"):
+        # The default lane keeps the historical group id
+        return base if lane in (None, self.default_lane) else f"{base}_{lane}"
+
+    def stamp(self, job: dict, user_tier=None) -> dict:
+        """
+        Record the job's lane, where its result should go and when it was submitted.
+        Workers echo these fields in the result.
+        """
+        lane = self.select(user_tier, job.get("action_type"))
+        job["lane"] = lane
+        job["submitted_at"] = time.time()
+        if self.output_queue_urls.get(lane):
+            job["reply_queue_url"] = self.output_queue_urls[lane]
+        return job
+
+    def listen_queues(self, reply_router=None):
+        """
+        Queues a ResponseWorker should poll, as (lane, queue_url, weight) tuples in
+        priority order. A queue shared by several lanes is listed once, under the
+        highest-priority lane that uses it.
+        """
+        queues = []
+        seen = set()
+        for lane, weight in self.weights.items():
+            urls = [self.output_queue_url(lane)]
+            if reply_router:
+                urls.insert(0, reply_router.reply_queue_url(lane=lane))
+            for url in urls:
+                if url and url not in seen:
+                    seen.add(url)
+                    queues.append((lane, url, weight))
+        return queues
+
+    def record_latency(self, lane, seconds):
+        if lane not in self.latencies:
+            lane = self.default_lane
+        self.latencies[lane].append(seconds)
+        JOB_LATENCY_SECONDS.labels(lane).observe(seconds)
+        self.completed[lane] += 1
+
+    def record_depth(self, lane, queue_url, depth):
+        self.depths.setdefault(lane, {})[queue_url] = depth
+
+    def stats(self):
+        result = {}
+        for lane in self.weights:
+            samples = sorted(self.latencies[lane])
+            result[lane] = {
+                "weight": self.weights[lane],
+                "completed": self.completed[lane],
+                "depth": sum(self.depths[lane].values()),
+                "latency_p50_ms": round(self._percentile(samples, 0.50) * 1000, 1),
+                "latency_p95_ms": round(self._percentile(samples, 0.95) * 1000, 1),
+            }
+        return result
+
+    @staticmethod
+    def _percentile(samples, q):
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
@@ -0,0 +1,104 @@
+import asyncio
+import json
+import uuid
+from config import logger, aws_clients, output_tasks_queue, NODE_ID, SQS_REPLY_QUEUE_URL_TEMPLATE, DEFAULT_PRIORITY_LANE
+from utils.tracing import OUTPUT_SENT_ATTRIBUTE, TRACEPARENT_ATTRIBUTE
+
+
+class ReplyRouter:
+    """
+    Routes analysis results back to the gateway node that owns the websocket.
+
+    Jobs are stamped with the originating node id (and that node's reply queue,
+    when a reply queue template is configured) before they are published. Result
+    messages that reach a node other than their owner are forwarded to the owner's
+    reply queue, or released back to the shared queue if there are no reply queues.
+    """
+    def __init__(self, node_id=NODE_ID, reply_queue_url_template=SQS_REPLY_QUEUE_URL_TEMPLATE, client=None):
+        self.node_id = node_id
+        self.reply_queue_url_template = reply_queue_url_template
+        self.sqs_client = client or aws_clients.sqs()
+        logger.info(f"ReplyRouter initialized for node {node_id}")
+
+    def reply_queue_url(self, node_id=None, lane=None):
+        """
+        Return the reply queue URL of a node (this node by default), or None if
+        per-node reply queues are not configured. Templates containing "{lane}"
+        give each priority lane its own reply queue.
+        """
+        if not self.reply_queue_url_template:
+            return None
+        return self.reply_queue_url_template.format(node_id=node_id or self.node_id,
+                                                    lane=lane or DEFAULT_PRIORITY_LANE)
+
+    @staticmethod
+    def template_problem(template):
+        """
+        Check a reply queue URL template before workers depend on it.
+
+        Returns:
+            None if the template is usable, otherwise what is wrong with it.
+        """
+        if not template:
+            return "SQS_REPLY_QUEUE_URL_TEMPLATE is not set"
+        if "{node_id}" not in template:
+            return "SQS_REPLY_QUEUE_URL_TEMPLATE must contain {node_id}"
+        try:
+            template.format(node_id="node", lane=DEFAULT_PRIORITY_LANE)
+        except (KeyError, IndexError, ValueError) as e:
+            return f"SQS_REPLY_QUEUE_URL_TEMPLATE has an unknown or malformed placeholder: {e}"
+        return None
+
+    def listen_queue_urls(self):
+        """
+        Queues this node's ResponseWorker should poll: its own reply queue first,
+        then the shared output queue for workers that do not honour reply_queue_url.
+        """
+        urls = [self.reply_queue_url(), output_tasks_queue.url]
+        return [url for url in urls if url]
+
+    def stamp(self, job: dict) -> dict:
+        """
+        Record in the job which node and reply queue its result belongs to.
+        """
+        job["reply_to"] = self.node_id
+        reply_queue_url = self.reply_queue_url(lane=job.get("lane"))
+        if reply_queue_url:
+            job["reply_queue_url"] = reply_queue_url
+        return job
+
+    def is_local(self, data: dict) -> bool:
+        """
+        Results without a reply_to stamp predate routing and are treated as local.
+        """
+        owner = data.get("reply_to")
+        return owner is None or owner == self.node_id
+
+    async def forward(self, data: dict, message: dict = None) -> bool:
+        """
+        Forward a result to the reply queue of the node that owns it.
+
+        The trace context of the original message (if any) goes along, with the
+        time the worker sent it, so the owner's trace covers both hops.
+
+        Returns:
+            True if the result was forwarded, False if there is no reply queue to
+            forward to and the message should be left for the owner to receive.
+        """
+        owner = data.get("reply_to")
+        queue_url = data.get("reply_queue_url") or self.reply_queue_url(owner, data.get("lane"))
+        if not queue_url:
+            return False
+        params = {"QueueUrl": queue_url, "MessageBody": json.dumps(data)}
+        attributes = dict((message or {}).get("MessageAttributes") or {})
+        if TRACEPARENT_ATTRIBUTE in attributes:
+            sent = (message.get("Attributes") or {}).get("SentTimestamp")
+            if sent and OUTPUT_SENT_ATTRIBUTE not in attributes:
+                attributes[OUTPUT_SENT_ATTRIBUTE] = {"DataType": "Number", "StringValue": sent}
+            params["MessageAttributes"] = attributes
+        if queue_url.endswith(".fifo"):
+            params["MessageGroupId"] = "processed_tasks"
+            params["MessageDeduplicationId"] = str(uuid.uuid4())
+        await asyncio.to_thread(self.sqs_client.send_message, **params)
+        logger.info("Forwarded result for job %s to node %s", data.get('job_id'), owner)
+        return True
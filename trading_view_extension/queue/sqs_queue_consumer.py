@@ -1,52 +1,311 @@
-from config import logger, sqs_client
-from config import logger
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    logger,
+    aws_clients,
+    SQS_VISIBILITY_TIMEOUT,
+    SQS_HEARTBEAT_INTERVAL,
+    SQS_MAX_HOLD,
+    SQS_PREFETCH,
+    SQS_RETRY_BASE_DELAY,
+    SQS_RETRY_MAX_DELAY,
+)
 from trading_view_extension.queue.sqs_queue_consumer_interface import IQueueConsumer
 
+BATCH_LIMIT = 10  # Entries per SQS batch call
+
 
 class SqsQueueConsumer(IQueueConsumer):
     """
-    A simple SQS consumer class for receiving and deleting messages from a queue.
+    SQS consumer with a prefetch buffer per queue.
+
+    The first receive from a queue starts a background task that long-polls it
+    into a bounded buffer; receive_messages() then hands out buffered messages
+    without waiting on SQS. All boto3 calls run on the consumer's own threads,
+    never on the event loop.
+
+    Messages are received with a short visibility timeout and renewed in batches
+    while they are buffered or being processed, until they are deleted or
+    released. A message whose processing failed is released with a backoff
+    delay, so it comes back in seconds rather than after a long fixed timeout.
     """
-    def __init__(self, max_messages=10, visibility_timeout=600, wait_time=5):
+    def __init__(self, max_messages=10, visibility_timeout=SQS_VISIBILITY_TIMEOUT, wait_time=5, client=None,
+                 prefetch=SQS_PREFETCH, heartbeat_interval=SQS_HEARTBEAT_INTERVAL, max_hold=SQS_MAX_HOLD,
+                 retry_base_delay=SQS_RETRY_BASE_DELAY, retry_max_delay=SQS_RETRY_MAX_DELAY):
         """
         Args:
-            max_messages: Max number of messages to fetch in one call.
-            visibility_timeout: Time in seconds that the received messages are hidden.
+            max_messages: Max number of messages handed out by one receive_messages() call.
+            visibility_timeout: Time in seconds that received messages are hidden between heartbeats.
             wait_time: Long polling wait time in seconds.
+            client: Optional SQS client (e.g. LocalSQSClient); defaults to the one from config.py.
+            prefetch: Messages buffered ahead of processing, per queue.
+            heartbeat_interval: Seconds between visibility renewals of held messages.
+            max_hold: Seconds after which a held message is no longer renewed.
+            retry_base_delay: Release delay after the first failed receive; doubles per receive.
+            retry_max_delay: Upper bound of the release delay.
         """
-        self.sqs_client = sqs_client  # Use the SQS client from config.py
+        self.sqs_client = client or aws_clients.sqs()
         self.max_messages = max_messages
         self.visibility_timeout = visibility_timeout
         self.wait_time = wait_time
+        self.prefetch = max(prefetch, max_messages)
+        self.heartbeat_interval = heartbeat_interval
+        self.max_hold = max_hold
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="sqs-consumer")
+        self.buffers = {}     # {queue_url: deque of messages received but not handed out}
+        self.has_space = {}   # {queue_url: asyncio.Event}, set while the buffer has room
+        self.prefetchers = {}  # {queue_url: asyncio.Task}
+        self.held = {}        # {receipt_handle: (queue_url, received_at)} until deleted or released
+        self.arrived = asyncio.Event()  # Set when any buffer gets messages
+        self.heartbeat_task = None
+        self.closed = False
+        self.heartbeats = 0
+        self.retries = 0
         logger.info("SqsQueueConsumer initialized")
 
-    async def receive_messages(self, queue_url: str):
+    async def _call(self, method, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, lambda: method(**kwargs))
+
+    async def receive_messages(self, queue_url: str, wait_time: int = None):
         """
-        Fetch a batch of messages from SQS.
+        Take up to max_messages messages from the queue's prefetch buffer.
         Returns a list of dictionaries as received from SQS.
+
+        Args:
+            queue_url: The queue to receive from.
+            wait_time: Seconds to wait for messages when none are buffered,
+                overriding the default (0 = return immediately).
         """
-        response = self.sqs_client.receive_message(
-            QueueUrl=queue_url,
-            MaxNumberOfMessages=self.max_messages,
-            VisibilityTimeout=self.visibility_timeout,
-            WaitTimeSeconds=self.wait_time,
-            AttributeNames=["All"],
-            MessageAttributeNames=["All"]
-        )
-        messages = response.get("Messages", [])
-        logger.debug(f"Received {len(messages)} messages from {queue_url}")
+        buffer = self._start_prefetch(queue_url)
+        wait_time = self.wait_time if wait_time is None else wait_time
+        if not buffer and wait_time > 0:
+            deadline = time.monotonic() + wait_time
+            while not buffer and not self.closed and time.monotonic() < deadline:
+                self.arrived.clear()
+                try:
+                    await asyncio.wait_for(self.arrived.wait(), deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    break
+        messages = [buffer.popleft() for _ in range(min(self.max_messages, len(buffer)))]
+        if messages:
+            self.has_space[queue_url].set()
+        logger.debug("Received %d messages from %s", len(messages), queue_url)
         return messages
 
+    async def wait_for_messages(self, timeout: float) -> bool:
+        """
+        Wait until any queue this consumer reads has buffered messages.
+
+        Returns:
+            True if messages are buffered, False if `timeout` passed first.
+        """
+        if any(self.buffers.values()):
+            return True
+        self.arrived.clear()
+        try:
+            await asyncio.wait_for(self.arrived.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _start_prefetch(self, queue_url):
+        buffer = self.buffers.get(queue_url)
+        if buffer is None:
+            buffer = self.buffers[queue_url] = deque()
+            self.has_space[queue_url] = asyncio.Event()
+            self.has_space[queue_url].set()
+            self.prefetchers[queue_url] = asyncio.create_task(self._prefetch(queue_url))
+        if self.heartbeat_task is None:
+            self.heartbeat_task = asyncio.create_task(self._heartbeat())
+        return buffer
+
+    async def _prefetch(self, queue_url):
+        """
+        Keep the queue's buffer topped up with long polls.
+        """
+        buffer = self.buffers[queue_url]
+        has_space = self.has_space[queue_url]
+        while not self.closed:
+            room = self.prefetch - len(buffer)
+            if room <= 0:
+                has_space.clear()
+                await has_space.wait()
+                continue
+            try:
+                response = await self._call(
+                    self.sqs_client.receive_message,
+                    QueueUrl=queue_url,
+                    MaxNumberOfMessages=min(room, BATCH_LIMIT),
+                    VisibilityTimeout=self.visibility_timeout,
+                    WaitTimeSeconds=self.wait_time,
+                    AttributeNames=["All"],
+                    MessageAttributeNames=["All"],
+                )
+            except Exception as e:
+                logger.warning(f"Failed to receive from {queue_url}: {e}")
+                await asyncio.sleep(1)
+                continue
+            messages = response.get("Messages", [])
+            if self.closed:
+                # Closed during the long poll; hand these straight back
+                await self._change_visibility(queue_url, [m["ReceiptHandle"] for m in messages], 0)
+                break
+            now = time.monotonic()
+            for message in messages:
+                self.held[message["ReceiptHandle"]] = (queue_url, now)
+            if messages:
+                buffer.extend(messages)
+                self.arrived.set()
+
+    async def _heartbeat(self):
+        """
+        Renew the visibility of every held message, one batch call per 10 messages.
+        """
+        while not self.closed:
+            await asyncio.sleep(self.heartbeat_interval)
+            expire_before = time.monotonic() - self.max_hold
+            by_queue = {}
+            for receipt_handle, (queue_url, received_at) in list(self.held.items()):
+                if received_at < expire_before:
+                    # Stuck; stop renewing so SQS hands it to someone else
+                    del self.held[receipt_handle]
+                    self._evict(queue_url, receipt_handle)
+                    logger.warning("Gave up renewing a message on %s held for over %ss", queue_url, self.max_hold)
+                    continue
+                by_queue.setdefault(queue_url, []).append(receipt_handle)
+            for queue_url, receipt_handles in by_queue.items():
+                try:
+                    await self._change_visibility(queue_url, receipt_handles, self.visibility_timeout)
+                except Exception as e:
+                    logger.warning(f"Failed to renew {len(receipt_handles)} messages on {queue_url}: {e}")
+            self.heartbeats += 1
+
+    async def _change_visibility(self, queue_url, receipt_handles, visibility_timeout):
+        for start in range(0, len(receipt_handles), BATCH_LIMIT):
+            batch = receipt_handles[start : start + BATCH_LIMIT]
+            response = await self._call(
+                self.sqs_client.change_message_visibility_batch,
+                QueueUrl=queue_url,
+                Entries=[{"Id": str(i), "ReceiptHandle": receipt_handle, "VisibilityTimeout": visibility_timeout}
+                         for i, receipt_handle in enumerate(batch)],
+            )
+            for failure in response.get("Failed", []):
+                # Usually a receipt handle that expired; the message is someone else's now
+                self.held.pop(batch[int(failure["Id"])], None)
+                self._evict(queue_url, batch[int(failure["Id"])])
+                logger.warning("Failed to change visibility on %s: %s", queue_url, failure.get('Message'))
+
+    def _evict(self, queue_url, receipt_handle):
+        """
+        Drop a message that is no longer renewed from the prefetch buffer, so it is
+        not handed out with a receipt handle that has expired.
+        """
+        buffer = self.buffers.get(queue_url)
+        if not buffer:
+            return
+        for message in buffer:
+            if message["ReceiptHandle"] == receipt_handle:
+                buffer.remove(message)
+                self.has_space[queue_url].set()
+                return
+
     async def delete_message(self, queue_url: str, message: dict):
         """
         Delete the given message from the queue to acknowledge successful processing.
         """
         receipt_handle = message.get("ReceiptHandle")
         if not receipt_handle:
-            logger.warning(f"No receipt handle for message {message.get('MessageId')}")
+            logger.warning("No receipt handle for message %s", message.get('MessageId'))
             return
-        self.sqs_client.delete_message(
+        self.held.pop(receipt_handle, None)
+        await self._call(self.sqs_client.delete_message, QueueUrl=queue_url, ReceiptHandle=receipt_handle)
+        logger.debug("Deleted message %s from %s", message.get('MessageId'), queue_url)
+
+    async def release_message(self, queue_url: str, message: dict, delay: int = None):
+        """
+        Make the given message visible again after `delay` seconds without deleting it,
+        so another consumer can pick it up. Without a delay, the retry backoff for
+        the message's receive count applies.
+        """
+        receipt_handle = message.get("ReceiptHandle")
+        if not receipt_handle:
+            logger.warning("No receipt handle for message %s", message.get('MessageId'))
+            return
+        if delay is None:
+            delay = self.retry_delay(message)
+            self.retries += 1
+        self.held.pop(receipt_handle, None)
+        await self._call(
+            self.sqs_client.change_message_visibility,
             QueueUrl=queue_url,
-            ReceiptHandle=receipt_handle
+            ReceiptHandle=receipt_handle,
+            VisibilityTimeout=delay,
         )
-        logger.debug(f"Deleted message {message.get('MessageId')} from {queue_url}")
+        logger.debug("Released message %s on %s for %ss", message.get('MessageId'), queue_url, delay)
+
+    def retry_delay(self, message: dict) -> int:
+        """
+        Backoff before a failed message is retried: base * 2^(receives - 1), capped.
+        """
+        try:
+            receives = int(message.get("Attributes", {}).get("ApproximateReceiveCount", 1))
+        except (TypeError, ValueError):
+            receives = 1
+        delay = self.retry_base_delay * 2 ** min(max(receives - 1, 0), 16)
+        return int(round(min(delay, self.retry_max_delay)))
+
+    async def close(self) -> None:
+        """
+        Stop prefetching and hand every buffered message back to the queue at once,
+        so other consumers can take them. Takes up to `wait_time` while long polls
+        finish. Messages already handed out stay with their caller until it
+        deletes or releases them.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.arrived.set()
+        for has_space in self.has_space.values():
+            has_space.set()
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+        if self.prefetchers:
+            # Let running long polls return (and release what they got) first, or
+            # they would take back the messages released below
+            await asyncio.wait(self.prefetchers.values(), timeout=self.wait_time + 1)
+        released = 0
+        for queue_url, buffer in self.buffers.items():
+            receipt_handles = [message["ReceiptHandle"] for message in buffer]
+            buffer.clear()
+            for receipt_handle in receipt_handles:
+                self.held.pop(receipt_handle, None)
+            try:
+                await self._change_visibility(queue_url, receipt_handles, 0)
+                released += len(receipt_handles)
+            except Exception as e:
+                logger.warning(f"Failed to release buffered messages on {queue_url}: {e}")
+        logger.info(f"SqsQueueConsumer closed; released {released} prefetched messages")
+
+    async def queue_depth(self, queue_url: str) -> int:
+        """
+        Approximate number of messages waiting (not in flight) on the queue.
+        """
+        response = await self._call(
+            self.sqs_client.get_queue_attributes,
+            QueueUrl=queue_url,
+            AttributeNames=["ApproximateNumberOfMessages"],
+        )
+        return int(response.get("Attributes", {}).get("ApproximateNumberOfMessages", 0))
+
+    def stats(self) -> dict:
+        buffered = sum(len(buffer) for buffer in self.buffers.values())
+        return {
+            "buffered": buffered,
+            "processing": len(self.held) - buffered,
+            "heartbeats": self.heartbeats,
+            "retries": self.retries,
+        }
@@ -42,4 +42,16 @@ class IQueueConsumer(ABC):
         This is typically required to signal the queue system that
         the message was successfully processed.
         """
+        pass
+
+    @abstractmethod
+    def release_message(self, message: any, delay: int = None) -> None:
+        """
+        Return the specified message to the queue without processing it.
+
+        Args:
+            message (QueueMessage): The message object to release.
+            delay (int): Seconds before the message becomes visible again; None
+                applies the consumer's retry backoff.
+        """
         pass
\ No newline at end of file
@@ -1,60 +1,166 @@
 # trading_view_extension/queues/sqs_queue_publisher.py
 
+import asyncio
 import json
+import time
 import uuid
+from collections import OrderedDict
 from typing import Dict
-from config import logger, input_tasks_queue, output_tasks_queue
+from urllib.parse import urlparse
+from config import (
+    logger,
+    aws_clients,
+    input_tasks_queue,
+    output_tasks_queue,
+    cancel_tasks_queue,
+    AGENT_QUEUE_URLS,
+    AWS_REGION,
+    INFLIGHT_TTL,
+)
 from trading_view_extension.queue.sqs_queue_publisher_interface import IQueuePublisher
+from trading_view_extension.queue.priority_lanes import PriorityLanes
+
+# Jobs whose input queue is remembered, so their cancel notices can follow them
+MAX_TRACKED_JOBS = 10_000
 
 class SQSQueuePublisher(IQueuePublisher):
-    def __init__(self):
+    def __init__(self, client=None, lanes: PriorityLanes = None, agent_queue_urls: Dict[str, str] = None):
         """
         Initialize the SQS clients from the SQSQueue dataclass 
         (which were already initialized in config.py).
+
+        Args:
+            client: Optional SQS client (e.g. LocalSQSClient) used for all queues instead.
+            lanes: Optional PriorityLanes; analysis jobs then go to their lane's queue.
+            agent_queue_urls: Optional {agent: queue_url} routing table; defaults to
+                AGENT_QUEUE_URLS. An agent's queue takes precedence over its lane's.
         """
+        self.lanes = lanes
+        self.agent_queue_urls = AGENT_QUEUE_URLS if agent_queue_urls is None else agent_queue_urls
+        self.client = client
+        self.clients = {}  # {queue_url: client}
+        self.job_destinations = OrderedDict()  # {job_id: (queue_url, published_at)}, oldest first
         try:
             # Use the clients stored in input_tasks_queue and output_tasks_queue
-            self.input_sqs_client = input_tasks_queue.client
-            self.output_sqs_client = output_tasks_queue.client
+            self.input_sqs_client = client or input_tasks_queue.client
+            self.output_sqs_client = client or output_tasks_queue.client
             logger.info("SQS clients initialized successfully.")
         except Exception as e:
             logger.exception("Failed to initialize SQS clients.")
             raise
 
-    async def publish_task(self, job: dict) -> None:
+    def analysis_destination(self, job: dict):
+        """
+        Queue URL and message group for an analysis job: the agent's own queue if
+        it has one, otherwise its priority lane's queue. The lane always picks the
+        message group.
+        """
+        lane = job.get("lane")
+        message_group_id = self.lanes.message_group_id(lane) if self.lanes else "analysis_tasks"
+        queue_url = self.agent_queue_urls.get(job.get("agent"))
+        if not queue_url:
+            queue_url = self.lanes.input_queue_url(lane) if self.lanes else input_tasks_queue.url
+        return queue_url, message_group_id
+
+    def cancel_destination(self, job_id) -> str:
+        """
+        Queue URL for a job's cancel notice: the agent or lane queue the job was
+        published to, or cancel_tasks_queue for jobs this publisher does not know
+        (published by another process, or too long ago).
+        """
+        self.forget_old_destinations()
+        destination = self.job_destinations.get(job_id)
+        return destination[0] if destination else cancel_tasks_queue.url
+
+    def remember_destination(self, job_id, queue_url: str) -> None:
+        if job_id is None:
+            return
+        self.job_destinations[job_id] = (queue_url, time.monotonic())
+        self.job_destinations.move_to_end(job_id)
+        self.forget_old_destinations()
+
+    def forget_old_destinations(self) -> None:
+        cutoff = time.monotonic() - INFLIGHT_TTL
+        while self.job_destinations:
+            job_id, (_, published_at) = next(iter(self.job_destinations.items()))
+            if published_at > cutoff and len(self.job_destinations) <= MAX_TRACKED_JOBS:
+                break
+            del self.job_destinations[job_id]
+
+    def client_for(self, queue_url: str):
+        """
+        Return the cached SQS client for a queue, creating one for the queue's
+        region on first use.
+        """
+        client = self.clients.get(queue_url)
+        if client is None:
+            client = self.client or self.regional_client(self.queue_region(queue_url))
+            self.clients[queue_url] = client
+        return client
+
+    def regional_client(self, region: str):
+        if region == AWS_REGION:
+            return self.input_sqs_client
+        return aws_clients.sqs(region)  # Shared by queues in the same region
+
+    @staticmethod
+    def queue_region(queue_url: str) -> str:
+        """
+        Region of a queue URL like https://sqs.<region>.amazonaws.com/<account>/<name>.
+        """
+        host = urlparse(queue_url or "").hostname or ""
+        parts = host.split(".")
+        if len(parts) >= 3 and parts[0] == "sqs" and parts[-2:] == ["amazonaws", "com"]:
+            return parts[1]
+        return AWS_REGION
+
+    async def publish_task(self, job: dict, message_attributes: dict = None) -> None:
         """
         Publish a message to the appropriate SQS FIFO queue based on the action_type.
 
         Args:
             job (dict): The data to send in the message.
+            message_attributes: Optional SQS message attributes (e.g. the trace context).
         """
         try:
             action_type = job.get("action_type")
             if action_type == "analysis":
-                client = self.input_sqs_client
-                queue_url = input_tasks_queue.url
-                message_group_id = "analysis_tasks"
+                queue_url, message_group_id = self.analysis_destination(job)
+                client = self.client_for(queue_url)
             elif action_type == "processed":
                 client = self.output_sqs_client
-                queue_url = output_tasks_queue.url
+                # Results go to the reply queue of the gateway node that owns the job
+                queue_url = job.get("reply_queue_url") or output_tasks_queue.url
                 message_group_id = "processed_tasks"
+            elif action_type == "cancel":
+                # Same queue as the job, so the agent fleet working on it sees the notice
+                queue_url = self.cancel_destination(job.get("job_id"))
+                client = self.client_for(queue_url)
+                message_group_id = "cancel_tasks"
             else:
                 logger.warning(f"Unknown action_type '{action_type}'. Defaulting to input_tasks_queue.")
-                client = self.input_sqs_client
-                queue_url = input_tasks_queue.url
-                message_group_id = "analysis_tasks"
+                queue_url, message_group_id = self.analysis_destination(job)
+                client = self.client_for(queue_url)
 
             message_deduplication_id = str(uuid.uuid4())
             message_body = json.dumps(job)
 
-            response = client.send_message(
+            params = {}
+            if message_attributes:
+                params["MessageAttributes"] = message_attributes
+            # boto3 blocks until SQS answers; keep the event loop free meanwhile
+            response = await asyncio.to_thread(
+                client.send_message,
                 QueueUrl=queue_url,
                 MessageBody=message_body,
                 MessageGroupId=message_group_id,
-                MessageDeduplicationId=message_deduplication_id
+                MessageDeduplicationId=message_deduplication_id,
+                **params
             )
 
-            logger.info(f"Message sent to SQS ({action_type}) with MessageId: {response.get('MessageId')}")
+            if action_type == "analysis":
+                self.remember_destination(job.get("job_id"), queue_url)
+            logger.info("Message sent to SQS (%s) with MessageId: %s", action_type, response.get('MessageId'))
         except Exception as e:
             logger.exception("Failed to publish message to SQS.")
             raise
@@ -20,7 +20,7 @@ class QueueMessage:
 
 class IQueuePublisher(ABC):
     @abstractmethod
-    async def publish_task(self, job: dict) -> None:
+    async def publish_task(self, job: dict, message_attributes: dict = None) -> None:
         pass
 
 
@@ -1,8 +1,13 @@
+import uuid
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from config import logger, DATABASE_URL
+from psycopg2.extras import Json, RealDictCursor
+from config import logger, DATABASE_URL, JOB_HISTORY_PAGE_SIZE, JOB_HISTORY_CHUNK_SIZE
 
-# Database connection details
+# Columns of a job returned by iter_job_history; routing ids (websocket_id) and
+# user_id are never sent back to clients. "result" holds final results that could
+# not be delivered (see save_result).
+JOB_HISTORY_COLUMNS = ("job_id", "tab_id", "agent", "action_type", "status", "filenames", "s3_urls",
+                       "result", "created_at", "updated_at")
 
 class DBConnection:
     def __init__(self):
@@ -37,6 +42,9 @@ class DBConnection:
                         "agent": "model_a",
                         "status": "pending"
                     }
+
+        Returns:
+            True if the job was inserted, False otherwise.
         """
         try:
             with self.connection.cursor() as cursor:
@@ -57,8 +65,10 @@ class DBConnection:
             ))
                 self.connection.commit()
                 logger.info("Job inserted successfully.")
+                return True
         except Exception as e:
             logger.info("Error inserting job:", e)
+            return False
 
 
     def fetch_job(self, user_id, tab_id):
@@ -86,6 +96,66 @@ class DBConnection:
             logger.info("Error fetching job:", e)
             return None
         
+    def iter_job_history(self, user_id, after=None, limit=None,
+                         page_size=JOB_HISTORY_PAGE_SIZE, chunk_size=JOB_HISTORY_CHUNK_SIZE):
+        """
+        Stream a user's jobs, newest first, as lists of at most `chunk_size` rows.
+
+        Pages are read with keyset pagination over (created_at, job_id), so every
+        page is an index range scan (ideally on jobs(user_id, created_at, job_id))
+        no matter how deep into the history we are. Each page is read through a
+        named, server-side cursor, so only one chunk is held in memory at a time.
+
+        Args:
+            user_id: The user_id to filter by.
+            after: Optional (created_at, job_id) key; only older jobs are returned.
+            limit: Optional maximum number of rows to return in total.
+            page_size: Rows per keyset page.
+            chunk_size: Rows per yielded chunk.
+
+        Yields:
+            Lists of job records as dictionaries.
+        """
+        remaining = limit
+        while remaining is None or remaining > 0:
+            page_limit = page_size if remaining is None else min(page_size, remaining)
+            keyset_clause = "AND (created_at, job_id) < (%s, %s)" if after else ""
+            query = f"""
+                SELECT {", ".join(JOB_HISTORY_COLUMNS)}
+                FROM jobs
+                WHERE user_id = %s {keyset_clause}
+                ORDER BY created_at DESC, job_id DESC
+                LIMIT %s
+            """
+            params = (user_id, *after, page_limit) if after else (user_id, page_limit)
+
+            # WITH HOLD keeps the cursor alive if another coroutine commits on this
+            # shared connection while we are awaiting a send between chunks.
+            cursor = self.connection.cursor(
+                name=f"job_history_{uuid.uuid4().hex}",
+                cursor_factory=RealDictCursor,
+                withhold=True,
+            )
+            cursor.itersize = chunk_size
+            page_rows = 0
+            try:
+                cursor.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    page_rows += len(rows)
+                    after = (rows[-1]["created_at"], rows[-1]["job_id"])
+                    yield rows
+            finally:
+                cursor.close()
+                self.connection.commit()
+
+            if remaining is not None:
+                remaining -= page_rows
+            if page_rows < page_limit:
+                return
+
     def update_job_status(self, job_id, status):
         """
         Update the status of a job record in the jobs table.
@@ -108,6 +178,38 @@ class DBConnection:
         except Exception as e:
             logger.info("Error updating job status:", e)
 
+    def save_result(self, job_id, status, result):
+        """
+        Keep the final result of a job that could not be delivered (its session is
+        gone, e.g. after a restart), so the client can fetch it with job_history.
+        Needs the jobs.result column (ALTER TABLE jobs ADD COLUMN result JSONB).
+
+        Args:
+            job_id: The job the result belongs to.
+            status: The job's final status.
+            result: The result as a dictionary.
+
+        Returns:
+            True if the job record was updated, False if there is no record of the job.
+
+        Raises:
+            psycopg2.Error: The update failed; worth retrying.
+        """
+        try:
+            with self.connection.cursor() as cursor:
+                query = """
+                    UPDATE jobs
+                    SET status = %s, result = %s, updated_at = NOW()
+                    WHERE job_id = %s
+                """
+                cursor.execute(query, (status, Json(result), job_id))
+                updated = cursor.rowcount > 0
+            self.connection.commit()
+            return updated
+        except Exception:
+            self.connection.rollback()
+            raise
+
     def close_connection(self):
         """
         Close the PostgreSQL database connection.
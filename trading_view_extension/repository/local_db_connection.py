@@ -0,0 +1,84 @@
+import threading
+from datetime import datetime, timezone
+from config import logger, JOB_HISTORY_PAGE_SIZE, JOB_HISTORY_CHUNK_SIZE
+from trading_view_extension.repository.db_connection import JOB_HISTORY_COLUMNS
+
+
+class LocalDBConnection:
+    """
+    In-memory stand-in for DBConnection, for local runs and load tests.
+
+    Implements the same methods over a dict of job rows; nothing is persisted.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jobs = {}  # {job_id: row}
+        logger.info("LocalDBConnection initialized")
+
+    def insert_job(self, job_data):
+        """
+        Insert a job record. Returns True if the job was inserted, False otherwise.
+        """
+        try:
+            now = datetime.now(timezone.utc)
+            row = {
+                key: job_data[key]
+                for key in ("job_id", "user_id", "tab_id", "websocket_id", "agent", "status",
+                            "action_type", "filenames", "s3_urls")
+            }
+            row["created_at"] = row["updated_at"] = now
+            with self._lock:
+                self.jobs[row["job_id"]] = row
+            return True
+        except Exception as e:
+            logger.error(f"Error inserting job: {e}")
+            return False
+
+    def fetch_job(self, user_id, tab_id):
+        with self._lock:
+            for row in self.jobs.values():
+                if row["user_id"] == user_id and row["tab_id"] == tab_id:
+                    return dict(row)
+        return None
+
+    def iter_job_history(self, user_id, after=None, limit=None,
+                         page_size=JOB_HISTORY_PAGE_SIZE, chunk_size=JOB_HISTORY_CHUNK_SIZE):
+        """
+        Stream a user's jobs, newest first, as lists of at most `chunk_size` rows
+        with the same columns as DBConnection.iter_job_history.
+        """
+        with self._lock:
+            rows = [{column: row.get(column) for column in JOB_HISTORY_COLUMNS}
+                    for row in self.jobs.values() if row["user_id"] == user_id]
+        rows.sort(key=lambda row: (row["created_at"], row["job_id"]), reverse=True)
+        if after:
+            after_key = (str(after[0]), str(after[1]))
+            rows = [row for row in rows if (str(row["created_at"]), row["job_id"]) < after_key]
+        if limit is not None:
+            rows = rows[:limit]
+        for start in range(0, len(rows), chunk_size):
+            yield rows[start:start + chunk_size]
+
+    def update_job_status(self, job_id, status):
+        with self._lock:
+            row = self.jobs.get(job_id)
+            if row is not None:
+                row["status"] = status
+                row["updated_at"] = datetime.now(timezone.utc)
+
+    def save_result(self, job_id, status, result):
+        """
+        Keep the final result of an undelivered job (see DBConnection.save_result).
+        Returns False if there is no record of the job.
+        """
+        with self._lock:
+            row = self.jobs.get(job_id)
+            if row is None:
+                return False
+            row["status"] = status
+            row["result"] = result
+            row["updated_at"] = datetime.now(timezone.utc)
+        return True
+
+    def close_connection(self):
+        logger.info("Local database closed.")
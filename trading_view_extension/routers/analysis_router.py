@@ -1,15 +1,46 @@
+import asyncio
+import json
 from config import logger
 from utils.upload_to_s3 import upload_to_s3
 from trading_view_extension.repository.db_connection import DBConnection
 from trading_view_extension.managers.analysis_task_manager import AnalysisTaskManager
+from trading_view_extension.managers.load_shedder import LoadShedder
+from trading_view_extension.managers.cancellation_manager import CancellationManager
+from utils.metrics import STAGE_SECONDS
+from utils.tracing import span
+
+S3_UPLOAD_SECONDS = STAGE_SECONDS.labels("s3_upload")
+DB_INSERT_SECONDS = STAGE_SECONDS.labels("db_insert")
+SQS_PUBLISH_SECONDS = STAGE_SECONDS.labels("sqs_publish")
+
+
+class JobInsertError(Exception):
+    """
+    Raised when the job record could not be written to the database.
+    """
+
 
 class AnalysisRouter:
-    def __init__(self, db:DBConnection, task_manager:AnalysisTaskManager):
+    def __init__(self, db:DBConnection, task_manager:AnalysisTaskManager, load_shedder:LoadShedder=None,
+                 cancellation_manager:CancellationManager=None, s3_client=None):
         """
         Initialize AnalysisRouter with a DBConnection instance.
+
+        s3_client optionally replaces the boto3 S3 client used for uploads (e.g.
+        LocalS3Client in local runs).
+
+        When a LoadShedder is given, S3 uploads, DB inserts and SQS publishes go
+        through its circuit breakers. When a CancellationManager is given, jobs
+        cancelled before they were published are dropped instead of published.
         """
         self.db = db
         self.task_manager = task_manager
+        self.load_shedder = load_shedder
+        self.cancellation_manager = cancellation_manager
+        self.s3_client = s3_client
+
+    def is_cancelled(self, job_id):
+        return self.cancellation_manager is not None and self.cancellation_manager.is_cancelled(job_id)
 
 
     async def create_analysis(self, data):
@@ -20,15 +51,98 @@ class AnalysisRouter:
         - 'file_paths': list of local file paths
         - 'filenames': list of original file names (optional, just for reference)
         - other metadata like 'agent', 'tab_id', 'user_id'...
+        - optionally 'trace', a Trace that records each step
+
+        Raises:
+            CircuitOpenError: A dependency's circuit breaker is open; nothing
+                further was done for the job.
         """
+        trace = data.get("trace")
+        job_id = data.get("job_id")
         try:
-            # Upload all file paths to S3 and get the S3 URLs
-            s3_urls = upload_to_s3(data.get('file_paths', []))
-            # Add S3 URLs to data
-            data['s3_urls'] = s3_urls
-            self.db.insert_job(data)  # Use DBConnection instance
-            await self.task_manager.publish_analysis_task(**data)
-
+            with S3_UPLOAD_SECONDS.time(), span(trace, "s3_upload"):
+                data['s3_urls'] = await self.call("s3", upload_to_s3, data.get('file_paths', []), client=self.s3_client)
+            with DB_INSERT_SECONDS.time(), span(trace, "db_insert"):
+                try:
+                    await self.call("db", self.insert_job, data)
+                except JobInsertError:
+                    # Counts against the DB breaker, but the job still runs without its history row
+                    logger.warning("Job %s was not recorded in the database", job_id)
+            if self.is_cancelled(job_id):
+                logger.info("Job %s was cancelled before publishing; dropped", job_id)
+                return
+            with SQS_PUBLISH_SECONDS.time(), span(trace, "sqs_publish"):
+                await self.call_async("sqs", self.task_manager.publish_analysis_task, **data)
         except Exception as e:
-            logger.error(f"Failed to create analysis job: {e}")
+            logger.error("Failed to create analysis job: %s", e)
             raise
+
+    async def call(self, dependency, fn, *args, **kwargs):
+        """
+        Run a blocking function on a worker thread through the circuit breaker of
+        `dependency` ("s3", "db" or "sqs"), or directly when there is no LoadShedder.
+
+        The event loop keeps delivering results while the call waits, and the
+        breaker times the call itself rather than a stalled loop.
+        """
+        if self.load_shedder is None:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        return await self.load_shedder.breaker(dependency).call_async(asyncio.to_thread, fn, *args, **kwargs)
+
+    async def call_async(self, dependency, fn, *args, **kwargs):
+        """
+        Await a coroutine function through the circuit breaker of `dependency`.
+        """
+        if self.load_shedder is None:
+            return await fn(*args, **kwargs)
+        return await self.load_shedder.breaker(dependency).call_async(fn, *args, **kwargs)
+
+    def insert_job(self, data):
+        """
+        DBConnection.insert_job reports failures instead of raising; raise so the
+        DB breaker sees them.
+        """
+        if not self.db.insert_job(data):
+            raise JobInsertError(f"Failed to insert job {data.get('job_id')}")
+
+    async def stream_job_history(self, websocket, user_id, cursor=None, limit=None):
+        """
+        Stream a user's job history to the websocket, one frame per chunk of rows.
+
+        Frames look like {"type": "job_history", "jobs": [...]} and the stream ends
+        with {"type": "job_history_end", "count": n, "next_cursor": ...}. Passing
+        `next_cursor` back as `cursor` continues where the previous call stopped;
+        it is None once the history is exhausted.
+
+        Args:
+            websocket: The WebSocket connection to stream to.
+            user_id: The user whose jobs are listed.
+            cursor: Optional {"created_at": ..., "job_id": ...} keyset cursor.
+            limit: Optional maximum number of jobs to send.
+        """
+        after = (cursor["created_at"], cursor["job_id"]) if cursor else None
+        count = 0
+        last_row = None
+        history = self.db.iter_job_history(user_id, after=after, limit=limit)
+        try:
+            # The cursor reads block on the database, so each chunk is pulled on a
+            # worker thread rather than on the event loop
+            while (rows := await asyncio.to_thread(next, history, None)) is not None:
+                count += len(rows)
+                last_row = rows[-1]
+                # websocket.send() waits for the transport to drain, so a slow client
+                # throttles how fast we pull rows from the cursor.
+                await websocket.send(json.dumps({"type": "job_history", "jobs": rows}, default=str))
+        finally:
+            # Release the server-side cursor even if the client went away mid-stream
+            await asyncio.to_thread(history.close)
+
+        next_cursor = None
+        if limit is not None and count >= limit and last_row is not None:
+            next_cursor = {"created_at": str(last_row["created_at"]), "job_id": str(last_row["job_id"])}
+        await websocket.send(json.dumps({
+            "type": "job_history_end",
+            "count": count,
+            "next_cursor": next_cursor,
+        }))
+        logger.info("Streamed %d history jobs for user %s", count, user_id)
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import time
+from config import logger, input_tasks_queue, cancel_tasks_queue, AGENT_QUEUE_URLS, S3_RESULTS_BUCKET_NAME
+from trading_view_extension.queue.sqs_queue_consumer import SqsQueueConsumer
+from trading_view_extension.queue.sqs_queue_publisher import SQSQueuePublisher
+from trading_view_extension.queue.priority_lanes import PriorityLanes
+from utils.tracing import echo_attributes
+
+
+class LocalAnalysisWorker:
+    """
+    Stand-in for the analysis worker fleet, for local runs and load tests.
+
+    Takes analysis tasks off the input queues and, after `latency` seconds,
+    publishes a progress update and then a final result that echoes the job, the
+    way the real workers do. Honours cancellation notices and job deadlines, and
+    echoes the job's trace context on its results.
+
+    With `result_bytes` and an S3 client, each result is a report of that size
+    stored in S3 and delivered as a claim-check ("result_ref").
+    """
+    def __init__(self, queue_consumer: SqsQueueConsumer, queue_publisher: SQSQueuePublisher,
+                 lanes: PriorityLanes = None, latency=0.5, concurrency=256, s3_client=None, result_bytes=0):
+        self.queue_consumer = queue_consumer
+        self.queue_publisher = queue_publisher
+        self.lanes = lanes
+        self.latency = latency
+        self.s3_client = s3_client
+        self.result_bytes = result_bytes
+        self.slots = asyncio.Semaphore(concurrency)
+        self.cancelled = set()
+        self.completed = 0
+        logger.info("LocalAnalysisWorker initialized")
+
+    def queue_urls(self):
+        urls = [input_tasks_queue.url, cancel_tasks_queue.url, *AGENT_QUEUE_URLS.values()]
+        if self.lanes:
+            urls += [self.lanes.input_queue_url(lane) for lane in self.lanes.lanes]
+        return list(dict.fromkeys(url for url in urls if url))
+
+    async def start(self) -> None:
+        queue_urls = self.queue_urls()
+        logger.info(f"LocalAnalysisWorker consuming {queue_urls}")
+        while True:
+            received = 0
+            for queue_url in queue_urls:
+                messages = await self.queue_consumer.receive_messages(queue_url, wait_time=0)
+                received += len(messages)
+                for message in messages:
+                    await self.queue_consumer.delete_message(queue_url, message)
+                    self.dispatch(json.loads(message["Body"]), echo_attributes(message))
+            if not received:
+                await asyncio.sleep(0.01)
+
+    def dispatch(self, job: dict, attributes: dict = None) -> None:
+        if job.get("task_type") == "cancel_task":
+            self.cancelled.add(job.get("job_id"))
+        elif job.get("task_type") == "analysis_task":
+            asyncio.create_task(self.process(job, attributes))
+
+    async def process(self, job: dict, attributes: dict = None) -> None:
+        async with self.slots:
+            job_id = job.get("job_id")
+            result = dict(job, action_type="processed")
+            expires_at = job.get("expires_at")
+            if expires_at is not None and time.time() > expires_at:
+                await self.queue_publisher.publish_task(dict(result, status="EXPIRED"), attributes)
+                return
+            await self.queue_publisher.publish_task(
+                dict(result, message_type="progress", seq=0, status="PROCESSING", progress=0.0), attributes
+            )
+            await asyncio.sleep(self.latency)
+            if job_id in self.cancelled:
+                self.cancelled.discard(job_id)
+                return
+            analysis = {"summary": f"Local analysis of {len(job.get('s3_urls') or [])} image(s)"}
+            if self.s3_client is not None and self.result_bytes > 0:
+                result["result_ref"] = await asyncio.to_thread(self.store_report, job_id, analysis)
+            else:
+                result["analysis"] = analysis
+            await self.queue_publisher.publish_task(dict(result, status="COMPLETED"), attributes)
+            self.completed += 1
+
+    def store_report(self, job_id, analysis: dict) -> dict:
+        """
+        Store a report of about `result_bytes` bytes and return its claim-check reference.
+        """
+        report = json.dumps(dict(analysis, report="." * self.result_bytes)).encode("utf-8")
+        key = f"results/{job_id}.json"
+        self.s3_client.put_object(Bucket=S3_RESULTS_BUCKET_NAME, Key=key, Body=report)
+        return {"bucket": S3_RESULTS_BUCKET_NAME, "key": key, "size": len(report),
+                "content_type": "application/json"}
@@ -1,8 +1,27 @@
 import asyncio
 import json
-from config import logger, output_tasks_queue
+import time
+from config import logger, output_tasks_queue, EXPIRED_RESULT_POLICY, LANE_DEPTH_INTERVAL, SQS_HANDOFF_DELAY
 from trading_view_extension.queue.sqs_queue_consumer import SqsQueueConsumer
 from trading_view_extension.managers.session_manager import SessionManager
+from trading_view_extension.queue.reply_router import ReplyRouter
+from trading_view_extension.queue.priority_lanes import PriorityLanes
+from trading_view_extension.managers.topic_manager import TopicManager
+from trading_view_extension.managers.admission_controller import AdmissionController
+from trading_view_extension.managers.cancellation_manager import CancellationManager
+from trading_view_extension.managers.partial_result_coalescer import PartialResultCoalescer
+from trading_view_extension.managers.result_streamer import ResultStreamer
+from utils.metrics import STAGE_SECONDS
+from utils.tracing import Tracer
+
+QUEUE_RECEIVE_SECONDS = STAGE_SECONDS.labels("queue_receive")
+RESULT_DECODE_SECONDS = STAGE_SECONDS.labels("result_decode")
+
+INTERMEDIATE_MESSAGE_TYPES = ("progress", "partial")
+TERMINAL_STATUSES = ("COMPLETED", "FAILED", "CANCELLED", "EXPIRED")
+# Routing fields left out of results kept for job_history
+ROUTING_FIELDS = ("websocket_id", "reply_to", "reply_queue_url")
+
 
 class ResponseWorker:
     """
@@ -14,10 +33,35 @@ class ResponseWorker:
         self,
         queue_consumer: SqsQueueConsumer,
         session_manager: SessionManager,  # Accept SessionManager instance
-        job_repository=None,   # Optional: if you need to interact with the database
-        real_time_manager=None # Optional: if you need to push updates to users
+        job_repository=None,   # Optional: keeps undeliverable final results for job_history
+        real_time_manager=None, # Optional: if you need to push updates to users
+        reply_router: ReplyRouter = None,  # Optional: route results between gateway nodes
+        topic_manager: TopicManager = None,  # Optional: broadcast results to asset subscribers
+        admission_controller: AdmissionController = None,  # Optional: frees in-flight slots
+        cancellation_manager: CancellationManager = None,  # Optional: drops results of cancelled jobs
+        expired_result_policy: str = EXPIRED_RESULT_POLICY,  # "drop" or "mark" results past their deadline
+        lanes: PriorityLanes = None,  # Optional: weighted polling across priority lanes
+        partial_coalescer: PartialResultCoalescer = None,  # Optional: merges progress/partial messages
+        tracer: Tracer = None,  # Optional: closes job traces when final results are handled
+        result_streamer: ResultStreamer = None,  # Optional: streams claim-check results from S3
+        handoff_delay: int = SQS_HANDOFF_DELAY  # Seconds before another node's result is handed back
     ):
         self.queue_consumer = queue_consumer
+        self.reply_router = reply_router
+        self.topic_manager = topic_manager
+        self.admission_controller = admission_controller
+        self.cancellation_manager = cancellation_manager
+        self.expired_result_policy = expired_result_policy
+        self.lanes = lanes
+        self.partial_coalescer = partial_coalescer
+        self.tracer = tracer
+        self.result_streamer = result_streamer
+        self.handoff_delay = handoff_delay
+        self.results_received = 0
+        self.results_handed_back = 0
+        self.results_expired = 0
+        self.stopping = False
+        self.stopped = asyncio.Event()
         self.job_repository = job_repository
         self.real_time_manager = real_time_manager
         self.session_manager = session_manager
@@ -25,59 +69,327 @@ class ResponseWorker:
 
     async def start_listening(self) -> None:
         """
-        Continuously fetch messages from the "analysis-completed" SQS queue and process them.
+        Continuously fetch messages from this node's reply queue and the shared
+        "analysis-completed" SQS queue and process them.
+
+        With priority lanes, each round polls every lane's queues up to `weight`
+        times (stopping early when a queue runs dry), highest priority first. The
+        consumer prefetches every queue in the background, so polls never wait on
+        SQS and an empty high-priority queue never holds up a busy low-priority one;
+        when all are empty the worker sleeps until any of them has messages.
+        """
+        queues = self.listen_queues()
+        logger.info(f"ResponseWorker listening on {[url for _, url, _ in queues]}")
+        next_depth_sample = 0.0
+        while not self.stopping:
+            if self.lanes and time.monotonic() >= next_depth_sample:
+                next_depth_sample = time.monotonic() + LANE_DEPTH_INTERVAL
+                await self.sample_lane_depths()
+            received = 0
+            for lane, queue_url, weight in queues:
+                for _ in range(weight):
+                    count = await self.poll_queue(queue_url, wait_time=0)
+                    received += count
+                    if count < self.queue_consumer.max_messages:
+                        break
+            if not received and not self.stopping:
+                await self.queue_consumer.wait_for_messages(timeout=1)
+        self.stopped.set()
+        logger.info("ResponseWorker stopped")
+
+    async def stop(self, timeout=None) -> None:
+        """
+        Stop polling after the current round. Messages already received are
+        processed and deleted (or released) before this returns; call close()
+        afterwards to hand prefetched ones back to the queue.
+        """
+        self.stopping = True
+        try:
+            await asyncio.wait_for(self.stopped.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"ResponseWorker did not stop within {timeout}s")
+
+    async def close(self) -> None:
+        """
+        Return prefetched messages to the queue, so nothing this process took off
+        it stays invisible until its timeout.
+        """
+        await self.queue_consumer.close()
+
+    def listen_queues(self):
+        """
+        Queues to poll as (lane, queue_url, weight) tuples, in priority order.
+        """
+        if self.lanes:
+            return self.lanes.listen_queues(self.reply_router)
+        if self.reply_router:
+            queue_urls = self.reply_router.listen_queue_urls()
+        else:
+            queue_urls = [output_tasks_queue.url]  # Fetch the output queue URL from config
+        return [(None, queue_url, 1) for queue_url in queue_urls]
+
+    async def sample_lane_depths(self) -> None:
+        """
+        Record the backlog of each lane's input queue.
         """
-        queue_url = output_tasks_queue.url  # Fetch the output queue URL from config
-        logger.info(f"ResponseWorker listening on {queue_url}")
-        while True:
+        for lane in self.lanes.lanes:
+            queue_url = self.lanes.input_queue_url(lane)
             try:
-                messages = await self.queue_consumer.receive_messages(queue_url)
-                logger.debug(f"Received {len(messages)} jobs in output queue")
-                for message in messages:
-                    try:
-                        await self.process_completed_task(message)
-                    except Exception as exc:
-                        logger.exception(f"Failed to process message {message.get('MessageId')}: {exc}")
-                    finally:
-                        # Always delete the message to avoid infinite re-delivery
-                        await self.queue_consumer.delete_message(queue_url, message)
+                depth = await self.queue_consumer.queue_depth(queue_url)
             except Exception as e:
-                logger.exception(f"Error while fetching messages: {e}")
-            await asyncio.sleep(1)  # Adjust the sleep duration as needed
+                logger.warning("Failed to sample depth of lane %s: %s", lane, e)
+                continue
+            self.lanes.record_depth(lane, queue_url, depth)
+
+    async def poll_queue(self, queue_url: str, wait_time: int = None) -> int:
+        """
+        Receive one batch of messages from queue_url and process them.
+
+        Returns:
+            The number of messages received.
+        """
+        messages = []
+        try:
+            with QUEUE_RECEIVE_SECONDS.time():
+                messages = await self.queue_consumer.receive_messages(queue_url, wait_time=wait_time)
+            logger.debug("Received %d jobs in %s", len(messages), queue_url)
+            for message in messages:
+                try:
+                    handled = await self.process_completed_task(message)
+                    if not handled:
+                        # Another node's result with nowhere to forward it
+                        release_delay = self.handoff_delay
+                        self.count_hand_back()
+                except Exception as exc:
+                    logger.exception("Failed to process message %s: %s", message.get('MessageId'), exc)
+                    handled = False
+                    release_delay = None  # Retry after a backoff
+                try:
+                    if handled:
+                        await self.queue_consumer.delete_message(queue_url, message)
+                    else:
+                        await self.queue_consumer.release_message(queue_url, message, delay=release_delay)
+                except Exception as e:
+                    # The message reappears once its visibility timeout runs out
+                    logger.warning("Failed to acknowledge message %s: %s", message.get('MessageId'), e)
+        except Exception as e:
+            logger.exception("Error while fetching messages: %s", e)
+        return len(messages)
+
+    def count_hand_back(self) -> None:
+        """
+        Count a result handed back for its owner. Every hand-back uses up one of the
+        redrive policy's receives, so the first one is reported as a misconfiguration.
+        """
+        self.results_handed_back += 1
+        if self.results_handed_back == 1:
+            logger.error("Received a result for another gateway node with no reply queue to forward it to; "
+                         "set SQS_REPLY_QUEUE_URL_TEMPLATE when several nodes share the output queue")
 
-    async def process_completed_task(self, message: dict) -> None:
+    async def process_completed_task(self, message: dict) -> bool:
         """
         Processes a single completed analysis task message:
           1) Parses the JSON body.
-          2) Sends the result via WebSocket if websocket_id is provided and valid.
+          2) Forwards results owned by another gateway node to that node.
+          3) Sends the result via WebSocket if websocket_id is provided and valid.
+
+        Returns:
+            False if the message belongs to another node and there is no reply
+            queue to forward it to, so it must go back on the queue for its owner;
+            True otherwise.
+
+        Raises:
+            Exception: Processing or forwarding failed; the message is retried.
         """
-        logger.info(f"Processing completed task message: {message.get('MessageId')}")
+        logger.info("Processing completed task message: %s", message.get('MessageId'))
         try:
-            data = json.loads(message.get("Body", "{}"))
+            with RESULT_DECODE_SECONDS.time():
+                data = json.loads(message.get("Body", "{}"))
         except json.JSONDecodeError as e:
-            logger.error(f"Invalid JSON in message {message.get('MessageId')}: {e}")
-            return
+            logger.error("Invalid JSON in message %s: %s", message.get('MessageId'), e)
+            return True
+
+        if self.reply_router and not self.reply_router.is_local(data):
+            return await self.reply_router.forward(data, message)
 
-        await self.manage_processed_job(data)
+        await self.manage_processed_job(data, message)
+        return True
 
-    async def manage_processed_job(self, data: dict) -> None:
+    async def manage_processed_job(self, data: dict, message: dict = None) -> None:
         """
         Fetches the websocket connection (using websocket_id from data)
         and sends the processed job data back to that websocket.
+
+        Intermediate messages (see is_final) leave the job in flight; with a
+        PartialResultCoalescer they are merged into periodic frames per connection.
+        Only the final result frees the job's admission slot and closes its trace.
+
+        Args:
+            data: The decoded result.
+            message: The SQS message it came in, carrying the trace context.
         """
         websocket_id = data.get("websocket_id")
+        job_id = data.get("job_id")
+        final = self.is_final(data)
+        if job_id and self.cancellation_manager and self.cancellation_manager.is_cancelled(job_id):
+            logger.info("Dropping result of cancelled job %s", job_id)
+            if final:
+                self.finish_trace(message, data, "cancelled")
+            return
+        if final:
+            # Progress and partial updates would skew the expiry rate
+            self.results_received += 1
+        if final and self.lanes and isinstance(data.get("submitted_at"), (int, float)):
+            self.lanes.record_latency(data.get("lane"), time.time() - data["submitted_at"])
+        if self.is_expired(data):
+            if final:
+                self.results_expired += 1
+            if self.expired_result_policy == "drop":
+                logger.info("Dropping result of job %s: past its deadline", job_id)
+                if final:
+                    self.finish_job(job_id)
+                    self.finish_trace(message, data, "expired")
+                return
+            data["expired"] = True
+
+        if not final:
+            # Route by the job index, which follows the session across reconnects
+            session = self.session_manager.get_session_for_job(job_id) if job_id else None
+            websocket_id = session.websocket_id if session else websocket_id
+            if not websocket_id:
+                return
+            if self.partial_coalescer:
+                self.partial_coalescer.add(websocket_id, data)
+                return
+            # Superseded status and progress updates may be coalesced by a slow connection
+            message_type = data.get("message_type")
+            coalesce_key = (job_id, message_type) if message_type in ("status", "progress") else None
+            self.session_manager.send(websocket_id, json.dumps(data), coalesce_key=coalesce_key)
+            return
+
+        if self.topic_manager and data.get("asset"):
+            # The submitting session gets the result directly below
+            self.topic_manager.publish(data["asset"], data, exclude=websocket_id)
+        # Fall back to the job index for results that lost their websocket_id
+        websocket_id = self.finish_job(job_id) or websocket_id
         if not websocket_id:
             logger.warning("No 'websocket_id' found in the data; cannot send response.")
+            await self.keep_undeliverable(data, message)
             return
+        if self.partial_coalescer and self.partial_coalescer.finish_job(
+                websocket_id, job_id, lambda: self.send_held_result(websocket_id, data, message)):
+            # Sent right after the frame carrying the job's pending partial outputs
+            return
+        if not self.send_final_result(websocket_id, data, message):
+            # Unknown session: it expired, or it lived in a process that restarted
+            await self.keep_undeliverable(data, message)
+
+    def send_final_result(self, websocket_id, data: dict, message: dict = None) -> bool:
+        """
+        Queue a final result for its session.
+
+        Returns:
+            False if the session is unknown.
+        """
+        job_id = data.get("job_id")
+        streamed = False
+        if self.result_streamer and ResultStreamer.is_claim_check(data):
+            # The payload is in S3; the client gets the envelope, then the object in chunks
+            data = self.result_streamer.accept(data, websocket_id)
+            streamed = "result_stream" in data
+
+        # Queue the entire processed data for the connection's writer; never wait on
+        # the client here, so one slow connection cannot hold up other results. A
+        # disconnected session keeps the result for replay on resume.
+        if not self.session_manager.send(websocket_id, json.dumps(data), essential=True):
+            logger.warning("No session found for ID: %s", websocket_id)
+            return False
+        logger.info("Queued processed job details for WebSocket %s", websocket_id)
+        if streamed and data["result_stream"]["streaming"]:
+            self.result_streamer.start(websocket_id, job_id)
+        self.finish_trace(message, data, "delivered")
+        return True
 
-        ws_connection = self.session_manager.get_websocket(websocket_id)
-        if not ws_connection:
-            logger.warning(f"No active WebSocket connection found for ID: {websocket_id}")
+    def send_held_result(self, websocket_id, data: dict, message: dict = None) -> None:
+        """
+        Send a final result the PartialResultCoalescer held back. Its message is
+        already deleted, so a session that vanished meanwhile means it is lost.
+        """
+        if not self.send_final_result(websocket_id, data, message):
+            self.finish_trace(message, data, "undeliverable")
+
+    async def keep_undeliverable(self, data: dict, message: dict = None) -> None:
+        """
+        Keep a final result that has no session to go to in the job repository, so
+        the client finds it with job_history. It is dropped if there is no
+        repository or no record of the job; if saving fails, the exception
+        propagates and the message is retried.
+        """
+        job_id = data.get("job_id")
+        result = {key: value for key, value in data.items() if key not in ROUTING_FIELDS}
+        status = str(data.get("status") or "COMPLETED").upper()
+        if self.job_repository is not None and job_id \
+                and await asyncio.to_thread(self.job_repository.save_result, job_id, status, result):
+            logger.info("Kept undeliverable result of job %s for job_history", job_id)
+            self.finish_trace(message, data, "kept")
             return
+        logger.warning("Dropping undeliverable result of job %s", job_id)
+        self.finish_trace(message, data, "undeliverable")
 
+    def finish_trace(self, message, data: dict, outcome: str) -> None:
+        if self.tracer is None:
+            return
         try:
-            # Send the entire processed data to the client
-            await ws_connection.send(json.dumps(data))
-            logger.info(f"Sent processed job details to WebSocket {websocket_id}")
+            self.tracer.finish(message or {}, data, outcome)
         except Exception as e:
-            logger.exception(f"Failed to send data to WebSocket {websocket_id}: {e}")
+            logger.warning("Failed to finish trace of job %s: %s", data.get('job_id'), e)
+
+    def finish_job(self, job_id):
+        """
+        Release a job that got its final result.
+
+        Returns:
+            The websocket_id the job was bound to, or None.
+        """
+        if not job_id:
+            return None
+        if self.admission_controller:
+            self.admission_controller.release(job_id)
+        return self.session_manager.release_job(job_id)
+
+    @staticmethod
+    def is_final(data: dict) -> bool:
+        """
+        Results with message_type "progress" or "partial", and "status" updates
+        with a non-terminal status, are intermediate; everything else is final.
+        """
+        message_type = data.get("message_type")
+        if message_type in INTERMEDIATE_MESSAGE_TYPES:
+            return False
+        if message_type == "status":
+            return str(data.get("status", "")).upper() in TERMINAL_STATUSES
+        return True
+
+    @staticmethod
+    def is_expired(data: dict, now: float = None) -> bool:
+        """
+        A result is expired if it arrived after the job's "expires_at", or if the
+        analysis worker skipped the job because it was already past it.
+        """
+        if data.get("status") == "EXPIRED":
+            return True
+        expires_at = data.get("expires_at")
+        if not isinstance(expires_at, (int, float)):
+            return False
+        return (time.time() if now is None else now) > expires_at
+
+    def expiry_stats(self) -> dict:
+        """
+        How many final results arrived, and how many of them were past their deadline.
+        """
+        return {
+            "results": self.results_received,
+            "expired": self.results_expired,
+            "expiry_rate": round(self.results_expired / self.results_received, 4) if self.results_received else 0.0,
+            "policy": self.expired_result_policy,
+        }
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+
+from config import logger, OUTBOUND_STATS_TOP
+from utils.loop_monitor import LoopMonitor, SamplingProfiler, format_stack
+
+HELP = """Commands:
+  loop                          event loop lag and stall counts
+  connections [n]               outbound queue depth and send latency of the
+                                n connections with the deepest queues
+  stalls                        stacks captured during recent loop stalls
+  stacks                        current stack of every thread
+  profile [seconds] [hz] [all]  sample the event loop thread (or all threads)
+                                and write folded stacks for flamegraph.pl
+"""
+
+
+class AdminServer:
+    """
+    Local admin channel on a Unix socket, for inspecting a live process.
+
+    One command per line, answered in plain text, e.g.
+
+        echo "profile 10" | nc -U /tmp/alpha-gateway-<node id>.sock
+
+    The socket is created with mode 0600, so only the gateway's own user can use it.
+    """
+    def __init__(self, path, loop_monitor: LoopMonitor = None, profiler: SamplingProfiler = None,
+                 session_manager=None):
+        self.path = path
+        self.loop_monitor = loop_monitor
+        self.session_manager = session_manager
+        self.profiler = profiler or SamplingProfiler()
+        self.loop_thread_id = None
+
+    async def run(self) -> None:
+        self.loop_thread_id = threading.get_ident()
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # Left over from a previous run
+        server = await asyncio.start_unix_server(self.handle, path=self.path)
+        os.chmod(self.path, 0o600)
+        logger.info(f"Admin channel listening on {self.path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = await self.execute(line.decode("utf-8", "replace").split())
+                writer.write(reply.encode("utf-8") + (b"" if reply.endswith("\n") else b"\n"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def execute(self, args) -> str:
+        command = args[0] if args else "help"
+        if command == "loop" and self.loop_monitor:
+            return json.dumps(self.loop_monitor.stats())
+        if command == "stalls" and self.loop_monitor:
+            return "\n".join(
+                f"--- blocked for {stall['blocked_for']}s at {stall['at']:.3f}\n{stall['stack']}"
+                for stall in self.loop_monitor.stalls
+            ) or "No stalls recorded"
+        if command == "connections" and self.session_manager:
+            try:
+                top = int(args[1]) if len(args) > 1 else OUTBOUND_STATS_TOP
+            except ValueError:
+                return "Usage: connections [n]"
+            return json.dumps(self.session_manager.outbound_stats(top=top))
+        if command == "stacks":
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            return "\n".join(
+                f"--- thread {names.get(ident, ident)}\n{format_stack(frame)}"
+                for ident, frame in sys._current_frames().items()
+            )
+        if command == "profile":
+            try:
+                seconds = float(args[1]) if len(args) > 1 else 10.0
+                hz = int(args[2]) if len(args) > 2 else None
+            except ValueError:
+                return "Usage: profile [seconds] [hz] [all]"
+            thread_id = None if "all" in args[1:] else self.loop_thread_id
+            kwargs = {"hz": hz} if hz else {}
+            # Sampling happens on a worker thread while the loop keeps serving
+            result = await asyncio.to_thread(self.profiler.profile, seconds, thread_id=thread_id, **kwargs)
+            return json.dumps(result)
+        return HELP
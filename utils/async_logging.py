@@ -0,0 +1,164 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import time
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line. Fields passed with `extra=`
+    are included as top-level keys.
+    """
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Rate-limits high-volume records per call site (file and line).
+
+    Each call site may log `rate` records per second at `max_level` or below,
+    with bursts of up to `burst`. Beyond that, one record in `sample_every` is
+    kept (marked with sampled=<sample_every> so readers can re-weight counts) and
+    the rest are dropped. Warnings and errors are never dropped.
+    """
+    def __init__(self, rate=10.0, burst=50, sample_every=100, max_level=logging.INFO):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.sample_every = sample_every
+        self.max_level = max_level
+        self.buckets = {}  # {(pathname, lineno): [tokens, last refill, records over budget]}
+        self.dropped = 0
+        self.sampled = 0
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        key = (record.pathname, record.lineno)
+        now = record.created
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [self.burst, now, 0]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return True
+        bucket[0] = tokens
+        bucket[2] += 1
+        if bucket[2] % self.sample_every == 0:
+            record.sampled = self.sample_every
+            self.sampled += 1
+            return True
+        self.dropped += 1
+        return False
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a background QueueListener without formatting them.
+
+    Formatting (including %-style message arguments) happens on the listener's
+    thread, so callers should pass arguments rather than pre-formatted strings on
+    hot paths. When the queue is full, records are dropped instead of blocking
+    the caller.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.enqueued = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record  # Same process: the listener formats the original record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self) -> dict:
+        sampler = next((f for f in self.filters if isinstance(f, SamplingFilter)), None)
+        return {
+            "enqueued": self.enqueued,
+            "queue_full_dropped": self.dropped,
+            "sampled_out": sampler.dropped if sampler else 0,
+            "sampled_kept": sampler.sampled if sampler else 0,
+            "queued": self.queue.qsize(),
+        }
+
+
+def stop_listener(queue_handler) -> None:
+    """
+    Write out everything still queued and stop the writer thread. Safe to call
+    more than once.
+    """
+    listener = getattr(queue_handler, "listener", None)
+    queue_handler.listener = None
+    if listener is not None:
+        listener.stop()
+
+
+def configure_logging(level, handlers, structured=True, text_format=None, queue_size=10000,
+                      sample_rate=10.0, sample_burst=50, sample_every=100):
+    """
+    Route all logging through a bounded queue to `handlers`, which run on a
+    background thread.
+
+    Args:
+        level: Root logger level.
+        handlers: Output handlers (file, console); they get the JSON or text formatter.
+        structured: Emit JSON lines instead of `text_format`.
+        text_format: logging format string used when structured is False.
+        queue_size: Records buffered for the writer thread before new ones are dropped.
+        sample_rate: Records per second per call site at INFO and below before
+            sampling kicks in; 0 disables sampling.
+        sample_burst: Burst allowance per call site.
+        sample_every: Keep one in this many records over the rate.
+
+    Returns:
+        The AsyncQueueHandler installed on the root logger.
+    """
+    formatter = JsonFormatter() if structured else logging.Formatter(text_format)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    queue_handler = AsyncQueueHandler(queue.Queue(maxsize=queue_size))
+    if sample_rate > 0:
+        queue_handler.addFilter(SamplingFilter(sample_rate, sample_burst, sample_every))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        if isinstance(handler, AsyncQueueHandler):
+            stop_listener(handler)  # Reconfigured; retire the previous writer thread
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    queue_handler.listener = listener
+    atexit.register(stop_listener, queue_handler)  # Flush what is still queued on exit
+    return queue_handler
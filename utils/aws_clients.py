@@ -0,0 +1,96 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger("config")
+
+
+class AWSClientFactory:
+    """
+    Builds boto3 clients on first use and caches them per service and region.
+
+    Nothing is imported or created until a client is asked for, so importing
+    config costs no boto3 start-up. Clients are thread-safe once built and are
+    shared by every component of the process. prewarm() builds them and opens
+    their connection pools ahead of the first request.
+    """
+    def __init__(self, access_key_id=None, secret_access_key=None, region="us-east-1",
+                 max_pool_connections=50, connect_timeout=5, read_timeout=30):
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.region = region
+        self.max_pool_connections = max_pool_connections
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.clients = {}  # {(service, region): client}
+        self.lock = threading.Lock()  # boto3 sessions are not safe to share while creating clients
+        self.session = None
+
+    def client(self, service: str, region: str = None):
+        region = region or self.region
+        client = self.clients.get((service, region))
+        if client is not None:
+            return client
+        with self.lock:
+            client = self.clients.get((service, region))
+            if client is None:
+                client = self.clients[(service, region)] = self._create(service, region)
+        return client
+
+    def sqs(self, region: str = None):
+        return self.client("sqs", region)
+
+    def s3(self, region: str = None):
+        return self.client("s3", region)
+
+    def _create(self, service, region):
+        import boto3
+        from botocore.config import Config
+
+        started = time.perf_counter()
+        if self.session is None:
+            self.session = boto3.session.Session(
+                aws_access_key_id=self.access_key_id,
+                aws_secret_access_key=self.secret_access_key,
+            )
+        client = self.session.client(
+            service,
+            region_name=region,
+            config=Config(
+                max_pool_connections=self.max_pool_connections,
+                connect_timeout=self.connect_timeout,
+                read_timeout=self.read_timeout,
+            ),
+        )
+        logger.info(f"Created {service} client for region {region} in {time.perf_counter() - started:.3f}s")
+        return client
+
+    def prewarm(self, queue_urls=(), bucket=None) -> None:
+        """
+        Build the SQS and S3 clients and open a connection to each endpoint, so
+        the first upload and the first poll do not pay for client construction
+        or the TLS handshake. Failures are logged, never raised; the clients retry
+        on use.
+
+        Args:
+            queue_urls: Queues to touch (one cheap GetQueueAttributes each).
+            bucket: Bucket to touch with HeadBucket.
+        """
+        started = time.perf_counter()
+        try:
+            sqs = self.sqs()
+            s3 = self.s3()
+        except Exception as e:
+            logger.warning(f"Could not pre-warm AWS clients: {e}")
+            return
+        for queue_url in dict.fromkeys(url for url in queue_urls if url):
+            try:
+                sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=["QueueArn"])
+            except Exception as e:
+                logger.warning(f"Could not pre-warm SQS connection to {queue_url}: {e}")
+        if bucket:
+            try:
+                s3.head_bucket(Bucket=bucket)
+            except Exception as e:
+                logger.warning(f"Could not pre-warm S3 connection to {bucket}: {e}")
+        logger.info(f"AWS clients pre-warmed in {time.perf_counter() - started:.3f}s")
@@ -0,0 +1,153 @@
+import time
+from collections import deque
+from config import (
+    logger,
+    BREAKER_FAILURE_RATE,
+    BREAKER_SLOW_CALL_SECONDS,
+    BREAKER_WINDOW,
+    BREAKER_MIN_CALLS,
+    BREAKER_OPEN_SECONDS,
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a dependency whose circuit breaker is open.
+    """
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit '{name}' is open; retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Tracks the error rate and latency of calls to one dependency (S3, SQS, DB).
+
+    Calls that fail or take longer than `slow_call_seconds` count as bad. When the
+    share of bad calls among the last `window` calls reaches `failure_rate`, the
+    breaker opens and calls are rejected immediately for `open_seconds`. After
+    that a single probe call is let through (half-open): success closes the
+    breaker, failure opens it again.
+    """
+    def __init__(self, name, failure_rate=BREAKER_FAILURE_RATE, slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+                 window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS, open_seconds=BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.failure_rate_threshold = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.outcomes = deque(maxlen=window)  # True for a bad (failed or slow) call
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.calls = 0
+        self.failures = 0
+        self.slow_calls = 0
+        self.rejections = 0
+        self.last_latency = 0.0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return CLOSED
+        if time.monotonic() - self.opened_at >= self.open_seconds:
+            return HALF_OPEN
+        return OPEN
+
+    @property
+    def failure_rate(self):
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.open_seconds - (time.monotonic() - self.opened_at))
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError unless a call may go through now.
+        """
+        state = self.state
+        if state == OPEN or (state == HALF_OPEN and self.probe_in_flight):
+            self.rejections += 1
+            raise CircuitOpenError(self.name, self.retry_after() or self.open_seconds)
+        if state == HALF_OPEN:
+            self.probe_in_flight = True
+
+    def record(self, success, duration):
+        """
+        Record the outcome of a call and open or close the breaker accordingly.
+        """
+        slow = duration >= self.slow_call_seconds
+        bad = not success or slow
+        self.calls += 1
+        self.failures += not success
+        self.slow_calls += slow
+        self.last_latency = duration
+
+        if self.probe_in_flight:
+            self.probe_in_flight = False
+            if bad:
+                self.opened_at = time.monotonic()
+                logger.warning(f"Circuit '{self.name}' probe failed; staying open")
+            else:
+                self.opened_at = None
+                self.outcomes.clear()
+                logger.warning(f"Circuit '{self.name}' closed")
+            return
+
+        self.outcomes.append(bad)
+        if self.opened_at is None and len(self.outcomes) >= self.min_calls \
+                and self.failure_rate >= self.failure_rate_threshold:
+            self.opened_at = time.monotonic()
+            logger.warning(f"Circuit '{self.name}' opened: {self.failure_rate:.0%} of the last "
+                           f"{len(self.outcomes)} calls failed or were slow")
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Call a blocking function through the breaker.
+        """
+        self.before_call()
+        started = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record(False, time.monotonic() - started)
+            raise
+        except BaseException:
+            self.probe_in_flight = False  # Cancelled; let another call probe
+            raise
+        self.record(True, time.monotonic() - started)
+        return result
+
+    async def call_async(self, fn, *args, **kwargs):
+        """
+        Await a coroutine function through the breaker.
+        """
+        self.before_call()
+        started = time.monotonic()
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception:
+            self.record(False, time.monotonic() - started)
+            raise
+        except BaseException:
+            self.probe_in_flight = False  # Cancelled; let another call probe
+            raise
+        self.record(True, time.monotonic() - started)
+        return result
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "failure_rate": round(self.failure_rate, 3),
+            "calls": self.calls,
+            "failures": self.failures,
+            "slow_calls": self.slow_calls,
+            "rejections": self.rejections,
+            "last_latency_ms": round(self.last_latency * 1000, 3),
+        }
@@ -0,0 +1,54 @@
+import io
+import threading
+
+from config import logger
+
+
+class LocalS3Client:
+    """
+    In-memory stand-in for the subset of the boto3 S3 client used by the gateway.
+
+    Objects are kept in a dict keyed by (bucket, key), so uploads in local runs
+    and load tests cost a file read and nothing else.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._objects = {}  # {(bucket, key): bytes}
+        logger.info("LocalS3Client initialized")
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        with open(Filename, "rb") as f:
+            self.put_object(Bucket=Bucket, Key=Key, Body=f.read())
+
+    def put_object(self, Bucket, Key, Body=b"", **kwargs):
+        data = Body.read() if hasattr(Body, "read") else Body
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self._lock:
+            self._objects[(Bucket, Key)] = bytes(data)
+        return {}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        with self._lock:
+            data = self._objects.get((Bucket, Key))
+        if data is None:
+            raise KeyError(f"No such key: {Bucket}/{Key}")
+        return {"ContentLength": len(data)}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        """
+        Return the object, or the byte range "bytes=start-end" of it.
+        """
+        with self._lock:
+            data = self._objects.get((Bucket, Key))
+        if data is None:
+            raise KeyError(f"No such key: {Bucket}/{Key}")
+        if Range:
+            start, _, end = Range.removeprefix("bytes=").partition("-")
+            data = data[int(start):int(end) + 1 if end else None]
+        return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        with self._lock:
+            self._objects.pop((Bucket, Key), None)
+        return {}
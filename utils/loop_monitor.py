@@ -0,0 +1,196 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+
+from config import (
+    logger,
+    LOOP_MONITOR_INTERVAL,
+    LOOP_STALL_THRESHOLD,
+    LOOP_STALL_LOG_INTERVAL,
+    PROFILE_OUTPUT_DIR,
+    PROFILE_MAX_SECONDS,
+    PROFILE_DEFAULT_HZ,
+)
+from utils.metrics import REGISTRY
+
+LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "gateway_event_loop_lag_seconds",
+    "How late the event loop ran a timer callback, in seconds.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+).labels()
+LOOP_STALLS_TOTAL = REGISTRY.counter(
+    "gateway_event_loop_stalls_total", "Times the event loop was blocked for longer than the stall threshold."
+).labels()
+
+
+def format_stack(frame, limit=None) -> str:
+    return "".join(traceback.format_stack(frame, limit=limit))
+
+
+_frame_names = {}  # {code object: "function (file:line)"}
+
+
+def _frame_name(code) -> str:
+    name = _frame_names.get(code)
+    if name is None:
+        path = os.path.relpath(code.co_filename)
+        if path.startswith(".."):
+            path = os.path.basename(code.co_filename)  # Standard library and site-packages
+        name = _frame_names[code] = f"{code.co_name} ({path}:{code.co_firstlineno})"
+    return name
+
+
+def folded_frames(frame) -> str:
+    """
+    A stack as "outer;...;inner" function names, the line format of folded
+    stacks read by flamegraph.pl, speedscope and similar tools.
+    """
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class LoopMonitor:
+    """
+    Measures event loop scheduling lag and catches the code that blocks it.
+
+    A task on the loop sleeps for `interval` and records how much later than
+    that it woke up. A watchdog thread checks that task's heartbeat; when the
+    loop has not run for `stall_threshold` seconds, it captures the loop thread's
+    current stack (the blocking call) and logs it. The cost is one timer per
+    interval on the loop and a mostly sleeping thread, so it stays enabled in
+    production.
+    """
+    def __init__(self, interval=LOOP_MONITOR_INTERVAL, stall_threshold=LOOP_STALL_THRESHOLD,
+                 stall_log_interval=LOOP_STALL_LOG_INTERVAL, max_stalls=20):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.stall_log_interval = stall_log_interval
+        self.loop_thread_id = None
+        self.heartbeat = time.monotonic()
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.stalls = deque(maxlen=max_stalls)  # Recent stalls, newest last
+        self.stall_count = 0
+        self.last_stall_logged = 0.0
+        self.watchdog = None
+        logger.info(f"LoopMonitor initialized (stall threshold {stall_threshold}s)")
+
+    async def run(self) -> None:
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.watchdog.start()
+        try:
+            while True:
+                expected = time.monotonic() + self.interval
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                if self.stalls and self.stalls[-1]["heartbeat"] == self.heartbeat:
+                    # The loop is back; record how long the captured stall lasted in total
+                    self.stalls[-1]["blocked_for"] = round(now - self.heartbeat, 3)
+                self.heartbeat = now
+                lag = max(0.0, now - expected)
+                self.last_lag = lag
+                self.max_lag = max(self.max_lag, lag)
+                LOOP_LAG_SECONDS.observe(lag)
+        finally:
+            self.loop_thread_id = None  # Stopped (e.g. at shutdown); the watchdog exits
+
+    def _watch(self) -> None:
+        """
+        Watchdog thread: capture the loop thread's stack once per stall.
+        """
+        captured_for = None  # Heartbeat of the stall already captured
+        while self.loop_thread_id is not None:
+            time.sleep(self.interval / 2)
+            heartbeat = self.heartbeat
+            blocked_for = time.monotonic() - heartbeat
+            if blocked_for < self.stall_threshold or heartbeat == captured_for:
+                continue
+            captured_for = heartbeat
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            self.record_stall(heartbeat, blocked_for, format_stack(frame))
+
+    def record_stall(self, heartbeat: float, blocked_for: float, stack: str) -> None:
+        self.stall_count += 1
+        LOOP_STALLS_TOTAL.inc()
+        self.stalls.append({"heartbeat": heartbeat, "at": time.time(), "blocked_for": round(blocked_for, 3),
+                            "stack": stack})
+        now = time.monotonic()
+        if now - self.last_stall_logged >= self.stall_log_interval:
+            self.last_stall_logged = now
+            logger.warning(f"Event loop blocked for {blocked_for:.3f}s (still running) in:\n{stack}")
+
+    def stats(self) -> dict:
+        return {
+            "interval": self.interval,
+            "last_lag": round(self.last_lag, 6),
+            "max_lag": round(self.max_lag, 6),
+            "stalls": self.stall_count,
+            "stall_threshold": self.stall_threshold,
+        }
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler: samples thread stacks from a separate thread at `hz`
+    and counts identical stacks. Nothing runs while it is idle, and the profiled
+    code is not instrumented, so it is safe to trigger on a live process.
+    """
+    def __init__(self, output_dir=PROFILE_OUTPUT_DIR, max_seconds=PROFILE_MAX_SECONDS):
+        self.output_dir = output_dir
+        self.max_seconds = max_seconds
+        self.lock = threading.Lock()  # One profile at a time
+
+    def sample(self, seconds, hz=PROFILE_DEFAULT_HZ, thread_id=None) -> Counter:
+        """
+        Sample for `seconds` and return {folded stack: samples}. Samples the given
+        thread, or every thread except the profiler's own.
+        """
+        seconds = min(seconds, self.max_seconds)
+        period = 1.0 / max(1, hz)
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own_id or (thread_id is not None and ident != thread_id):
+                    continue
+                prefix = names.get(ident, str(ident)) if thread_id is None else None
+                stack = folded_frames(frame)
+                stacks[f"{prefix};{stack}" if prefix else stack] += 1
+            time.sleep(period)
+        return stacks
+
+    def profile(self, seconds, hz=PROFILE_DEFAULT_HZ, thread_id=None, path=None) -> dict:
+        """
+        Sample and write the folded stacks to a file ready for flamegraph.pl.
+
+        Returns:
+            {"path": ..., "samples": ..., "stacks": ...}, or an "error" if a
+            profile is already running.
+        """
+        if not self.lock.acquire(blocking=False):
+            return {"error": "A profile is already running"}
+        try:
+            stacks = self.sample(seconds, hz, thread_id)
+            if path is None:
+                os.makedirs(self.output_dir, exist_ok=True)
+                path = os.path.join(self.output_dir, f"profile-{os.getpid()}-{int(time.time())}.folded")
+            with open(path, "w") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            logger.info(f"Wrote profile of {sum(stacks.values())} samples to {path}")
+            return {"path": os.path.abspath(path), "samples": sum(stacks.values()), "stacks": len(stacks)}
+        finally:
+            self.lock.release()
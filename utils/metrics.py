@@ -0,0 +1,365 @@
+import asyncio
+import math
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from config import logger
+
+# Upper bounds (seconds) of the default latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(ABC):
+    """
+    Base of all metric types: a name, help text, label names and one child per
+    combination of label values.
+    """
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=(), fn=None):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.fn = fn  # Callback returning the value, or {label values tuple: value}
+        self.children = {}
+
+    def labels(self, *values):
+        """
+        Return the child for these label values. Bind it once (e.g. at module level)
+        and reuse it on hot paths.
+        """
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """
+        Create the value holder for one combination of label values.
+        """
+
+    def _samples(self):
+        """
+        Yield (suffix, label values, extra label, value) tuples.
+        """
+        if self.fn is not None:
+            value = self.fn()
+            items = value.items() if isinstance(value, dict) else [((), value)]
+            for label_values, sample in items:
+                if not isinstance(label_values, tuple):
+                    label_values = (label_values,)
+                yield "", label_values, None, sample
+            return
+        for label_values, child in self.children.items():
+            yield "", label_values, None, child.value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            for suffix, label_values, extra, value in self._samples():
+                labels = _format_labels(self.label_names, label_values, extra)
+                lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        except Exception as e:
+            logger.warning(f"Failed to collect metric {self.name}: {e}")
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    """
+    A monotonically increasing count.
+    """
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down, set directly or read from a callback at scrape time.
+    """
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("child", "started")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values (latencies in seconds) over fixed buckets.
+    An observation is a binary search and three additions.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _samples(self):
+        for label_values, child in self.children.items():
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), child.counts):
+                cumulative += count
+                yield "_bucket", label_values, ("le", _format_value(bound)), cumulative
+            yield "_sum", label_values, None, child.sum
+            yield "_count", label_values, None, child.count
+
+
+class MetricsRegistry:
+    """
+    Holds metrics and renders them in the Prometheus text exposition format.
+    """
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric):
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            if metric.fn is not None:
+                existing.fn = metric.fn  # Re-wiring a callback (e.g. a new server instance)
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=(), fn=None):
+        return self._register(Counter(name, help_text, labels, fn))
+
+    def gauge(self, name, help_text, labels=(), fn=None):
+        return self._register(Gauge(name, help_text, labels, fn))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Time spent in each stage of the request and result pipelines
+STAGE_SECONDS = REGISTRY.histogram(
+    "gateway_stage_seconds",
+    "Latency of gateway pipeline stages in seconds.",
+    labels=("stage",),
+)
+
+
+BREAKER_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def register_gateway_metrics(registry=REGISTRY, session_manager=None, admission_controller=None,
+                             load_shedder=None, response_worker=None, lanes=None, topic_manager=None,
+                             partial_coalescer=None, log_handler=None, drain_manager=None,
+                             queue_consumer=None, result_streamer=None):
+    """
+    Expose the state of the gateway's components as metrics read at scrape time.
+    Components that are None are skipped.
+    """
+    if session_manager is not None:
+        registry.gauge("gateway_active_connections", "Open WebSocket connections with a session.",
+                       fn=lambda: len(session_manager.sessions_by_connection))
+        registry.gauge("gateway_sessions", "Sessions by state.", labels=("state",),
+                       fn=lambda: {"attached": len(session_manager.sessions) - len(session_manager.detached),
+                                   "detached": len(session_manager.detached)})
+        registry.gauge("gateway_jobs_bound", "In-flight jobs bound to a session.",
+                       fn=lambda: len(session_manager.sessions_by_job))
+        registry.gauge("gateway_outbound_queued_frames", "Frames waiting in outbound queues.",
+                       fn=lambda: sum(len(s.outbound.frames) for s in session_manager.sessions.values()
+                                      if s.outbound is not None))
+        # Only the connections with the deepest queues, to bound label cardinality
+        registry.gauge("gateway_outbound_queue_depth", "Frames waiting in the deepest outbound queues.",
+                       labels=("connection",),
+                       fn=lambda: {stats["websocket_id"]: stats["depth"]
+                                   for stats in session_manager.outbound_stats()})
+        registry.gauge("gateway_outbound_send_seconds_max", "Slowest send on the connections with the "
+                       "deepest outbound queues.", labels=("connection",),
+                       fn=lambda: {stats["websocket_id"]: stats["max_send_ms"] / 1000
+                                   for stats in session_manager.outbound_stats()})
+    if admission_controller is not None:
+        registry.gauge("gateway_inflight_jobs", "Jobs holding an admission slot.",
+                       fn=lambda: len(admission_controller.inflight))
+        registry.gauge("gateway_inflight_jobs_limit", "Global limit on jobs holding an admission slot.",
+                       fn=lambda: admission_controller.max_global)
+        registry.counter("gateway_admission_total", "Admission decisions by outcome.", labels=("outcome",),
+                         fn=lambda: {"admitted": admission_controller.admitted,
+                                     "rejected": admission_controller.rejected})
+    if load_shedder is not None:
+        registry.gauge("gateway_pipeline_utilization", "Share of upload pipeline slots in use.",
+                       fn=lambda: load_shedder.inflight / load_shedder.max_inflight if load_shedder.max_inflight else 0)
+        registry.counter("gateway_shed_total", "Uploads rejected by load shedding.", fn=lambda: load_shedder.shed)
+        registry.gauge("gateway_breaker_state", "Circuit breaker state (0 closed, 1 half-open, 2 open).",
+                       labels=("dependency",),
+                       fn=lambda: {name: BREAKER_STATE_VALUES[b.state] for name, b in load_shedder.breakers.items()})
+        registry.gauge("gateway_breaker_failure_rate", "Share of recent calls that failed or were slow.",
+                       labels=("dependency",),
+                       fn=lambda: {name: b.failure_rate for name, b in load_shedder.breakers.items()})
+        registry.counter("gateway_breaker_rejections_total", "Calls rejected by an open breaker.",
+                         labels=("dependency",),
+                         fn=lambda: {name: b.rejections for name, b in load_shedder.breakers.items()})
+    if response_worker is not None:
+        registry.counter("gateway_results_total", "Final results received from the analysis workers.",
+                         fn=lambda: response_worker.results_received)
+        registry.counter("gateway_results_expired_total", "Final results that arrived past their deadline.",
+                         fn=lambda: response_worker.results_expired)
+        registry.counter("gateway_results_handed_back_total",
+                         "Results for another node handed back to the shared queue, not forwarded.",
+                         fn=lambda: response_worker.results_handed_back)
+    if lanes is not None:
+        registry.gauge("gateway_lane_queue_depth", "Messages waiting on each priority lane's input queue.",
+                       labels=("lane",),
+                       fn=lambda: {lane: sum(depths.values()) for lane, depths in lanes.depths.items()})
+    if topic_manager is not None:
+        registry.gauge("gateway_topic_subscriptions", "Asset topic subscriptions.",
+                       fn=lambda: sum(len(subscribers) for subscribers in topic_manager.subscribers.values()))
+    if partial_coalescer is not None:
+        registry.counter("gateway_partial_frames_total", "Coalesced partial-result frames sent.",
+                         fn=lambda: partial_coalescer.frames)
+    if log_handler is not None:
+        registry.counter("gateway_log_records_total", "Log records by what happened to them.", labels=("outcome",),
+                         fn=lambda: {outcome: count for outcome, count in log_handler.stats().items()
+                                     if outcome != "queued"})
+        registry.gauge("gateway_log_queue_depth", "Log records waiting for the writer thread.",
+                       fn=lambda: log_handler.queue.qsize())
+    if queue_consumer is not None:
+        registry.gauge("gateway_consumer_messages", "Result messages held invisible by the consumer.",
+                       labels=("state",),
+                       fn=lambda: {state: count for state, count in queue_consumer.stats().items()
+                                   if state in ("buffered", "processing")})
+        registry.counter("gateway_consumer_retries_total", "Result messages released for a retry with backoff.",
+                         fn=lambda: queue_consumer.retries)
+    if result_streamer is not None:
+        registry.gauge("gateway_result_streams", "Claim-check results being streamed.",
+                       fn=lambda: len(result_streamer.streams))
+        registry.counter("gateway_result_streams_total", "Claim-check result streams by outcome.",
+                         labels=("outcome",),
+                         fn=lambda: {"completed": result_streamer.completed,
+                                     "interrupted": result_streamer.interrupted,
+                                     "refused": result_streamer.refused})
+        registry.counter("gateway_result_stream_bytes_total", "Bytes of claim-check results sent.",
+                         fn=lambda: result_streamer.bytes_sent)
+    if drain_manager is not None:
+        registry.gauge("gateway_draining", "1 while the process is draining for a restart.",
+                       fn=lambda: int(drain_manager.draining))
+
+
+class MetricsServer:
+    """
+    Minimal HTTP server exposing a registry at GET /metrics for Prometheus.
+    """
+    def __init__(self, registry=REGISTRY, host="0.0.0.0", port=9090):
+        self.registry = registry
+        self.host = host
+        self.port = port
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass  # Headers are not needed
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, content_type = "200 OK", "text/plain; version=0.0.4; charset=utf-8"
+                body = self.registry.render().encode("utf-8")
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", b"Not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def run(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        logger.info(f"Metrics endpoint running on http://{self.host}:{self.port}/metrics")
+        async with server:
+            await server.serve_forever()
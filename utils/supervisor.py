@@ -0,0 +1,84 @@
+import multiprocessing
+import signal
+import socket
+import time
+from config import logger, DRAIN_PIPELINE_TIMEOUT, DRAIN_GRACE_PERIOD, DRAIN_FLUSH_TIMEOUT
+
+
+class Supervisor:
+    """
+    Runs N copies of a worker entry point in separate processes and restarts any
+    that crash.
+
+    Workers share the listening port through SO_REUSEPORT, so the kernel spreads
+    incoming connections across them. Each worker is started as target(index);
+    the index gives it a stable identity (e.g. its node id for reply routing)
+    that survives restarts.
+    """
+    def __init__(self, target, worker_count, restart_delay=1.0, max_restart_delay=30.0,
+                 stop_timeout=DRAIN_PIPELINE_TIMEOUT * 2 + DRAIN_GRACE_PERIOD + DRAIN_FLUSH_TIMEOUT + 5):
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise RuntimeError("SO_REUSEPORT is not supported on this platform; run a single worker instead.")
+        self.target = target
+        self.worker_count = worker_count
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stop_timeout = stop_timeout  # Time workers get to drain before they are killed
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = {}          # {index: Process}
+        self.restart_delays = {}   # {index: seconds to wait before the next restart}
+        self.restart_at = {}       # {index: monotonic time of the pending restart}
+        self.started_at = {}       # {index: monotonic time the worker was last started}
+        self.stopping = False
+
+    def start_worker(self, index):
+        process = self.context.Process(target=self.target, args=(index,), name=f"gateway-worker-{index}")
+        process.start()
+        self.workers[index] = process
+        self.started_at[index] = time.monotonic()
+        logger.info(f"Started worker {index} (pid {process.pid})")
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def run(self):
+        """
+        Start all workers and supervise them until SIGINT or SIGTERM.
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.worker_count):
+            self.start_worker(index)
+
+        while not self.stopping:
+            now = time.monotonic()
+            for index, process in list(self.workers.items()):
+                if index in self.restart_at:
+                    continue
+                if process.is_alive():
+                    # A worker that stayed up for a while is healthy again; reset its backoff
+                    if now - self.started_at[index] > self.max_restart_delay:
+                        self.restart_delays.pop(index, None)
+                    continue
+                # Back off on crash loops
+                delay = self.restart_delays.get(index, self.restart_delay)
+                logger.error(f"Worker {index} (pid {process.pid}) exited with code {process.exitcode}; "
+                             f"restarting in {delay:.1f}s")
+                self.restart_at[index] = now + delay
+                self.restart_delays[index] = min(delay * 2, self.max_restart_delay)
+            for index, restart_at in list(self.restart_at.items()):
+                if restart_at <= now:
+                    del self.restart_at[index]
+                    self.start_worker(index)
+            time.sleep(0.5)
+
+        logger.info("Supervisor stopping; terminating workers")
+        for process in self.workers.values():
+            if process.is_alive():
+                process.terminate()
+        # Workers drain in parallel; give them all the same deadline
+        deadline = time.monotonic() + self.stop_timeout
+        for process in self.workers.values():
+            process.join(timeout=max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
@@ -0,0 +1,356 @@
+import json
+import queue
+import random
+import threading
+import time
+import urllib.request
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import nullcontext
+
+from config import (
+    logger,
+    TRACE_SAMPLE_RATE,
+    TRACE_EXPORT_PATH,
+    TRACE_COLLECTOR_URL,
+    MAX_PENDING_TRACES,
+)
+from utils.metrics import STAGE_SECONDS
+
+# SQS message attributes carrying the trace context. Analysis workers copy
+# "traceparent" from the job message onto its result messages and add the job
+# message's SentTimestamp and ApproximateFirstReceiveTimestamp (see echo_attributes).
+TRACEPARENT_ATTRIBUTE = "traceparent"
+INPUT_SENT_ATTRIBUTE = "trace_input_sent_at"          # Epoch milliseconds
+INPUT_RECEIVED_ATTRIBUTE = "trace_input_received_at"  # Epoch milliseconds
+OUTPUT_SENT_ATTRIBUTE = "trace_output_sent_at"        # Set when a result is forwarded between nodes
+
+INPUT_QUEUE_SECONDS = STAGE_SECONDS.labels("input_queue_dwell")
+WORKER_SECONDS = STAGE_SECONDS.labels("worker")
+OUTPUT_QUEUE_SECONDS = STAGE_SECONDS.labels("output_queue_dwell")
+
+_NO_SPAN = nullcontext()
+
+
+def _string_attribute(value):
+    return {"DataType": "String", "StringValue": str(value)}
+
+
+def _number_attribute(value):
+    return {"DataType": "Number", "StringValue": str(value)}
+
+
+def message_attribute(message: dict, name: str):
+    """
+    String value of an SQS message attribute, or None.
+    """
+    attribute = (message.get("MessageAttributes") or {}).get(name)
+    return attribute.get("StringValue") if attribute else None
+
+
+def parse_traceparent(value):
+    """
+    Split a W3C traceparent ("00-<trace id>-<span id>-<flags>") into
+    (trace_id, span_id), or return None if it is malformed.
+    """
+    parts = (value or "").split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+
+def echo_attributes(message: dict) -> dict:
+    """
+    Message attributes an analysis worker should send with the results of the job
+    in `message`: its trace context plus the job message's queue timestamps.
+    """
+    traceparent = message_attribute(message, TRACEPARENT_ATTRIBUTE)
+    if not traceparent:
+        return {}
+    attributes = {TRACEPARENT_ATTRIBUTE: _string_attribute(traceparent)}
+    sqs_attributes = message.get("Attributes") or {}
+    if sqs_attributes.get("SentTimestamp"):
+        attributes[INPUT_SENT_ATTRIBUTE] = _number_attribute(sqs_attributes["SentTimestamp"])
+    if sqs_attributes.get("ApproximateFirstReceiveTimestamp"):
+        attributes[INPUT_RECEIVED_ATTRIBUTE] = _number_attribute(sqs_attributes["ApproximateFirstReceiveTimestamp"])
+    return attributes
+
+
+def span(trace, name):
+    """
+    Context manager timing `name` in the trace, or doing nothing if trace is None.
+    """
+    return trace.span(name) if trace is not None else _NO_SPAN
+
+
+class _Span:
+    __slots__ = ("trace", "name", "started")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add_span(self.name, self.started, time.perf_counter() - self.started)
+
+
+class Trace:
+    """
+    Timings of one job. Gateway spans are measured with perf_counter relative to
+    the trace start; hops outside the gateway come from epoch timestamps.
+    """
+    __slots__ = ("trace_id", "span_id", "job_id", "started_at", "origin", "spans")
+
+    def __init__(self, job_id, trace_id=None, started=None):
+        """
+        Args:
+            job_id: The traced job.
+            trace_id: Continue an existing trace instead of starting a new one.
+            started: perf_counter() value at which the trace began (default: now).
+        """
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.job_id = job_id
+        now = time.perf_counter()
+        self.origin = now if started is None else started
+        self.started_at = time.time() - (now - self.origin)
+        self.spans = []  # [(name, start offset in seconds, duration in seconds)]
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def add_span(self, name, started, duration):
+        """
+        Record a span that started at perf_counter() value `started`.
+        """
+        self.spans.append((name, started - self.origin, duration))
+
+    def add_wall_span(self, name, start, end):
+        """
+        Record a span between two epoch timestamps in seconds.
+        """
+        self.spans.append((name, start - self.started_at, end - start))
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def message_attributes(self) -> dict:
+        return {TRACEPARENT_ATTRIBUTE: _string_attribute(self.traceparent)}
+
+
+class TraceExporter(ABC):
+    """
+    Writes finished traces from a background thread, so exporting never blocks
+    the event loop. Traces are dropped (and counted) when the buffer is full.
+    """
+    def __init__(self, max_buffer=10000, batch_size=100):
+        self.buffer = queue.Queue(maxsize=max_buffer)
+        self.batch_size = batch_size
+        self.exported = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self.thread.start()
+
+    def export(self, record: dict) -> None:
+        try:
+            self.buffer.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self.buffer.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.buffer.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write_batch(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                logger.warning(f"Failed to export {len(batch)} traces: {e}")
+
+    @abstractmethod
+    def write_batch(self, records):
+        """
+        Write a list of trace records; runs on the exporter's thread.
+        """
+
+
+class FileTraceExporter(TraceExporter):
+    """
+    Appends traces to a file, one JSON object per line.
+    """
+    def __init__(self, path=TRACE_EXPORT_PATH, **kwargs):
+        self.path = path
+        super().__init__(**kwargs)
+        logger.info(f"Exporting traces to {path}")
+
+    def write_batch(self, records):
+        lines = "".join(json.dumps(record) + "\n" for record in records)
+        with open(self.path, "a") as f:
+            f.write(lines)
+
+
+class HttpTraceExporter(TraceExporter):
+    """
+    POSTs batches of traces as a JSON array to a collector.
+    """
+    def __init__(self, url=TRACE_COLLECTOR_URL, timeout=5, **kwargs):
+        self.url = url
+        self.timeout = timeout
+        super().__init__(**kwargs)
+        logger.info(f"Exporting traces to {url}")
+
+    def write_batch(self, records):
+        request = urllib.request.Request(self.url, data=json.dumps(records).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+class Tracer:
+    """
+    Starts traces for uploaded jobs and closes them when their final result
+    reaches the client.
+
+    The gateway's own spans (frame parsing, S3 upload, DB insert, SQS publish)
+    are kept in memory until the result arrives. The hops in between are derived
+    from SQS timestamps: input queue dwell from the job message's SentTimestamp
+    to its ApproximateFirstReceiveTimestamp (echoed back by the worker), worker
+    time from there to the result message's SentTimestamp, and output queue
+    dwell from there to the result's ApproximateFirstReceiveTimestamp. SQS
+    timestamps come from AWS's clock, so hop boundaries are only as accurate as
+    the gateway's clock sync.
+    """
+    def __init__(self, exporter: TraceExporter = None, sample_rate=TRACE_SAMPLE_RATE,
+                 max_pending=MAX_PENDING_TRACES):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.max_pending = max_pending
+        self.pending = OrderedDict()  # {job_id: Trace}, oldest first
+        self.finished = 0
+        self.evicted = 0
+        logger.info(f"Tracer initialized (sample rate {sample_rate})")
+
+    @classmethod
+    def from_config(cls):
+        exporter = HttpTraceExporter() if TRACE_COLLECTOR_URL else FileTraceExporter()
+        return cls(exporter)
+
+    def start(self, job_id, started=None):
+        """
+        Start tracing a job, or return None if it is not sampled.
+
+        Args:
+            job_id: The job to trace.
+            started: Optional perf_counter() value at which work on the job began.
+        """
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None
+        trace = Trace(job_id, started=started)
+        self.pending[job_id] = trace
+        while len(self.pending) > self.max_pending:
+            self.pending.popitem(last=False)  # Results that never came back
+            self.evicted += 1
+        return trace
+
+    def discard(self, trace) -> None:
+        """
+        Forget a trace whose job was never published.
+        """
+        if trace is not None:
+            self.pending.pop(trace.job_id, None)
+
+    def finish(self, message: dict, data: dict, outcome: str):
+        """
+        Close the trace of a job whose final result was handled.
+
+        Args:
+            message: The SQS result message, for its attributes and timestamps.
+            data: The decoded result.
+            outcome: What happened to the result ("delivered", "expired", ...).
+
+        Returns:
+            The exported trace record, or None if the job was not traced.
+        """
+        job_id = data.get("job_id")
+        trace = self.pending.pop(job_id, None)
+        context = parse_traceparent(message_attribute(message, TRACEPARENT_ATTRIBUTE))
+        if trace is None:
+            if context is None:
+                return None
+            # Traced by another process (e.g. before a restart); only the hops are known
+            trace = Trace(job_id, trace_id=context[0])
+            trace.started_at = self._timestamp(message_attribute(message, INPUT_SENT_ATTRIBUTE)) or time.time()
+        now = time.time()
+        self.add_hops(trace, message, now)
+
+        record = {
+            "trace_id": trace.trace_id,
+            "job_id": job_id,
+            "lane": data.get("lane"),
+            "agent": data.get("agent"),
+            "status": data.get("status"),
+            "outcome": outcome,
+            "started_at": trace.started_at,
+            "duration_ms": round((now - trace.started_at) * 1000, 3),
+            "spans": [
+                {"name": name, "start_ms": round(start * 1000, 3), "duration_ms": round(duration * 1000, 3)}
+                for name, start, duration in trace.spans
+            ],
+        }
+        self.finished += 1
+        if self.exporter is not None:
+            self.exporter.export(record)
+        return record
+
+    def add_hops(self, trace: Trace, message: dict, now: float) -> None:
+        """
+        Add the input queue, worker, output queue and delivery spans of a result.
+        Hops whose timestamps are missing are left out.
+        """
+        attributes = message.get("Attributes") or {}
+        input_sent = self._timestamp(message_attribute(message, INPUT_SENT_ATTRIBUTE))
+        input_received = self._timestamp(message_attribute(message, INPUT_RECEIVED_ATTRIBUTE))
+        output_sent = (self._timestamp(message_attribute(message, OUTPUT_SENT_ATTRIBUTE))
+                       or self._timestamp(attributes.get("SentTimestamp")))
+        output_received = self._timestamp(attributes.get("ApproximateFirstReceiveTimestamp"))
+
+        if input_sent and input_received:
+            trace.add_wall_span("input_queue", input_sent, input_received)
+            INPUT_QUEUE_SECONDS.observe(max(0.0, input_received - input_sent))
+        if input_received and output_sent:
+            trace.add_wall_span("worker", input_received, output_sent)
+            WORKER_SECONDS.observe(max(0.0, output_sent - input_received))
+        if output_sent and output_received:
+            trace.add_wall_span("output_queue", output_sent, output_received)
+            OUTPUT_QUEUE_SECONDS.observe(max(0.0, output_received - output_sent))
+        trace.add_wall_span("result_delivery", output_received or now, now)
+
+    @staticmethod
+    def _timestamp(value):
+        """
+        Epoch seconds from an SQS timestamp in milliseconds, or None.
+        """
+        try:
+            return int(value) / 1000 if value else None
+        except (TypeError, ValueError):
+            return None
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self.pending),
+            "finished": self.finished,
+            "evicted": self.evicted,
+            "exported": self.exporter.exported if self.exporter else 0,
+            "export_dropped": self.exporter.dropped if self.exporter else 0,
+        }
@@ -1,26 +1,21 @@
-from config import logger, S3_BUCKET_NAME, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION
+from config import logger, aws_clients, S3_BUCKET_NAME, AWS_REGION
 import os
 import uuid
-import boto3
 
-def upload_to_s3(file_paths):
+def upload_to_s3(file_paths, client=None):
         """
         Upload multiple files to S3 and return their S3 URLs.
 
         Args:
             file_paths (list): List of local file paths to upload.
+            client: Optional S3 client (e.g. LocalS3Client) to upload with.
 
         Returns:
             list: List of S3 URLs for the uploaded files.
         """
         s3_urls = []
         try:
-            s3_client = boto3.client(
-                's3',
-                aws_access_key_id=AWS_ACCESS_KEY_ID,
-                aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-                region_name=AWS_REGION
-            )
+            s3_client = client or aws_clients.s3()
 
             for local_file_path in file_paths:
                 s3_file_key = f"{uuid.uuid4()}_{os.path.basename(local_file_path)}"
@@ -31,10 +26,10 @@ def upload_to_s3(file_paths):
                 s3_url = f"https://web-extension-screenshots.s3.{AWS_REGION}.amazonaws.com/{s3_file_key}"
                 s3_urls.append(s3_url)
 
-                logger.info(f"Uploaded file to S3: {s3_file_key}")
+                logger.info("Uploaded file to S3: %s", s3_file_key)
 
         except Exception as e:
-            logger.error(f"Failed to upload files to S3: {e}")
+            logger.error("Failed to upload files to S3: %s", e)
             raise
 
         return s3_urls
\ No newline at end of file
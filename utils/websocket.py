@@ -4,28 +4,67 @@ import json
 import os
 import struct
 import shutil
-from config import WEBSOCKET_HOST, WEBSOCKET_PORT, logger
+import time
+from datetime import datetime
+from config import (
+    WEBSOCKET_HOST,
+    WEBSOCKET_PORT,
+    WS_PING_INTERVAL,
+    WS_PING_TIMEOUT,
+    WS_MAX_SIZE,
+    WS_MAX_QUEUE,
+    WS_READ_LIMIT,
+    WS_WRITE_LIMIT,
+    WS_COMPRESSION,
+    DEFAULT_JOB_MAX_AGE,
+    DRAIN_RECONNECT_DELAY,
+    JOB_HISTORY_MAX_LIMIT,
+    logger,
+)
 from trading_view_extension.routers.analysis_router import AnalysisRouter
 from trading_view_extension.managers.session_manager import SessionManager
+from trading_view_extension.managers.topic_manager import TopicManager
+from trading_view_extension.managers.admission_controller import AdmissionController
+from trading_view_extension.managers.load_shedder import LoadShedder
+from trading_view_extension.managers.cancellation_manager import CancellationManager
+from trading_view_extension.managers.result_streamer import ResultStreamer
+from utils.circuit_breaker import CircuitOpenError
+from utils.metrics import REGISTRY, STAGE_SECONDS
+from utils.tracing import Tracer
 import uuid
 
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-connected_users = {}
+FRAME_PARSE_SECONDS = STAGE_SECONDS.labels("frame_parse")
+DISK_SPOOL_SECONDS = STAGE_SECONDS.labels("disk_spool")
+CONNECTIONS_TOTAL = REGISTRY.counter("gateway_connections_total", "WebSocket connections accepted.")
 
 class WebSocketServer:
-    def __init__(self, analysis_router : AnalysisRouter , session_manager: SessionManager):
+    def __init__(self, analysis_router : AnalysisRouter , session_manager: SessionManager,
+                 topic_manager: TopicManager = None, admission_controller: AdmissionController = None,
+                 load_shedder: LoadShedder = None, cancellation_manager: CancellationManager = None,
+                 tracer: Tracer = None, result_streamer: ResultStreamer = None):
         """
         Initializes the WebSocketServer with an AnalysisRouter instance.
         """
         self.analysis_router = analysis_router
         self.ssm = session_manager
+        self.topic_manager = topic_manager
+        self.admission_controller = admission_controller
+        self.load_shedder = load_shedder
+        self.cancellation_manager = cancellation_manager
+        self.tracer = tracer
+        self.result_streamer = result_streamer
+        self.ws_server = None    # websockets server, set while run() is serving
+        self.draining = False    # Set by stop_accepting(); new uploads are refused
+        self.pipelines = 0       # Uploads currently between parsing and publishing
 
     async def handle_connection(self, websocket, path=None):
         """
         Handles a new WebSocket connection, processes incoming messages, and manages cleanup.
         """
+        CONNECTIONS_TOTAL.inc()
         try:
             async for message in websocket:
                 if isinstance(message, bytes):
@@ -35,8 +74,8 @@ class WebSocketServer:
         except websockets.exceptions.ConnectionClosed:
             logger.info("Client disconnected")
         except Exception as e:
-            logger.error(f"Error handling connection: {e}")
-        # finally:
+            logger.error("Error handling connection: %s", e)
+        finally:
             await self.cleanup(websocket)
 
     async def process_binary_message(self, websocket, message):
@@ -45,6 +84,45 @@ class WebSocketServer:
         We will parse each image, but only after parsing them all, we create a single 'job' that
         references all images at once.
         """
+        if self.draining:
+            await websocket.send(json.dumps({
+                "type": "error",
+                "code": "draining",
+                "retry_after": DRAIN_RECONNECT_DELAY,
+                "message": "Server is restarting; reconnect and resubmit.",
+            }))
+            return
+        if self.load_shedder:
+            # Shed load before doing any work: degraded dependencies or too many pipelines
+            rejection = self.load_shedder.try_acquire()
+            if rejection:
+                await websocket.send(json.dumps(rejection))
+                return
+        self.pipelines += 1
+        try:
+            await self._process_binary_message(websocket, message)
+        finally:
+            self.pipelines -= 1
+            if self.load_shedder:
+                self.load_shedder.release()
+
+    async def _process_binary_message(self, websocket, message):
+        """
+        Body of process_binary_message, run while holding a pipeline slot.
+        """
+        job_id = str(uuid.uuid4())
+        if self.admission_controller:
+            # Decide from the first image's metadata, before anything is written to disk
+            first_metadata = self.peek_metadata(message)
+            if first_metadata is not None:
+                rejection = self.admission_controller.try_admit(
+                    first_metadata.get("user_id"), first_metadata.get("tab_id"), job_id
+                )
+                if rejection:
+                    logger.info("Rejected job for user=%s: %s", first_metadata.get('user_id'), rejection['code'])
+                    await websocket.send(json.dumps(rejection))
+                    return
+
         offset = 0
         total_length = len(message)
 
@@ -58,7 +136,11 @@ class WebSocketServer:
         user_id = None  # track userId from the first chunk
         tab_id = None   # track tabId from the first chunk
         agent = None    # track agent from the first chunk
+        expires_at = None  # absolute deadline from the first chunk, if any
 
+        trace = None
+        parse_started = time.perf_counter()
+        spool_seconds = 0.0
         while offset < total_length:
             # 1) We must have 4 bytes for metadata length
             if offset + 4 > total_length:
@@ -98,7 +180,9 @@ class WebSocketServer:
                     "tab_id": tab_id,
                     "user_id": user_id,
                     "action_type": metadata.get("action_type", "analysis"),
+                    "user_tier": metadata.get("user_tier"),
                 }
+                expires_at = self.job_expiry(metadata)
 
             # 5) Make sure we have blob_size
             blob_size = metadata.get("blob_size")
@@ -118,23 +202,48 @@ class WebSocketServer:
             offset += blob_size
 
             # 8) Save the file
+            spool_started = time.perf_counter()
             file_path = self.save_file(metadata, binary_data)
+            spooled = time.perf_counter() - spool_started
+            spool_seconds += spooled
+            DISK_SPOOL_SECONDS.observe(spooled)
 
             # Collect for single-job usage
             images_file_paths.append(file_path)
             images_filenames.append(metadata.get("filename", "unknown"))
 
             # We do NOT call create_analysis() here. We'll do it after the loop.
+        parse_seconds = time.perf_counter() - parse_started - spool_seconds
+        FRAME_PARSE_SECONDS.observe(parse_seconds)
 
         # ------------------------------------------------------
         # AFTER we've parsed all images, create a single job/record
         # that references all images
         # ------------------------------------------------------
-        if images_file_paths:
+        if images_file_paths and expires_at is not None and expires_at <= time.time():
+            # Already too late; don't spend an upload and an analysis on it
+            logger.info("Rejected job for user=%s: deadline already passed", user_id)
+            if self.admission_controller:
+                self.admission_controller.release(job_id)
+            await websocket.send(json.dumps({
+                "type": "error",
+                "code": "deadline_exceeded",
+                "retry_after": 0,
+                "message": "The job's deadline passed before it could be submitted.",
+            }))
+        elif images_file_paths:
             # For example, we can call a new method like create_analysis_batch()
             # or reuse create_analysis with a custom approach. Let's show a new method:
 
+            if self.tracer:
+                trace = self.tracer.start(job_id, started=parse_started)
+                if trace is not None:
+                    # Parsing and spooling interleave per image; recorded back to back
+                    trace.add_span("frame_parse", parse_started, parse_seconds)
+                    trace.add_span("disk_spool", parse_started + parse_seconds, spool_seconds)
             try:
+                # Clients that skipped the handshake get a session implicitly
+                websocket_id, _ = self.ssm.open_session(websocket, user_id=user_id, tab_id=tab_id)
                 # Build a dictionary representing the "job" or "analysis" that includes multiple images
                 job_data = {
                     "asset": asset,
@@ -144,16 +253,19 @@ class WebSocketServer:
                     "action_type": common_metadata.get("action_type"),
                     "filenames": images_filenames,       # array of just the names
                     "file_paths": images_file_paths,     # array of actual saved paths
-                    "job_id": str(uuid.uuid4()),  # will be generated
+                    "job_id": job_id,
                     "status": "PENDING",
-                    "websocket_id": id(websocket),
+                    "websocket_id": websocket_id,
+                    "expires_at": expires_at,
+                    "user_tier": common_metadata.get("user_tier"),
+                    "trace": trace,
                     # you can add more fields as desired
                 }
 
                 # Example: Suppose your analysis_router has a method create_analysis_batch
                 # that expects a dictionary with "job_data" containing multiple images.
                 # If you only have create_analysis, you can extend it or create a new one.
-                self.ssm.register_websocket(str(id(websocket)),websocket)
+                self.ssm.bind_job(websocket_id, job_data["job_id"])
                 await self.analysis_router.create_analysis(job_data)
                 # Send a single response to confirm the entire batch was processed
                 await websocket.send(json.dumps({
@@ -163,23 +275,223 @@ class WebSocketServer:
                     "agent": agent,
                 }))
             except Exception as e:
-                logger.error(f"Failed to process multiple images for user={user_id}: {e}")
-                await websocket.send("Error: Failed to process multiple files in batch.")
+                logger.error("Failed to process multiple images for user=%s: %s", user_id, e)
+                self.ssm.release_job(job_id)
+                if self.tracer:
+                    self.tracer.discard(trace)
+                if self.admission_controller:
+                    self.admission_controller.release(job_id)
+                if isinstance(e, CircuitOpenError):
+                    # A breaker opened while the upload was under way; same answer as shedding it up front
+                    await websocket.send(json.dumps(LoadShedder.degraded_rejection(e.retry_after)))
+                else:
+                    await websocket.send("Error: Failed to process multiple files in batch.")
+        elif self.admission_controller:
+            self.admission_controller.release(job_id)
+
+    @staticmethod
+    def peek_metadata(message):
+        """
+        Parse the metadata of the first image in a binary message, or return None
+        if it is malformed (the full parse reports the error to the client).
+        """
+        if len(message) < 4:
+            return None
+        metadata_length = struct.unpack('>I', message[:4])[0]
+        if 4 + metadata_length > len(message):
+            return None
+        try:
+            metadata = json.loads(message[4 : 4 + metadata_length].decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            return None
+        return metadata if isinstance(metadata, dict) else None
+
+    @staticmethod
+    def job_expiry(metadata, now=None):
+        """
+        Work out a job's absolute expiry from its upload metadata.
+
+        "deadline" is an epoch timestamp (seconds, or milliseconds as produced by
+        JavaScript's Date.now()); "max_age" is a number of seconds from now. When
+        both are given the earlier one wins; with neither, DEFAULT_JOB_MAX_AGE applies.
+
+        Returns:
+            The expiry in epoch seconds, or None if the job has no deadline.
+        """
+        now = time.time() if now is None else now
+        candidates = []
+        deadline = metadata.get("deadline")
+        if isinstance(deadline, (int, float)) and not isinstance(deadline, bool):
+            candidates.append(deadline / 1000 if deadline > 1e11 else float(deadline))
+        max_age = metadata.get("max_age", DEFAULT_JOB_MAX_AGE or None)
+        if isinstance(max_age, (int, float)) and not isinstance(max_age, bool) and max_age > 0:
+            candidates.append(now + max_age)
+        return min(candidates) if candidates else None
 
     async def process_text_message(self, websocket, message):
         """
-        Processes text messages, typically containing user identification or "handshake" data.
+        Processes text messages: commands ("job_history", "subscribe", "unsubscribe",
+        "cancel", "fetch_result") or, without a command, user identification /
+        "handshake" data.
         """
         try:
             data = json.loads(message)
-            logger.info(
-                f"New connection established for userId: {data.get('user_id', 'unknown')} "
-                f"with tabId: {data.get('tab_id', 'unknown')}"
-            )
-            await websocket.send("Connection established.")
         except json.JSONDecodeError:
-            logger.warning(f"Invalid text message: {message}")
+            data = None
+        if not isinstance(data, dict):
+            logger.warning("Invalid text message: %s", message)
             await websocket.send("Error: Invalid JSON format.")
+            return
+
+        command = data.get("command")
+        if command == "job_history":
+            await self.handle_job_history(websocket, data)
+        elif command in ("subscribe", "unsubscribe") and self.topic_manager:
+            await self.handle_subscription(websocket, command, data)
+        elif command == "cancel" and self.cancellation_manager:
+            await self.handle_cancel(websocket, data)
+        elif command == "fetch_result" and self.result_streamer:
+            await self.handle_fetch_result(websocket, data)
+        else:
+            await self.handle_handshake(websocket, data)
+
+    async def handle_handshake(self, websocket, data):
+        """
+        Identifies the connection and attaches it to a new or resumed session.
+        """
+        logger.info(
+            "New connection established for userId: %s with tabId: %s",
+            data.get('user_id', 'unknown'), data.get('tab_id', 'unknown')
+        )
+        # Reconnecting clients present the session id and resume token they were issued
+        websocket_id, resumed = self.ssm.open_session(
+            websocket,
+            user_id=data.get("user_id"),
+            tab_id=data.get("tab_id"),
+            session_id=data.get("session_id"),
+            resume_token=data.get("resume_token"),
+        )
+        await websocket.send("Connection established.")
+        await websocket.send(json.dumps({
+            "type": "session",
+            "session_id": websocket_id,
+            "resume_token": self.ssm.resume_token_for(websocket_id),
+            "resumed": resumed,
+        }))
+        if resumed:
+            if self.cancellation_manager:
+                self.cancellation_manager.on_resume(websocket_id)
+            replay = self.ssm.drain_replay(websocket_id)
+            for result in replay:
+                # Buffered results are not sent again if dropped now
+                self.ssm.send(websocket_id, result, essential=True)
+            if replay:
+                logger.info("Replayed %d buffered results to session %s", len(replay), websocket_id)
+
+    async def handle_job_history(self, websocket, data):
+        """
+        Streams the job history of the session's user (see AnalysisRouter.stream_job_history).
+        The user comes from the handshake, never from the request.
+        """
+        session = self.ssm.get_session(self.ssm.session_id_for(websocket))
+        if session is None or session.user_id is None:
+            await websocket.send(json.dumps({
+                "type": "error",
+                "code": "handshake_required",
+                "message": "Identify with a handshake before requesting job history.",
+            }))
+            return
+        limit = data.get("limit", JOB_HISTORY_MAX_LIMIT)
+        cursor = data.get("cursor")
+        problem = self.history_request_problem(limit, cursor)
+        if problem:
+            await websocket.send(json.dumps({"type": "error", "code": "invalid_request", "message": problem}))
+            return
+        try:
+            await self.analysis_router.stream_job_history(websocket, session.user_id, cursor=cursor, limit=limit)
+        except websockets.exceptions.ConnectionClosed:
+            raise
+        except Exception as e:
+            logger.error("Failed to stream job history for user=%s: %s", session.user_id, e)
+            await websocket.send("Error: Failed to fetch job history.")
+
+    @staticmethod
+    def history_request_problem(limit, cursor):
+        """
+        Check the "limit" and "cursor" of a job_history request.
+
+        Returns:
+            None if they are valid, otherwise a message for the client.
+        """
+        if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= JOB_HISTORY_MAX_LIMIT:
+            return f"'limit' must be an integer between 1 and {JOB_HISTORY_MAX_LIMIT}."
+        if cursor is None:
+            return None
+        if not isinstance(cursor, dict) or not isinstance(cursor.get("created_at"), str) \
+                or not isinstance(cursor.get("job_id"), str):
+            return "'cursor' must be the 'next_cursor' of a previous response."
+        try:
+            datetime.fromisoformat(cursor["created_at"])
+        except ValueError:
+            return "'cursor' must be the 'next_cursor' of a previous response."
+        return None
+
+    async def handle_subscription(self, websocket, command, data):
+        """
+        Subscribes the session to, or unsubscribes it from, asset topics.
+        """
+        assets = data.get("assets")
+        if assets is not None and (not isinstance(assets, list)
+                                   or not all(isinstance(asset, str) and asset for asset in assets)):
+            await websocket.send(json.dumps({
+                "type": "error",
+                "code": "invalid_request",
+                "message": "'assets' must be a list of asset symbols.",
+            }))
+            return
+        websocket_id = self.ssm.session_id_for(websocket)
+        if websocket_id is None:
+            websocket_id, _ = self.ssm.open_session(websocket, user_id=data.get("user_id"))
+        assets = assets or []
+        if command == "subscribe":
+            topics = self.topic_manager.subscribe(websocket_id, assets, compress=bool(data.get("compress")))
+            if topics is None:
+                await websocket.send(json.dumps({
+                    "type": "error",
+                    "code": "too_many_subscriptions",
+                    "message": f"A session may subscribe to at most {self.topic_manager.max_topics} assets.",
+                }))
+                return
+        else:
+            topics = self.topic_manager.unsubscribe(websocket_id, assets or None)
+        await websocket.send(json.dumps({
+            "type": "subscriptions",
+            "assets": topics,
+            # Binary zlib frames, or text frames (compressed by permessage-deflate if negotiated)
+            "compressed": [asset for asset in topics if self.topic_manager.compresses(websocket_id, asset)],
+        }))
+
+    async def handle_cancel(self, websocket, data):
+        """
+        Cancels a job submitted from this session or another tab of the same user.
+        """
+        job_id = data.get("job_id")
+        session = self.ssm.get_session(self.ssm.session_id_for(websocket))
+        owner = self.ssm.get_session_for_job(job_id)
+        allowed = session is not None and owner is not None and (
+            owner is session or (owner.user_id is not None and owner.user_id == session.user_id)
+        )
+        cancelled = allowed and await self.cancellation_manager.cancel(job_id)
+        await websocket.send(json.dumps({"type": "cancel", "job_id": job_id, "cancelled": bool(cancelled)}))
+
+    async def handle_fetch_result(self, websocket, data):
+        """
+        (Re)starts streaming a claim-check result from "offset", e.g. after a reconnect.
+        """
+        session = self.ssm.get_session(self.ssm.session_id_for(websocket))
+        rejection = self.result_streamer.fetch(session, data.get("job_id"), data.get("offset", 0))
+        if rejection:
+            await websocket.send(json.dumps(rejection))
 
     def save_file(self, metadata, binary_data):
         """
@@ -213,25 +525,81 @@ class WebSocketServer:
 
     async def cleanup(self, websocket):
         """
-        Cleans up resources and deletes the user's upload directory upon disconnection.
+        Detaches the session (keeping it resumable), schedules cancellation of its
+        in-flight jobs if CANCEL_ON_DISCONNECT is enabled, and deletes the user's
+        upload directory once the user's last tab has disconnected.
         """
-        if websocket in connected_users:
-            user_id = connected_users[websocket]
-            user_dir = os.path.join(UPLOAD_DIR, str(user_id))
-            if os.path.exists(user_dir):
-                try:
-                    shutil.rmtree(user_dir)
-                    logger.info(f"Deleted user directory: {user_dir}")
-                except Exception as e:
-                    logger.error(f"Error deleting user directory {user_dir}: {e}")
-            del connected_users[websocket]
+        session = self.ssm.detach_websocket(websocket)
+        if session is not None and self.cancellation_manager and not self.draining:
+            # While draining the client is told to reconnect elsewhere; its jobs keep running
+            # Otherwise in-flight jobs are cancelled (if enabled) unless the tab reconnects
+            # within the grace period
+            self.cancellation_manager.schedule_disconnect_cancel(session.websocket_id)
+        if session is None or session.user_id is None:
+            return
+        if self.ssm.get_user_websockets(session.user_id):
+            return  # Other tabs of this user are still connected
+        user_dir = os.path.join(UPLOAD_DIR, str(session.user_id))
+        if os.path.exists(user_dir):
+            try:
+                shutil.rmtree(user_dir)
+                logger.info("Deleted user directory: %s", user_dir)
+            except Exception as e:
+                logger.error("Error deleting user directory %s: %s", user_dir, e)
 
-    async def run(self):
+    @staticmethod
+    def serve_options():
+        """
+        Per-connection buffer limits and keepalive settings passed to websockets.serve().
+        """
+        return {
+            "ping_interval": WS_PING_INTERVAL,  # Keepalive pings detect and evict dead peers
+            "ping_timeout": WS_PING_TIMEOUT,
+            "max_size": WS_MAX_SIZE,
+            "max_queue": WS_MAX_QUEUE,
+            "read_limit": WS_READ_LIMIT,
+            "write_limit": WS_WRITE_LIMIT,
+            "compression": WS_COMPRESSION,
+        }
+
+    async def run(self, reuse_port=False, host=WEBSOCKET_HOST, port=WEBSOCKET_PORT):
         """
         Starts the WebSocket server and listens for incoming connections indefinitely.
+
+        Args:
+            reuse_port: Bind with SO_REUSEPORT so several worker processes can share the port.
+            host: Interface to listen on.
+            port: Port to listen on.
+        """
+        async with websockets.serve(self.handle_connection, host, port, reuse_port=reuse_port,
+                                    **self.serve_options()) as ws_server:
+            self.ws_server = ws_server
+            logger.info(f"WebSocket server running on ws://{host}:{port}")
+            await ws_server.wait_closed()  # Until close_connections() after a drain
+        logger.info("WebSocket server stopped")
+
+    def stop_accepting(self):
+        """
+        Start draining: close the listening socket, so new connections go to other
+        processes sharing the port (or the next deployment), and refuse new uploads
+        on open connections. Results and commands keep flowing.
+        """
+        self.draining = True
+        if self.ws_server is not None:
+            self.ws_server.server.close()  # Listener only; open connections stay up
+        logger.info("Stopped accepting connections and uploads")
+
+    async def close_connections(self, code=1012, reason="Service restart"):
+        """
+        Close every open connection with `code` (1012: service restart) and stop the server.
         """
-        async with websockets.serve(self.handle_connection, WEBSOCKET_HOST, WEBSOCKET_PORT):
-            logger.info(f"WebSocket server running on ws://{WEBSOCKET_HOST}:{WEBSOCKET_PORT}")
-            await asyncio.Future()  # Run forever
+        if self.ws_server is None:
+            return
+        connections = list(self.ws_server.websockets)
+        await asyncio.gather(*(websocket.close(code, reason) for websocket in connections),
+                             return_exceptions=True)
+        self.ws_server.close()
+        await self.ws_server.wait_closed()
+        logger.info(f"Closed {len(connections)} connections with code {code}")
 
 